@@ -0,0 +1,65 @@
+"""
+Measure how quickly check results are encoded for publishing.
+
+    $ python benchmarks/encode_results.py --count 1000000
+
+"asdict" is the original json.dumps(dataclasses.asdict(results)), the others
+are the encoders available to publishers (see httpcheck.encoders).
+"""
+import argparse
+import dataclasses
+import json
+import time
+
+from httpcheck import encoders
+from httpcheck.common import WebsiteCheckResults
+from httpcheck.common import WebsiteMonitorConfig
+
+
+def encode_asdict(results):
+    return json.dumps(dataclasses.asdict(results)).encode("utf8")
+
+
+def make_results():
+    config = WebsiteMonitorConfig("https://example.com/health", regex="ok")
+    results = WebsiteCheckResults.from_config(config)
+    results.is_online = True
+    results.status_code = 200
+    results.response_time = 0.123456789
+    results.regex_found = True
+    results.bytes_read = 2
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--count", type=int, default=1000000)
+    args = parser.parse_args()
+
+    results = make_results()
+    candidates = {"asdict": encode_asdict}
+    for name in encoders.ENCODERS:
+        try:
+            candidates[name] = encoders.get_encoder(name)
+        except RuntimeError:
+            pass
+
+    for name, encode in candidates.items():
+        start = time.perf_counter()
+        for _ in range(args.count):
+            encode(results)
+        elapsed = time.perf_counter() - start
+        print(
+            json.dumps(
+                {
+                    "encoder": name,
+                    "count": args.count,
+                    "seconds": round(elapsed, 3),
+                    "results_per_second": round(args.count / elapsed),
+                }
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Measure the memory used per monitor config and per check result.
+
+    $ python benchmarks/memory_per_record.py --count 100000
+
+Compares the slotted records in httpcheck.common with equivalent regular
+dataclasses, which keep a __dict__ per instance. Field values are shared
+between instances, so only the size of the records themselves is measured.
+"""
+import argparse
+import dataclasses
+import json
+import tracemalloc
+
+from httpcheck.common import WebsiteCheckResults
+from httpcheck.common import WebsiteMonitorConfig
+
+
+def unslotted(cls, frozen=False):
+    fields = [(f.name, f.type, f) for f in dataclasses.fields(cls)]
+    return dataclasses.make_dataclass(f"Unslotted{cls.__name__}", fields, frozen=frozen)
+
+
+def bytes_per_instance(factory, count):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    instances = [factory() for _ in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del instances
+    return (after - before) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--count", type=int, default=100000)
+    args = parser.parse_args()
+
+    config = WebsiteMonitorConfig("https://example.com/health", regex="ok")
+    results = WebsiteCheckResults.from_config(config)
+    config_kwargs = config.as_dict()
+    results_kwargs = results.as_dict()
+    UnslottedConfig = unslotted(WebsiteMonitorConfig, frozen=True)
+    UnslottedResults = unslotted(WebsiteCheckResults)
+
+    measurements = {
+        "config_slotted": lambda: WebsiteMonitorConfig(**config_kwargs),
+        "config_dict": lambda: UnslottedConfig(**config_kwargs),
+        "results_slotted": lambda: WebsiteCheckResults(**results_kwargs),
+        "results_dict": lambda: UnslottedResults(**results_kwargs),
+    }
+    report = {
+        f"{name}_bytes": round(bytes_per_instance(factory, args.count))
+        for name, factory in measurements.items()
+    }
+    print(json.dumps(report))
+
+
+if __name__ == "__main__":
+    main()
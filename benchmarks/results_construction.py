@@ -0,0 +1,61 @@
+"""
+Measure how many check results can be constructed per second.
+
+    $ python benchmarks/results_construction.py
+
+"before" repeats the per-result hostname and timezone lookups that
+WebsiteCheckResults.from_config used to make, "after" uses the cached ones.
+The hostname lookup depends on the local resolver, so results vary by host.
+"""
+import argparse
+import datetime
+import json
+import socket
+import time
+
+import pytz
+
+from httpcheck.common import WebsiteCheckResults
+from httpcheck.common import WebsiteMonitorConfig
+
+
+def from_config_uncached(config):
+    timezone = pytz.timezone(config.timezone)
+    return WebsiteCheckResults(
+        url=config.url,
+        timestamp=datetime.datetime.now(timezone).isoformat(),
+        method=config.method,
+        identifier=config.identifier,
+        regex=config.regex,
+        hostname=socket.getfqdn(),
+    )
+
+
+def results_per_second(fn, config, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        fn(config)
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--count", type=int, default=20000)
+    args = parser.parse_args()
+
+    config = WebsiteMonitorConfig("http://example.com", timezone="Europe/Berlin")
+    before = results_per_second(from_config_uncached, config, args.count)
+    after = results_per_second(WebsiteCheckResults.from_config, config, args.count)
+    print(
+        json.dumps(
+            {
+                "before_results_per_second": round(before),
+                "after_results_per_second": round(after),
+                "speedup": round(after / before, 1),
+            }
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Compare the scheduler backends: job-add throughput and timer drift.
+
+    $ python benchmarks/scheduler_backends.py --sizes 1000 10000 100000
+
+Drift is how late each run starts compared to its intended time on the grid
+of (first run + n * frequency). Jobs are staggered evenly so that the load is
+spread across the period, as recommended for large inventories.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import time
+
+from httpcheck import scheduler
+from httpcheck.common import WebsiteMonitorConfig
+
+
+def make_configs(count, frequency):
+    return [
+        WebsiteMonitorConfig(f"http://{i}.example.com/", frequency=frequency)
+        for i in range(count)
+    ]
+
+
+def bench_add(backend_name, configs):
+    async def job_fn(config):
+        pass
+
+    job_scheduler = scheduler.Scheduler(
+        job_fn, backend=scheduler.make_backend(backend_name), stagger="even"
+    )
+    start = time.perf_counter()
+    for config in configs:
+        job_scheduler.schedule(config)
+    elapsed = time.perf_counter() - start
+    return len(configs) / elapsed
+
+
+async def bench_drift(backend_name, configs, duration):
+    frequency = configs[0].frequency
+    # Even staggering puts the first run of the nth job at a known offset
+    offsets = {
+        config.url: scheduler.van_der_corput(index) * frequency
+        for index, config in enumerate(configs)
+    }
+    lateness = []
+
+    async def job_fn(config):
+        late = (time.monotonic() - started - offsets[config.url]) % frequency
+        lateness.append(late if late < frequency / 2 else late - frequency)
+
+    job_scheduler = scheduler.Scheduler(
+        job_fn, backend=scheduler.make_backend(backend_name), stagger="even"
+    )
+    started = time.monotonic()
+    for config in configs:
+        job_scheduler.schedule(config)
+    job_scheduler.start()
+    await asyncio.sleep(duration)
+    job_scheduler.stop()
+
+    if not lateness:
+        # Every run was missed, eg. the backend was still busy starting up
+        return {"runs": 0}
+    lateness.sort()
+    return {
+        "runs": len(lateness),
+        "drift_p50_ms": round(1000 * statistics.median(lateness), 1),
+        "drift_p99_ms": round(1000 * lateness[int(len(lateness) * 0.99)], 1),
+        "drift_max_ms": round(1000 * lateness[-1], 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--backends", nargs="+", default=sorted(scheduler.BACKENDS))
+    parser.add_argument("--frequency", type=float, default=5)
+    parser.add_argument("--duration", type=float, default=12)
+    args = parser.parse_args()
+    # APScheduler logs every missed run, which would drown out the results
+    logging.getLogger("apscheduler").setLevel(logging.ERROR)
+
+    for size in args.sizes:
+        configs = make_configs(size, args.frequency)
+        for backend_name in args.backends:
+            adds_per_second = bench_add(backend_name, configs)
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            drift = loop.run_until_complete(
+                bench_drift(backend_name, configs, args.duration)
+            )
+            loop.close()
+            result = {
+                "backend": backend_name,
+                "monitors": size,
+                "adds_per_second": round(adds_per_second),
+                **drift,
+            }
+            print(json.dumps(result), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Measure how long it takes to load and schedule a large websites inventory.
+
+    $ python benchmarks/startup_time.py --count 100000
+
+Reports the time until the first monitor is scheduled, the time until all
+of them are, and the peak memory allocated while loading, for a JSON file and
+for the same monitors as JSON Lines.
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from httpcheck import scheduler
+from httpcheck.main import MonitorManager
+
+
+def write_inventories(directory, count):
+    websites = {
+        f"monitor-{i}": {"url": f"https://{i}.example.com/health", "frequency": 300}
+        for i in range(count)
+    }
+    json_filename = os.path.join(directory, "websites.json")
+    with open(json_filename, "w") as f:
+        json.dump(websites, f)
+
+    jsonl_filename = os.path.join(directory, "websites.jsonl")
+    with open(jsonl_filename, "w") as f:
+        for key, config in websites.items():
+            f.write(json.dumps({"key": key, **config}) + "\n")
+    return {"json": json_filename, "jsonl": jsonl_filename}
+
+
+async def measure_startup(filename):
+    async def job_fn(config):
+        pass
+
+    job_scheduler = scheduler.Scheduler(
+        job_fn, backend=scheduler.NativeBackend(), stagger="hash"
+    )
+    manager = MonitorManager(
+        monitor_configs={}, scheduler=job_scheduler, websites_filename=filename
+    )
+    first_scheduled = None
+
+    def start_monitor(config):
+        nonlocal first_scheduled
+        if first_scheduled is None:
+            first_scheduled = time.perf_counter()
+        job_scheduler.schedule(config)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    await manager.load_monitors(start_monitor)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "first_scheduled_seconds": round(first_scheduled - start, 3),
+        "all_scheduled_seconds": round(elapsed, 3),
+        "peak_allocated_mb": round(peak / 2 ** 20, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--count", type=int, default=100000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for file_format, filename in write_inventories(directory, args.count).items():
+            result = asyncio.run(measure_startup(filename))
+            print(json.dumps({"format": file_format, "monitors": args.count, **result}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Adapt when each monitor is next checked to what its last checks found.
+
+ * When a website goes down or comes back up, it is checked again sooner (after
+   `confirm_interval` seconds) to confirm the change rather than a flap.
+ * While a website stays down, the delay between checks doubles up to
+   `max_backoff` seconds, which bounds how long a recovery goes unnoticed.
+ * A 429 or 503 response with a Retry-After header is not checked again
+   before then (up to `max_backoff` seconds).
+
+Otherwise monitors are checked at their regular frequency.
+"""
+import dataclasses
+import typing
+
+from . import common
+
+# Status codes for which the Retry-After header is respected
+RETRY_AFTER_STATUS_CODES = (429, 503)
+
+
+@dataclasses.dataclass
+class MonitorState:
+    is_online: typing.Optional[bool] = None
+    failures: int = 0
+    confirming: int = 0
+
+
+class AdaptivePolicy:
+    @dataclasses.dataclass(frozen=True)
+    class Config:
+        confirm_interval: float = 10
+        confirm_checks: int = 1
+        backoff_factor: float = 2
+        max_backoff: float = 900
+
+    def __init__(self, config=None):
+        self.config = common.build_config(self.Config, config or {})
+        self._states = {}
+
+    def forget(self, job_id):
+        self._states.pop(job_id, None)
+
+    def next_delay(self, job_id, monitor_config, results):
+        """ Seconds until the next check, or None for the regular schedule. """
+        state = self._states.setdefault(job_id, MonitorState())
+        is_online = bool(results.is_online)
+        if state.is_online is not None and is_online != state.is_online:
+            state.confirming = self.config.confirm_checks
+        state.is_online = is_online
+        state.failures = 0 if is_online else state.failures + 1
+
+        frequency = monitor_config.frequency
+        max_delay = max(self.config.max_backoff, frequency)
+        delay = None
+        if state.confirming:
+            state.confirming -= 1
+            delay = min(self.config.confirm_interval, frequency)
+        elif state.failures > 1:
+            backoff = frequency * self.config.backoff_factor ** (state.failures - 1)
+            delay = min(backoff, max_delay)
+
+        retry_after = results.retry_after
+        if retry_after is not None and results.status_code in RETRY_AFTER_STATUS_CODES:
+            wait = min(retry_after, max_delay)
+            if wait > (frequency if delay is None else delay):
+                delay = wait
+        return delay
@@ -0,0 +1,342 @@
+"""
+Benchmark httpcheck end to end, against a stand-in HTTP server on localhost.
+
+    $ httpcheck-bench --monitors 5000 --frequency 10 --duration 60
+
+The target server runs in its own process, with configurable latency, body
+size, failure rate and dropped connections, so that the measurements below
+only include httpcheck itself:
+
+ * checks_per_second: completed checks, over the measured duration
+ * lag_p50_ms, lag_p99_ms: how late checks start compared to their schedule
+   (including any wait for a concurrency slot)
+ * cpu_ms_per_check: process CPU time (user + system) per completed check
+ * rss_mb, max_rss_mb: resident memory at the end, and its peak
+ * fds, max_fds: open file descriptors at the end, and their peak
+
+The results are printed as a JSON object, to track them between releases.
+"""
+import asyncio
+import dataclasses
+import functools
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import time
+
+import click
+
+from . import clients
+from . import limits
+from . import main
+from . import publishers
+from . import scheduler
+from . import websitecheck
+from .common import WebsiteMonitorConfig
+from .decorators import help_messages
+from .stats import percentile
+
+# Seconds between samples of the memory and file descriptor usage
+SAMPLE_INTERVAL = 0.5
+
+
+@dataclasses.dataclass(frozen=True)
+class TargetConfig:
+    latency: float = 0.05
+    body_size: int = 1024
+    failure_rate: float = 0.0
+    drop_rate: float = 0.0
+    seed: int = 0
+
+
+async def serve_target(config, ready):
+    """ Serve keep-alive HTTP/1.1 responses, calling ready(port) once listening. """
+    rand = random.Random(config.seed)
+    body = b"x" * config.body_size
+
+    async def respond(reader, writer):
+        try:
+            while True:
+                request = await reader.readuntil(b"\r\n\r\n")
+                if rand.random() < config.drop_rate:
+                    break
+                await asyncio.sleep(config.latency)
+                status = "503 Service Unavailable"
+                if rand.random() >= config.failure_rate:
+                    status = "200 OK"
+                head = f"HTTP/1.1 {status}\r\nContent-Length: {len(body)}\r\n\r\n"
+                writer.write(head.encode("ascii"))
+                if not request.startswith(b"HEAD "):
+                    writer.write(body)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(respond, "127.0.0.1", 0, backlog=1024)
+    ready(server.sockets[0].getsockname()[1])
+    async with server:
+        await server.serve_forever()
+
+
+def run_target(config, conn):
+    """ The entry point of the target server process. """
+    asyncio.run(serve_target(config, conn.send))
+
+
+def start_target(config):
+    context = multiprocessing.get_context("spawn")
+    read_conn, write_conn = context.Pipe(duplex=False)
+    process = context.Process(target=run_target, args=(config, write_conn))
+    process.daemon = True
+    process.start()
+    return process, read_conn.recv()
+
+
+def make_monitor_configs(port, count, frequency, method):
+    return {
+        f"monitor-{i}": WebsiteMonitorConfig(
+            url=f"http://127.0.0.1:{port}/{i}",
+            key=f"monitor-{i}",
+            method=method,
+            frequency=frequency,
+            retries=0,
+        )
+        for i in range(count)
+    }
+
+
+class NullPublisher(publishers.BasePublisher):
+    """ Encode the results as usual, but do not write them anywhere. """
+
+    key = "null"
+
+    def write_batch(self, msgs):
+        pass
+
+
+class Measurements:
+    def __init__(self):
+        self.lags = []
+        self.online = 0
+        self.offline = 0
+        self.max_rss = 0
+        self.max_fds = 0
+
+    @property
+    def checks(self):
+        return self.online + self.offline
+
+    def add_lag(self, config):
+        # Hash staggering anchors the schedule of each monitor to the wall clock
+        phase = scheduler.hash_fraction(scheduler.get_job_id(config)) * config.frequency
+        lag = (time.time() - phase) % config.frequency
+        self.lags.append(lag if lag < config.frequency / 2 else lag - config.frequency)
+
+    def add_results(self, results):
+        if results.is_online:
+            self.online += 1
+        else:
+            self.offline += 1
+
+    def sample(self):
+        self.max_rss = max(self.max_rss, get_rss())
+        self.max_fds = max(self.max_fds, get_fd_count())
+
+
+def get_rss():
+    """ Resident memory of this process in bytes, or 0 if unknown. """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return 0
+
+
+def get_fd_count():
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return 0
+
+
+def get_cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+async def check_and_measure(config, measurements, publisher, client_pool):
+    measurements.add_lag(config)
+    results = await websitecheck.run(config, client_pool=client_pool)
+    measurements.add_results(results)
+    await publisher.submit_results(results)
+    return results
+
+
+async def sample_periodically(measurements):
+    while True:
+        measurements.sample()
+        await asyncio.sleep(SAMPLE_INTERVAL)
+
+
+async def run_benchmark(
+    monitor_configs,
+    duration,
+    warmup,
+    pool_config=None,
+    limiter_config=None,
+    scheduler_backend=scheduler.DEFAULT_BACKEND,
+):
+    measurements = Measurements()
+    publisher = NullPublisher({"queue_size": 10000})
+    client_pool = clients.ClientPool(pool_config)
+    job_fn = functools.partial(
+        check_and_measure,
+        measurements=measurements,
+        publisher=publisher,
+        client_pool=client_pool,
+    )
+    manager = main.MonitorManager(
+        monitor_configs=monitor_configs,
+        scheduler=scheduler.Scheduler(
+            job_fn,
+            backend=scheduler.make_backend(scheduler_backend),
+            limiter=limits.ConcurrencyLimiter(limiter_config),
+            stagger="hash",
+        ),
+        client_pool=client_pool,
+        publisher=publisher,
+    )
+    manager.scheduler.start()
+    sampler = asyncio.ensure_future(sample_periodically(measurements))
+    try:
+        await manager.load_monitors(manager.scheduler.schedule)
+        await asyncio.sleep(warmup)
+        # Only measure the steady state, after the warmup
+        measurements.lags.clear()
+        measurements.online = measurements.offline = 0
+        cpu_start, started = get_cpu_time(), time.perf_counter()
+        await asyncio.sleep(duration)
+        cpu_time, elapsed = get_cpu_time() - cpu_start, time.perf_counter() - started
+        measurements.sample()
+    finally:
+        sampler.cancel()
+        manager.scheduler.stop()
+        await manager.aclose()
+
+    checks = measurements.checks
+    lags = measurements.lags or [0]
+    rss = get_rss()
+    return {
+        "checks": checks,
+        "online": measurements.online,
+        "offline": measurements.offline,
+        "checks_per_second": round(checks / elapsed, 1),
+        "lag_p50_ms": round(1000 * percentile(lags, 0.5), 1),
+        "lag_p99_ms": round(1000 * percentile(lags, 0.99), 1),
+        "cpu_ms_per_check": round(1000 * cpu_time / checks, 3) if checks else None,
+        "rss_mb": round(rss / 2 ** 20, 1),
+        "max_rss_mb": round(max(rss, measurements.max_rss) / 2 ** 20, 1),
+        "fds": get_fd_count(),
+        "max_fds": measurements.max_fds,
+    }
+
+
+def httpcheck_bench_cli():
+    httpcheck_bench(auto_envvar_prefix="HTTPCHECK_BENCH")
+
+
+@help_messages(
+    {
+        "monitors": "Number of synthetic monitors",
+        "frequency": "Seconds between checks of each monitor",
+        "duration": "Seconds to measure for",
+        "warmup": "Seconds to run before measuring",
+        "method": "The HTTP method to use",
+        "latency": "Seconds the target server waits before responding",
+        "body_size": "Size of the target server's response body, in bytes",
+        "failure_rate": "Fraction of requests answered with a 503 error",
+        "drop_rate": "Fraction of requests whose connection is dropped",
+        "seed": "Seed for the target server's failures and drops",
+        "max_connections": "Maximum open connections per shared HTTP client",
+        "max_in_flight": "Maximum number of checks running at the same time",
+        "max_per_host": "Maximum number of checks running at once against one host",
+        "scheduler_backend": "Implementation used to schedule repeated checks",
+    }
+)
+@click.command()
+@click.option("--monitors", default=1000)
+@click.option("--frequency", default=10)
+@click.option("--duration", default=30.0)
+@click.option("--warmup", default=5.0)
+@click.option("--method", default="GET")
+@click.option("--latency", default=0.05)
+@click.option("--body-size", default=1024)
+@click.option("--failure-rate", default=0.0)
+@click.option("--drop-rate", default=0.0)
+@click.option("--seed", default=0)
+@click.option("--max-connections", default=100)
+@click.option("--max-in-flight", default=500)
+@click.option("--max-per-host", default=0)
+@click.option(
+    "--scheduler-backend",
+    type=click.Choice(sorted(scheduler.BACKENDS)),
+    default=scheduler.DEFAULT_BACKEND,
+)
+def httpcheck_bench(
+    monitors,
+    frequency,
+    duration,
+    warmup,
+    method,
+    latency,
+    body_size,
+    failure_rate,
+    drop_rate,
+    seed,
+    max_connections,
+    max_in_flight,
+    max_per_host,
+    scheduler_backend,
+):
+    # APScheduler logs the checks still running when it stops as errors
+    logging.getLogger("apscheduler").setLevel(logging.CRITICAL)
+
+    target_config = TargetConfig(
+        latency=latency,
+        body_size=body_size,
+        failure_rate=failure_rate,
+        drop_rate=drop_rate,
+        seed=seed,
+    )
+    target, port = start_target(target_config)
+    try:
+        results = asyncio.run(
+            run_benchmark(
+                make_monitor_configs(port, monitors, frequency, method),
+                duration=duration,
+                warmup=warmup,
+                pool_config={"max_connections": max_connections},
+                limiter_config={
+                    "max_in_flight": max_in_flight,
+                    "max_per_host": max_per_host,
+                },
+                scheduler_backend=scheduler_backend,
+            )
+        )
+    finally:
+        target.terminate()
+
+    output = {
+        "monitors": monitors,
+        "frequency": frequency,
+        "duration": duration,
+        "scheduler_backend": scheduler_backend,
+        **dataclasses.asdict(target_config),
+        **results,
+    }
+    click.echo(json.dumps(output))
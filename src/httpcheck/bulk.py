@@ -0,0 +1,269 @@
+"""
+Check every URL in a (possibly huge) list once, as fast as allowed.
+
+    $ httpcheck --once --input urls.txt
+    $ generate-urls | httpcheck --once --input -
+
+The list is read lazily, in small batches, and a fixed pool of workers checks
+the URLs, so memory use does not grow with the length of the list. Results are
+published as each check finishes, so they are in completion order rather than
+in the order of the list.
+
+With a checkpoint file, progress is saved every few seconds and at the end of
+an interrupted run. Running the same command again skips the lines that were
+already checked. A few lines may be checked twice: the checkpoint only moves
+past a line once it and every line before it have finished.
+"""
+import asyncio
+import collections
+import dataclasses
+import json
+import logging
+import os
+import sys
+import time
+
+from . import clients
+from . import limits
+from . import publishers
+from . import websitecheck
+from .common import WebsiteCheckResults
+
+logger = logging.getLogger(__name__)
+
+# Bytes of input read at a time, in a thread
+READ_BATCH_BYTES = 64 * 1024
+# Workers when the number of checks in flight is not limited
+DEFAULT_WORKERS = 500
+# Seconds between saving the checkpoint
+CHECKPOINT_INTERVAL = 5
+
+
+def parse_line(line):
+    """ The URL on a line of input, or None for blank lines and comments. """
+    url = line.strip()
+    if not url or url.startswith("#"):
+        return None
+    return url
+
+
+class Checkpoint:
+    """ How far through the input every check has finished, saved to a file. """
+
+    def __init__(self, filename, input_name):
+        self.filename = filename
+        self.input_name = input_name
+        self.line = 0
+        # Lines started in order, and those of them that finished out of order
+        self._started = collections.deque()
+        self._finished = set()
+
+    def load(self):
+        try:
+            with open(self.filename) as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return
+        if saved.get("input") != self.input_name:
+            raise ValueError(
+                f"Checkpoint {self.filename} is for {saved.get('input')!r}, "
+                f"not {self.input_name!r}"
+            )
+        self.line = saved["line"]
+
+    def start(self, line_number):
+        self._started.append(line_number)
+
+    def finish(self, line_number):
+        self._finished.add(line_number)
+        # Move past every line that finished, up to the first still running
+        while self._started and self._started[0] in self._finished:
+            self.line = self._started.popleft()
+            self._finished.remove(self.line)
+
+    def save(self):
+        data = json.dumps({"input": self.input_name, "line": self.line})
+        with open(self.filename + ".tmp", "w") as f:
+            f.write(data)
+        os.replace(self.filename + ".tmp", self.filename)
+
+    def remove(self):
+        try:
+            os.remove(self.filename)
+        except FileNotFoundError:
+            pass
+
+
+@dataclasses.dataclass
+class BulkProgress:
+    checked: int = 0
+    online: int = 0
+    skipped: int = 0
+    started: float = dataclasses.field(default_factory=time.monotonic)
+
+    def summary(self):
+        elapsed = time.monotonic() - self.started
+        rate = self.checked / elapsed if elapsed else 0
+        summary = (
+            f"Checked {self.checked} URLs in {elapsed:.1f}s ({rate:.1f}/s): "
+            f"{self.online} online, {self.checked - self.online} offline"
+        )
+        if self.skipped:
+            summary += f" ({self.skipped} already checked before the checkpoint)"
+        return summary
+
+
+async def read_urls(f, checkpoint, progress):
+    """ Yield the line number and URL of each line to check, reading in a thread.
+    """
+    loop = asyncio.get_event_loop()
+    line_number = 0
+    while True:
+        lines = await loop.run_in_executor(None, f.readlines, READ_BATCH_BYTES)
+        if not lines:
+            return
+        for line in lines:
+            line_number += 1
+            url = parse_line(line)
+            if url is None:
+                continue
+            if checkpoint is not None and line_number <= checkpoint.line:
+                progress.skipped += 1
+                continue
+            yield line_number, url
+
+
+async def save_periodically(checkpoint):
+    while True:
+        await asyncio.sleep(CHECKPOINT_INTERVAL)
+        checkpoint.save()
+
+
+async def check_input(
+    f,
+    config_template,
+    publisher,
+    client_pool,
+    limiter_config=None,
+    workers=DEFAULT_WORKERS,
+    checkpoint=None,
+):
+    """ Check each URL read from f, with the settings of config_template.
+
+    At most `workers` checks run at a time, and the next line is only read
+    when one of them finishes.
+    """
+    progress = BulkProgress()
+    limiter = limits.ConcurrencyLimiter(limiter_config)
+    slots = asyncio.Semaphore(workers)
+    running = set()
+
+    errors = []
+
+    async def check(line_number, url):
+        try:
+            config = dataclasses.replace(config_template, url=url, key=url)
+            results = await check_url(config, client_pool, limiter)
+            await publisher.submit_results(results)
+            progress.checked += 1
+            progress.online += bool(results.is_online)
+        finally:
+            if checkpoint is not None:
+                checkpoint.finish(line_number)
+            slots.release()
+
+    def check_done(task):
+        running.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            errors.append(task.exception())
+
+    saver = None
+    if checkpoint is not None:
+        saver = asyncio.ensure_future(save_periodically(checkpoint))
+    try:
+        async for line_number, url in read_urls(f, checkpoint, progress):
+            await slots.acquire()
+            if checkpoint is not None:
+                checkpoint.start(line_number)
+            task = asyncio.ensure_future(check(line_number, url))
+            running.add(task)
+            task.add_done_callback(check_done)
+            if errors:
+                break
+        await asyncio.gather(*running)
+        if errors:
+            raise errors[0]
+    finally:
+        for task in running:
+            task.cancel()
+        if saver is not None:
+            saver.cancel()
+    return progress
+
+
+async def check_url(config, client_pool, limiter):
+    """ Check one URL, reporting a URL that cannot be checked as offline. """
+    try:
+        async with limiter.slot(config):
+            return await websitecheck.run(config, client_pool=client_pool)
+    except (ValueError, TypeError) as exc:
+        # eg. "http://[bad" is rejected before any request is made
+        logger.warning("Cannot check %r: %s", config.url, exc)
+        results = WebsiteCheckResults.from_config(config)
+        results.is_online = False
+        results.exception = type(exc).__name__
+        return results
+    finally:
+        # Each URL is only checked once, so nothing need be kept for later
+        client_pool.forget(config)
+
+
+def run(
+    input_filename,
+    config_template,
+    publisher_config,
+    pool_config=None,
+    limiter_config=None,
+    checkpoint_filename=None,
+):
+    """ Check the URLs in the file (or stdin for "-"), and report the progress. """
+    checkpoint = None
+    if checkpoint_filename:
+        checkpoint = Checkpoint(checkpoint_filename, input_filename)
+        checkpoint.load()
+
+    # Each worker runs one check at a time
+    workers = (limiter_config or {}).get("max_in_flight") or DEFAULT_WORKERS
+
+    async def run_all(f):
+        with publishers.get_publisher(publisher_config) as publisher:
+            await publisher.astart()
+            async with clients.ClientPool(pool_config) as client_pool:
+                try:
+                    return await check_input(
+                        f,
+                        config_template,
+                        publisher,
+                        client_pool,
+                        limiter_config=limiter_config,
+                        workers=workers,
+                        checkpoint=checkpoint,
+                    )
+                finally:
+                    await publisher.aclose()
+
+    f = sys.stdin if input_filename == "-" else open(input_filename)
+    try:
+        progress = asyncio.run(run_all(f))
+    except KeyboardInterrupt:
+        if checkpoint is not None:
+            checkpoint.save()
+            logger.warning("Interrupted, saved progress to %s", checkpoint.filename)
+        raise
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+    if checkpoint is not None:
+        checkpoint.remove()
+    return progress
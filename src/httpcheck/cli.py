@@ -1,32 +1,103 @@
+import json
 import logging
 import os
 
 import click
 
+from . import bulk
+from . import encoders
 from . import main
+from . import publishers
+from . import scheduler
+from . import sharding
+from . import store as store_module
+from . import transitions
+from . import workers as workers_module
+from .common import get_hostname
 from .common import WebsiteMonitorConfig
 from .decorators import help_messages
 
 
-# Here is a preconfigured click Path type
+# Here are preconfigured click Path types
 FilePath = click.Path(exists=True, allow_dash=False, dir_okay=False, resolve_path=True)
+FileOrDirPath = click.Path(exists=True, allow_dash=False, resolve_path=True)
 
 
 def httpcheck_cli():
     httpcheck_main(auto_envvar_prefix="HTTPCHECK")
 
 
+def httpcheck_query_cli():
+    httpcheck_query(auto_envvar_prefix="HTTPCHECK_QUERY")
+
+
+def parse_duration(ctx, param, value):
+    try:
+        return store_module.parse_duration(value)
+    except ValueError as exc:
+        raise click.BadParameter(str(exc)) from exc
+
+
 @help_messages(
     {
         "identifier": "A string for the User-Agent header when making requests",
         "method": "The HTTP method to use",
         "timeout": "Number of seconds to wait for the HTTP response",
-        "retries": "Number of immediate retries when HTTP connection fails",
+        "retries": "Number of retries when the HTTP request fails",
+        "retry_backoff": "Seconds to wait before the first retry, doubled for each",
+        "retry_status": "Also retry responses with this status code (repeatable)",
+        "deadline": "Maximum seconds for all the attempts of a check",
+        "hedge_percentile": "Hedge requests slower than this fraction of recent ones",
         "regex": "A regular expression to search for in the response",
+        "regex_max_bytes": "Maximum number of bytes to search for the regex",
+        "conditional": "Only download the body again when it has changed (GET)",
+        "range_bytes": "Only ask for this many bytes of the body (GET)",
         "frequency": "Seconds to wait before re-checking website",
-        "websites": "Filename for a JSON file multiple website configuration",
+        "websites": "JSON or JSON Lines website configuration (file or directory)",
         "timezone": "Timezone to report attempts in",
         "once": "Only run the check once for each website, do not monitor",
+        "input_filename": "With --once, check each URL in this file (- for stdin)",
+        "checkpoint": "With --input, save progress to this file to resume later",
+        "max_connections": "Maximum open connections per shared HTTP client",
+        "max_keepalive": "Maximum idle connections kept open per shared HTTP client",
+        "keepalive_expiry": "Seconds an idle connection is kept open for reuse",
+        "dns_min_ttl": "Seconds a host's addresses are cached for, at least",
+        "dns_max_ttl": "Seconds a host's addresses are cached for, at most",
+        "dns_negative_ttl": "Seconds a failed DNS lookup is cached for",
+        "dns_cache_size": "Number of hosts kept in the DNS cache",
+        "dns_prewarm": "Look up the hosts of all monitors when (re)loading them",
+        "coalesce": "Make one request for monitors that only differ in key or regex",
+        "transitions_only": "Only publish results that differ from the previous ones",
+        "heartbeat_interval": "Seconds between rollups with --transitions-only",
+        "latency_band": "Response time (seconds) splitting latency bands (repeatable)",
+        "max_in_flight": "Maximum number of checks running at the same time",
+        "max_per_host": "Maximum number of checks running at once against one host",
+        "stagger": "How to spread the first check of each website across its period",
+        "jitter": "Maximum seconds to randomly move each check by",
+        "scheduler_backend": "Implementation used to schedule repeated checks",
+        "adaptive": "Check sooner after changes, and back off while websites are down",
+        "confirm_interval": "With --adaptive, seconds before confirming a change",
+        "max_backoff": "With --adaptive, maximum seconds between checks of a website",
+        "publish_queue_size": "Size of the background publishing queue (0 to disable)",
+        "publish_batch_size": "Maximum number of results published in one write",
+        "publish_flush_interval": "Maximum seconds a result waits to be published",
+        "publish_overflow": "What to do with results when the publish queue is full",
+        "publish_spill_file": "File for results that overflow the publish queue",
+        "json_encoder": "JSON encoder for results (auto: the fastest installed)",
+        "metrics_port": "Serve Prometheus metrics on this port (0 to disable)",
+        "metrics_host": "Address to serve Prometheus metrics on",
+        "store": "Also keep the results in this directory, for httpcheck-query",
+        "store_retention": "How long to keep results in --store for (eg 7d, 12h)",
+        "workers": "Number of worker processes to run the checks in",
+        "shard_index": "Index of this node, to only check its share of the websites",
+        "shard_count": "Number of nodes sharing the websites with --shard-index",
+        "cluster_members": "File listing the nodes sharing the websites, one per line",
+        "node_name": "Name of this node in --cluster-members (default: hostname)",
+        "replicas": "Number of nodes that check each website",
+        "membership_refresh": "Seconds between reloading --cluster-members",
+        "stats_interval": "Seconds between publishing scheduler stats (0 to disable)",
+        "lag_warning": "Warn when checks or the event loop are this many seconds late",
+        "hostname_refresh": "Seconds between looking up this host's name (0 for never)",
     }
 )
 @click.command()
@@ -35,41 +106,315 @@ def httpcheck_cli():
 @click.option("--method", default="HEAD")
 @click.option("--timeout", default=30)
 @click.option("--retries", default=1)
+@click.option("--retry-backoff", default=0.5)
+@click.option("--retry-status", type=int, multiple=True)
+@click.option("--deadline", type=float)
+@click.option("--hedge-percentile", type=click.FloatRange(0, 1))
 @click.option("--regex",)
+@click.option("--regex-max-bytes", type=int)
+@click.option("--conditional", is_flag=True)
+@click.option("--range-bytes", type=int)
 @click.option("--frequency", default=300)
-@click.option("--websites", type=FilePath)
+@click.option("--websites", type=FileOrDirPath)
 @click.option("--timezone", default="UTC")
 @click.option("--once", is_flag=True)
+@click.option("--input", "input_filename", type=click.Path(dir_okay=False))
+@click.option("--checkpoint", type=click.Path(dir_okay=False))
+@click.option("--max-connections", default=100)
+@click.option("--max-keepalive", default=20)
+@click.option("--keepalive-expiry", default=5.0)
+@click.option("--dns-min-ttl", default=30.0)
+@click.option("--dns-max-ttl", default=3600.0)
+@click.option("--dns-negative-ttl", default=10.0)
+@click.option("--dns-cache-size", default=10000)
+@click.option("--dns-prewarm", is_flag=True)
+@click.option("--coalesce", is_flag=True)
+@click.option("--transitions-only", is_flag=True)
+@click.option("--heartbeat-interval", default=300.0)
+@click.option(
+    "--latency-band",
+    type=float,
+    multiple=True,
+    default=transitions.DEFAULT_LATENCY_BANDS,
+)
+@click.option("--max-in-flight", default=500)
+@click.option("--max-per-host", default=10)
+@click.option("--stagger", type=click.Choice(scheduler.STAGGER_MODES), default="none")
+@click.option("--jitter", default=0.0)
+@click.option(
+    "--scheduler-backend",
+    type=click.Choice(sorted(scheduler.BACKENDS)),
+    default=scheduler.DEFAULT_BACKEND,
+)
+@click.option("--adaptive", is_flag=True)
+@click.option("--confirm-interval", default=10.0)
+@click.option("--max-backoff", default=900.0)
+@click.option("--publish-queue-size", default=10000)
+@click.option("--publish-batch-size", default=100)
+@click.option("--publish-flush-interval", default=0.5)
+@click.option(
+    "--publish-overflow",
+    type=click.Choice(publishers.OVERFLOW_POLICIES),
+    default="block",
+)
+@click.option("--publish-spill-file", type=click.Path(dir_okay=False))
+@click.option(
+    "--json-encoder", type=click.Choice(encoders.ENCODER_NAMES), default="json"
+)
+@click.option("--metrics-port", default=0)
+@click.option("--metrics-host", default="127.0.0.1")
+@click.option("--store", type=click.Path(file_okay=False, resolve_path=True))
+@click.option("--store-retention", default="7d", callback=parse_duration)
+@click.option("--workers", default=1)
+@click.option("--shard-index", default=0)
+@click.option("--shard-count", default=1)
+@click.option("--cluster-members", type=FilePath)
+@click.option("--node-name")
+@click.option("--replicas", default=1)
+@click.option("--membership-refresh", default=10.0)
+@click.option("--stats-interval", default=0.0)
+@click.option("--lag-warning", default=1.0)
+@click.option("--hostname-refresh", default=0.0)
 def httpcheck_main(
     urls,
     identifier,
     method,
     timeout,
     retries,
+    retry_backoff,
+    retry_status,
+    deadline,
+    hedge_percentile,
     regex,
+    regex_max_bytes,
+    conditional,
+    range_bytes,
     frequency,
     websites,
     timezone,
     once,
+    input_filename,
+    checkpoint,
+    max_connections,
+    max_keepalive,
+    keepalive_expiry,
+    dns_min_ttl,
+    dns_max_ttl,
+    dns_negative_ttl,
+    dns_cache_size,
+    dns_prewarm,
+    coalesce,
+    transitions_only,
+    heartbeat_interval,
+    latency_band,
+    max_in_flight,
+    max_per_host,
+    stagger,
+    jitter,
+    scheduler_backend,
+    adaptive,
+    confirm_interval,
+    max_backoff,
+    publish_queue_size,
+    publish_batch_size,
+    publish_flush_interval,
+    publish_overflow,
+    publish_spill_file,
+    json_encoder,
+    metrics_port,
+    metrics_host,
+    store,
+    store_retention,
+    workers,
+    shard_index,
+    shard_count,
+    cluster_members,
+    node_name,
+    replicas,
+    membership_refresh,
+    stats_interval,
+    lag_warning,
+    hostname_refresh,
 ):
     set_log_level_from_environment()
 
+    config_options = dict(
+        identifier=identifier,
+        method=method,
+        timeout=timeout,
+        retries=retries,
+        retry_backoff=retry_backoff,
+        retry_statuses=retry_status,
+        deadline=deadline,
+        hedge_percentile=hedge_percentile,
+        regex=regex,
+        regex_max_bytes=regex_max_bytes,
+        conditional=conditional,
+        range_bytes=range_bytes,
+        frequency=frequency,
+        timezone=timezone,
+    )
     monitor_configs = {}
     for url in urls:
-        monitor_config = WebsiteMonitorConfig(
-            identifier=identifier,
-            method=method,
-            url=url,
-            timeout=timeout,
-            retries=retries,
-            regex=regex,
-            frequency=frequency,
-            timezone=timezone,
+        monitor_configs[url] = WebsiteMonitorConfig(url=url, **config_options)
+
+    publisher_config = {
+        "backend": "console",
+        "queue_size": publish_queue_size,
+        "batch_size": publish_batch_size,
+        "flush_interval": publish_flush_interval,
+        "overflow": publish_overflow,
+        "spill_filename": publish_spill_file,
+        "encoder": json_encoder,
+    }
+    if transitions_only and (metrics_port or store or input_filename):
+        raise click.UsageError(
+            "--transitions-only cannot be used with --metrics-port, --store or --input"
+        )
+    if metrics_port:
+        publisher_config.update(
+            backend="prometheus", metrics_host=metrics_host, metrics_port=metrics_port
+        )
+    if store:
+        publisher_config.update(
+            backend="prometheus-store" if metrics_port else "store",
+            store_directory=store,
+            retention=store_retention,
+        )
+    pool_config = {
+        "max_connections": max_connections,
+        "max_keepalive_connections": max_keepalive,
+        "keepalive_expiry": keepalive_expiry,
+        "dns_min_ttl": dns_min_ttl,
+        "dns_max_ttl": dns_max_ttl,
+        "dns_negative_ttl": dns_negative_ttl,
+        "dns_cache_size": dns_cache_size,
+    }
+    limiter_config = {"max_in_flight": max_in_flight, "max_per_host": max_per_host}
+
+    if input_filename is not None:
+        if not once:
+            raise click.UsageError("--input needs --once")
+        if urls or websites or workers > 1:
+            raise click.UsageError(
+                "--input cannot be used with URLs, --websites or --workers"
+            )
+        if hedge_percentile is not None:
+            # Each URL is checked once, so there are no recent response times
+            raise click.UsageError("--input cannot be used with --hedge-percentile")
+        try:
+            progress = bulk.run(
+                input_filename,
+                WebsiteMonitorConfig(url="", **config_options),
+                publisher_config,
+                pool_config=pool_config,
+                limiter_config=limiter_config,
+                checkpoint_filename=checkpoint,
+            )
+        except (OSError, ValueError) as exc:
+            raise click.ClickException(str(exc)) from exc
+        click.echo(progress.summary(), err=True)
+        return
+
+    scheduler_config = {
+        "backend": scheduler_backend,
+        "stagger": stagger,
+        "jitter": jitter,
+    }
+    if adaptive:
+        scheduler_config["adaptive"] = {
+            "confirm_interval": confirm_interval,
+            "max_backoff": max_backoff,
+        }
+    transitions_config = None
+    if transitions_only:
+        transitions_config = {
+            "latency_bands": latency_band,
+            "heartbeat_interval": heartbeat_interval,
+        }
+    monitor_all_kwargs = dict(
+        once=once,
+        pool_config=pool_config,
+        limiter_config=limiter_config,
+        scheduler_config=scheduler_config,
+        hostname_refresh=hostname_refresh,
+        stats_interval=stats_interval,
+        lag_warning=lag_warning,
+        dns_prewarm=dns_prewarm,
+        coalesce=coalesce,
+        transitions_config=transitions_config,
+        **get_cluster_kwargs(
+            shard_index,
+            shard_count,
+            cluster_members,
+            node_name,
+            replicas,
+            membership_refresh,
+        ),
+    )
+    if workers > 1:
+        workers_module.supervise(
+            workers,
+            publisher_config,
+            monitor_configs=monitor_configs,
+            websites_filename=websites,
+            **monitor_all_kwargs,
+        )
+    else:
+        main.monitor_all(
+            monitor_configs, publisher_config, websites, **monitor_all_kwargs
+        )
+
+
+@help_messages(
+    {
+        "store": "Directory of results kept by httpcheck --store",
+        "since": "Start of the time range: a time, or a duration ago (eg 7d)",
+        "until": "End of the time range: a time, or a duration ago (eg 1h)",
+        "url": "Only summarise this URL",
+        "identifier": "Only summarise the results with this identifier",
+    }
+)
+@click.command()
+@click.option("--store", type=click.Path(exists=True, file_okay=False), required=True)
+@click.option("--since", default="1d")
+@click.option("--until", default="0s")
+@click.option("--url")
+@click.option("--identifier")
+def httpcheck_query(store, since, until, url, identifier):
+    """ Summarise the uptime and response times of stored results. """
+    try:
+        since, until = store_module.parse_time(since), store_module.parse_time(until)
+    except ValueError as exc:
+        raise click.BadParameter(str(exc)) from exc
+    summaries = store_module.query(store, since, until, url=url, identifier=identifier)
+    for summary in summaries:
+        click.echo(json.dumps(summary))
+
+
+def get_cluster_kwargs(
+    shard_index, shard_count, cluster_members, node_name, replicas, membership_refresh
+):
+    """ Decide which monitors this node checks, when several nodes share them. """
+    if cluster_members is not None:
+        if shard_count != 1:
+            raise click.UsageError("Use either --cluster-members or --shard-count")
+        membership = sharding.Membership(
+            cluster_members,
+            node=node_name or get_hostname(),
+            replicas=replicas,
+            refresh_interval=membership_refresh,
         )
-        monitor_configs[url] = monitor_config
+        membership.reload()
+        return {"membership": membership}
 
-    publisher_config = {"backend": "console"}
-    main.monitor_all(monitor_configs, publisher_config, websites, once=once)
+    try:
+        shard = sharding.Shard(shard_index, shard_count, replicas=replicas)
+    except ValueError as exc:
+        raise click.UsageError(str(exc)) from exc
+    if shard_count == 1:
+        return {}
+    return {"owns": shard.owns}
 
 
 def set_log_level_from_environment():
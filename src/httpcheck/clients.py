@@ -0,0 +1,105 @@
+import contextlib
+import dataclasses
+import typing
+
+import httpx
+
+from . import common
+from . import conditional
+from . import dns
+from . import retries
+from . import tracing
+
+
+class ClientPool:
+    """ Shared httpx clients, reused across checks with the same settings.
+
+    Clients are keyed by everything that is fixed when a client is constructed
+    (timeouts, headers and TLS settings), so monitors that agree on these share
+    their connections instead of making a new TCP + TLS handshake every check.
+    All the clients share one DNS cache, configured by the same config, one
+    cache of the responses of conditional monitors and the recent response
+    times of hedged monitors.
+    """
+
+    @dataclasses.dataclass(frozen=True)
+    class Config:
+        max_connections: typing.Optional[int] = 100
+        max_keepalive_connections: typing.Optional[int] = 20
+        keepalive_expiry: typing.Optional[float] = 5.0
+
+    def __init__(self, config=None):
+        self.config = common.build_config(self.Config, config or {})
+        self.resolver = dns.CachingResolver(config)
+        self.response_cache = conditional.ResponseCache()
+        self.latency_history = retries.LatencyHistory()
+        self._clients = {}
+
+    @property
+    def limits(self):
+        return httpx.Limits(
+            max_connections=self.config.max_connections,
+            max_keepalive_connections=self.config.max_keepalive_connections,
+            keepalive_expiry=self.config.keepalive_expiry,
+        )
+
+    def _get_client_key(self, monitor_config):
+        return (
+            monitor_config.timeout,
+            monitor_config.identifier,
+            monitor_config.verify,
+        )
+
+    def get_client(self, monitor_config):
+        key = self._get_client_key(monitor_config)
+        try:
+            return self._clients[key]
+        except KeyError:
+            client = make_client(monitor_config, self.limits, self.resolver)
+            self._clients[key] = client
+            return client
+
+    def forget(self, monitor_config):
+        """ Drop what was kept from the earlier checks of a monitor. """
+        self.response_cache.forget(monitor_config)
+        self.latency_history.forget(common.get_monitor_key(monitor_config))
+
+    @contextlib.asynccontextmanager
+    async def client(self, monitor_config):
+        """ Provide a client for the given monitor.
+
+        Monitors that want to measure a cold handshake get a single-use client,
+        everything else shares the pooled client.
+        """
+        if monitor_config.fresh_connection:
+            async with make_client(
+                monitor_config, self.limits, self.resolver
+            ) as client:
+                yield client
+        else:
+            yield self.get_client(monitor_config)
+
+    async def aclose(self):
+        clients, self._clients = self._clients, {}
+        for client in clients.values():
+            await client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+
+def make_client(monitor_config, limits, resolver=None):
+    _timeout = httpx.Timeout(5, read=monitor_config.timeout)
+    headers = {"user-agent": f"httpcheck/{monitor_config.identifier}"}
+    return httpx.AsyncClient(
+        timeout=_timeout,
+        headers=headers,
+        verify=monitor_config.verify,
+        limits=limits,
+        transport=tracing.make_transport(
+            verify=monitor_config.verify, limits=limits, resolver=resolver
+        ),
+    )
@@ -0,0 +1,112 @@
+"""
+Make one request for all the monitors that would make the same request.
+
+Monitors often check the same URL with the same settings, only searching the
+response for different regexes (eg. teams watching a shared health endpoint).
+With coalescing, monitors whose configs only differ in their key, regex or
+source share one scheduled job: each run makes a single request, searches its
+body for every subscriber's regex, and publishes the results of each
+subscriber separately.
+
+Monitors with `conditional` set also need the same regex, as the cached
+search result of a 304 response is shared.
+"""
+import copy
+import dataclasses
+import hashlib
+
+from . import common
+from . import websitecheck
+
+# Fields that may differ between the monitors sharing a request
+SUBSCRIBER_FIELDS = ("key", "regex", "source")
+
+
+def request_signature(config):
+    """ The fields of the config that decide what request is made, and when. """
+    return tuple(
+        (name, value)
+        for name, value in config.as_dict().items()
+        if name not in SUBSCRIBER_FIELDS or (name == "regex" and config.conditional)
+    )
+
+
+def get_group_key(config):
+    digest = hashlib.sha1(repr(request_signature(config)).encode("utf8"))
+    return f"coalesced:{digest.hexdigest()[:16]}"
+
+
+@dataclasses.dataclass
+class Group:
+    # The config of the shared job, keyed by the group
+    config: common.WebsiteMonitorConfig
+    # The config of each monitor in the group, by monitor key
+    subscribers: dict = dataclasses.field(default_factory=dict)
+
+
+class Coalescer:
+    """ The monitors sharing each request, grouped by request signature. """
+
+    def __init__(self):
+        self._groups = {}
+
+    def add(self, config):
+        """ Add (or update) a monitor, returning its group's config.
+
+        Also returns whether the group is new, and so needs to be scheduled.
+        """
+        group_key = get_group_key(config)
+        group = self._groups.get(group_key)
+        is_new = group is None
+        if is_new:
+            regex = config.regex if config.conditional else None
+            group_config = dataclasses.replace(
+                config, key=group_key, regex=regex, source=None
+            )
+            group = self._groups[group_key] = Group(group_config)
+        group.subscribers[common.get_monitor_key(config)] = config
+        return group.config, is_new
+
+    def remove(self, config):
+        """ Remove a monitor, returning its group's config and whether it is empty.
+        """
+        group_key = get_group_key(config)
+        group = self._groups[group_key]
+        group.subscribers.pop(common.get_monitor_key(config), None)
+        if group.subscribers:
+            return group.config, False
+        del self._groups[group_key]
+        return group.config, True
+
+    def subscribers(self, group_config):
+        group = self._groups.get(group_config.key)
+        if group is None:
+            return []
+        return list(group.subscribers.values())
+
+    def group_configs(self):
+        return [group.config for group in self._groups.values()]
+
+
+async def run(group_config, subscribers, client_pool=None):
+    """ Make the group's request once, and collate the results of each subscriber.
+
+    Returns the results of the request, and those of each subscriber.
+    """
+    by_regex = {c.regex: c.pattern for c in subscribers if c.regex}
+    regexes, patterns = list(by_regex), list(by_regex.values())
+    results = await websitecheck.run(group_config, client_pool, patterns)
+    found = dict(zip(regexes, results.regex_found or ()))
+    results.regex_found = None
+    return results, fan_out(results, subscribers, found)
+
+
+def fan_out(results, subscribers, found):
+    """ A copy of the results for each subscriber, with its own regex search. """
+    subscriber_results = []
+    for config in subscribers:
+        copied = copy.copy(results)
+        copied.regex = config.regex
+        copied.regex_found = found.get(config.regex)
+        subscriber_results.append(copied)
+    return subscriber_results
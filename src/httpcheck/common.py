@@ -1,16 +1,90 @@
+import collections
 import dataclasses
 import datetime
+import functools
 import logging
+import re
 import socket
 from typing import Optional
+from typing import Tuple
 
 import pytz
 
 logger = logging.getLogger(__name__)
+_hostname = None
 
+# Transient errors, in both httpx and httpcore
+DEFAULT_RETRY_ERRORS = (
+    "TimeoutException",
+    "NetworkError",
+    "ProtocolError",
+    "ProxyError",
+)
 
+
+def get_hostname():
+    """ The fully qualified name of this host, looked up once and then cached.
+
+    The lookup may involve a blocking reverse DNS query, so it must not happen
+    for every check. Use refresh_hostname() to look it up again.
+    """
+    if _hostname is None:
+        return refresh_hostname()
+    return _hostname
+
+
+def refresh_hostname():
+    global _hostname
+    _hostname = socket.getfqdn()
+    return _hostname
+
+
+@functools.lru_cache(maxsize=None)
+def get_timezone(name):
+    return pytz.timezone(name)
+
+
+class Record:
+    """ Base class for the slotted dataclasses below.
+
+    Slotted instances have no __dict__, so use .as_dict() instead of vars().
+    """
+
+    __slots__ = ()
+
+    def as_dict(self):
+        """ A shallow dict of the fields, in the order they are defined. """
+        return {f.name: getattr(self, f.name) for f in dataclasses.fields(self)}
+
+    def __getstate__(self):
+        return self.as_dict()
+
+    def __setstate__(self, state):
+        # object.__setattr__ also works for frozen dataclasses
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+
+
+def slotted(cls):
+    """ Recreate a dataclass with __slots__, so instances have no __dict__.
+
+    This is what dataclass(slots=True) does from Python 3.10 onwards.
+    """
+    field_names = tuple(f.name for f in dataclasses.fields(cls))
+    cls_dict = dict(cls.__dict__)
+    # Slots for values derived from the fields, which are not pickled
+    cls_dict["__slots__"] = field_names + cls_dict.pop("_derived_slots", ())
+    for name in field_names:
+        # Defaults are kept as class attributes, which would clash with slots
+        cls_dict.pop(name, None)
+    cls_dict.pop("__dict__", None)
+    cls_dict.pop("__weakref__", None)
+    return type(cls)(cls.__name__, cls.__bases__, cls_dict)
+
+
+@slotted
 @dataclasses.dataclass(frozen=True)
-class WebsiteMonitorConfig:
+class WebsiteMonitorConfig(Record):
     url: str
     key: Optional[str] = None
     timeout: int = 30  # seconds
@@ -21,16 +95,55 @@ class WebsiteMonitorConfig:
     frequency: int = 300  # seconds
     source: Optional[str] = None
     timezone: str = "UTC"
+    verify: bool = True
+    fresh_connection: bool = False
+    regex_max_bytes: Optional[int] = None
+    # Retries wait up to retry_backoff * 2**n seconds (at most retry_max_delay)
+    retry_backoff: float = 0.5
+    retry_max_delay: float = 10
+    # Names of the exception classes (or their bases) and status codes retried
+    retry_errors: Tuple[str, ...] = DEFAULT_RETRY_ERRORS
+    retry_statuses: Tuple[int, ...] = ()
+    # Seconds for all attempts together, including the waits between them
+    deadline: Optional[float] = None
+    # Hedge requests slower than this fraction of recent requests (eg 0.95)
+    hedge_percentile: Optional[float] = None
+    # Send If-None-Match/If-Modified-Since, and only ask for the first bytes
+    conditional: bool = False
+    range_bytes: Optional[int] = None
+
+    _derived_slots = ("_pattern",)
+
+    def __post_init__(self):
+        # Lists from the websites file, kept hashable
+        object.__setattr__(self, "retry_errors", tuple(self.retry_errors))
+        object.__setattr__(self, "retry_statuses", tuple(self.retry_statuses))
 
+    @property
+    def pattern(self):
+        """ The compiled regex, compiled once for this config and its checks. """
+        try:
+            return self._pattern
+        except AttributeError:
+            pattern = None if self.regex is None else re.compile(self.regex)
+            object.__setattr__(self, "_pattern", pattern)
+            return pattern
 
+
+def get_monitor_key(config):
+    """ The key identifying a monitor: its configured key, or else its URL. """
+    return config.key or config.url
+
+
+@slotted
 @dataclasses.dataclass
-class WebsiteCheckResults:
+class WebsiteCheckResults(Record):
     """ Run and record the results for a single website check. """
 
     method: str
     url: str
     timestamp: str
-    hostname: Optional[str] = dataclasses.field(default_factory=socket.getfqdn)
+    hostname: Optional[str] = dataclasses.field(default_factory=get_hostname)
     identifier: Optional[str] = None
     is_online: Optional[bool] = None
     response_time: Optional[float] = None
@@ -39,10 +152,27 @@ class WebsiteCheckResults:
     regex_found: Optional[bool] = None
     exception: Optional[Exception] = None
     retries: int = 0
+    bytes_read: Optional[int] = None
+    # Bytes of the body not downloaded, thanks to a 304 or a Range request
+    bytes_saved: Optional[int] = None
+    # Seconds the website asked us to wait, in a Retry-After header
+    retry_after: Optional[float] = None
+    # The phases of the last attempt, in seconds (None when not measured)
+    dns_time: Optional[float] = None
+    # Whether the addresses were cached, and the resolver's time otherwise
+    dns_cache_hit: Optional[bool] = None
+    resolver_time: Optional[float] = None
+    connect_time: Optional[float] = None
+    tls_time: Optional[float] = None
+    first_byte_time: Optional[float] = None
+    body_time: Optional[float] = None
+    connection_reused: Optional[bool] = None
+    # Each attempt, when more than one request was made
+    attempts: Optional[list] = None
 
     @classmethod
     def from_config(cls, config):
-        timezone = pytz.timezone(config.timezone)
+        timezone = get_timezone(config.timezone)
         return cls(
             url=config.url,
             timestamp=datetime.datetime.now(timezone).isoformat(),
@@ -52,13 +182,38 @@ class WebsiteCheckResults:
         )
 
 
-def print_monitor_configs(*monitor_configs):
-    lines = []
-    lines.append("---")
-    lines.append("The following websites are configured:")
-    for config in monitor_configs:
-        lines.append("---")
-        for key, val in vars(config).items():
-            lines.append(f"{key}: {val}")
-    lines.append("---")
-    logger.info("\n".join(lines))
+def build_config(config_cls, config):
+    """ Build a component's Config dataclass, ignoring keys it does not use. """
+    relevant_config_keys = {f.name for f in dataclasses.fields(config_cls)}
+    relevant_config = {k: v for k, v in config.items() if k in relevant_config_keys}
+    return config_cls(**relevant_config)
+
+
+class MonitorSummary:
+    """ Summarise the configured monitors as they are loaded.
+
+    Listing every field of every monitor does not scale to large inventories,
+    so this is only done at DEBUG level. Otherwise a summary is logged.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.sources = collections.Counter()
+        self.frequencies = collections.Counter()
+
+    def add(self, config):
+        self.count += 1
+        self.sources[config.source or "command line"] += 1
+        self.frequencies[config.frequency] += 1
+        if logger.isEnabledFor(logging.DEBUG):
+            fields = ", ".join(f"{k}={v!r}" for k, v in config.as_dict().items())
+            logger.debug("Configured website: %s", fields)
+
+    def log(self):
+        sources = ", ".join(f"{n} from {s}" for s, n in self.sources.most_common())
+        frequencies = ", ".join(
+            f"{n} every {f}s" for f, n in sorted(self.frequencies.items())
+        )
+        logger.info(
+            "%d websites are configured (%s; %s)", self.count, sources, frequencies
+        )
@@ -0,0 +1,103 @@
+"""
+Avoid downloading response bodies that have not changed, or are not needed.
+
+Monitors with `conditional` set remember the ETag and Last-Modified headers of
+their last response, along with what the regex search found in its body. The
+next check sends them as If-None-Match and If-Modified-Since, and a 304 Not
+Modified response reuses the cached search result instead of a new download.
+
+The cache is kept by the client pool, and a monitor's response is forgotten
+when the monitor is no longer scheduled.
+
+Monitors with `range_bytes` set only ask for the start of the body, for
+regexes known to match near the top of the page. When the server cannot
+satisfy the range (416), the whole body is requested instead.
+"""
+import dataclasses
+from typing import Optional
+
+from . import common
+
+# Only these methods have a body worth avoiding
+BODY_METHODS = ("GET",)
+
+
+@common.slotted
+@dataclasses.dataclass
+class CachedResponse(common.Record):
+    etag: Optional[str]
+    last_modified: Optional[str]
+    regex: Optional[str]
+    regex_found: Optional[bool]
+    # Size of the body the server would otherwise send, in bytes
+    size: int
+
+
+class ResponseCache:
+    """ The validators and search result of each monitor's last response. """
+
+    def __init__(self):
+        self._responses = {}
+
+    def __len__(self):
+        return len(self._responses)
+
+    def get(self, config):
+        if not config.conditional or config.method not in BODY_METHODS:
+            return None
+        cached = self._responses.get(common.get_monitor_key(config))
+        if cached is None or cached.regex != config.regex:
+            return None
+        return cached
+
+    def store(self, config, response, results):
+        """ Remember a successful response, if it can be validated later. """
+        if not config.conditional or config.method not in BODY_METHODS:
+            return
+        etag = response.headers.get("etag")
+        last_modified = response.headers.get("last-modified")
+        if response.status_code not in (200, 206) or not (etag or last_modified):
+            return
+        size = get_body_size(response)
+        self._responses[common.get_monitor_key(config)] = CachedResponse(
+            etag=etag,
+            last_modified=last_modified,
+            regex=config.regex,
+            regex_found=results.regex_found,
+            size=results.bytes_read if size is None else size,
+        )
+
+    def forget(self, config):
+        self._responses.pop(common.get_monitor_key(config), None)
+
+
+def get_request_headers(config, cached):
+    headers = {}
+    if cached is not None:
+        if cached.etag:
+            headers["if-none-match"] = cached.etag
+        if cached.last_modified:
+            headers["if-modified-since"] = cached.last_modified
+    if config.range_bytes and config.method in BODY_METHODS:
+        headers["range"] = f"bytes=0-{config.range_bytes - 1}"
+    return headers
+
+
+def get_body_size(response):
+    """ The size of the whole body, from Content-Range or Content-Length. """
+    if response.status_code == 206:
+        return parse_content_range_size(response.headers.get("content-range"))
+    try:
+        return int(response.headers["content-length"])
+    except (KeyError, ValueError):
+        return None
+
+
+def parse_content_range_size(value):
+    """ The complete length from a Content-Range header ("bytes 0-99/1234"). """
+    if not value or "/" not in value:
+        return None
+    try:
+        return int(value.rsplit("/", 1)[1])
+    except ValueError:
+        return None  # The length is unknown ("*")
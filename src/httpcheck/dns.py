@@ -0,0 +1,174 @@
+"""
+Resolve host names once for all the monitors that share them.
+
+Each client pool has one resolver, which caches the addresses of every host
+for the TTL of its DNS records (clamped between `dns_min_ttl` and
+`dns_max_ttl`), and failed lookups for `dns_negative_ttl` seconds. Checks of a
+host that is being looked up wait for that lookup rather than starting another.
+At most `dns_cache_size` hosts are cached, the least recently used going first,
+and expired entries are dropped when they are next looked up.
+
+TTLs are only known when aiodns is installed (`pip install httpcheck[dns]`).
+Otherwise names are resolved with the system resolver (getaddrinfo, in a
+thread) and cached for `dns_default_ttl` seconds.
+"""
+import asyncio
+import collections
+import dataclasses
+import ipaddress
+import logging
+import socket
+import time
+import typing
+import urllib.parse
+
+from . import common
+
+try:
+    import aiodns
+except ImportError:  # aiodns is an optional dependency
+    aiodns = None
+
+logger = logging.getLogger(__name__)
+
+# Hosts looked up at the same time when pre-warming the cache
+PREWARM_CONCURRENCY = 50
+
+
+@dataclasses.dataclass
+class Lookup:
+    """ The outcome of looking up a host, and how long it took. """
+
+    addresses: typing.List[str]
+    error: typing.Optional[OSError]
+    resolver_time: float
+    expires: float
+
+
+class CachingResolver:
+    @dataclasses.dataclass(frozen=True)
+    class Config:
+        dns_min_ttl: float = 30
+        dns_max_ttl: float = 3600
+        dns_default_ttl: float = 60
+        dns_negative_ttl: float = 10
+        dns_cache_size: int = 10000
+
+    def __init__(self, config=None):
+        self.config = common.build_config(self.Config, config or {})
+        self._cache = collections.OrderedDict()
+        self._lookups = {}
+        self._aiodns_resolver = None
+
+    async def resolve(self, host, port=0):
+        """ The addresses of the host, and whether they came from the cache.
+
+        Also returns the time the resolver took to answer, unless the cache
+        answered. IP addresses are returned as they are, neither cached nor not.
+        """
+        if is_ip_address(host):
+            return [host], None, None
+        lookup = self._cache.get(host)
+        cache_hit = lookup is not None and lookup.expires > time.monotonic()
+        if cache_hit:
+            self._cache.move_to_end(host)
+        else:
+            self._cache.pop(host, None)
+            lookup = await self._lookup(host, port)
+        if lookup.error is not None:
+            # A new exception each time, rather than piling up tracebacks
+            raise type(lookup.error)(*lookup.error.args)
+        return lookup.addresses, cache_hit, None if cache_hit else lookup.resolver_time
+
+    async def _lookup(self, host, port):
+        """ Look the host up, or wait for the lookup already in progress. """
+        future = self._lookups.get(host)
+        if future is None:
+            future = asyncio.ensure_future(self._query(host, port))
+            self._lookups[host] = future
+            future.add_done_callback(lambda f: self._finish_lookup(host, f))
+        # Checks that give up waiting do not cancel the lookup for the others
+        return await asyncio.shield(future)
+
+    def _finish_lookup(self, host, future):
+        del self._lookups[host]
+        if not future.cancelled() and future.exception() is None:
+            self._cache[host] = future.result()
+            self._cache.move_to_end(host)
+            while len(self._cache) > self.config.dns_cache_size:
+                self._cache.popitem(last=False)
+
+    async def _query(self, host, port):
+        start = time.perf_counter()
+        addresses, ttl, error = [], self.config.dns_negative_ttl, None
+        try:
+            addresses, ttl = await self._query_aiodns(host)
+        except OSError:
+            # eg. names only in /etc/hosts, or without aiodns
+            try:
+                addresses = await query_system(host, port)
+                ttl = self.config.dns_default_ttl
+            except OSError as exc:
+                error = exc
+        resolver_time = time.perf_counter() - start
+        if error is None:
+            ttl = min(max(ttl, self.config.dns_min_ttl), self.config.dns_max_ttl)
+        return Lookup(addresses, error, resolver_time, time.monotonic() + ttl)
+
+    async def _query_aiodns(self, host):
+        """ The IPv4 and IPv6 addresses of the host, and their lowest TTL. """
+        if aiodns is None:
+            raise OSError("aiodns is not installed")
+        if self._aiodns_resolver is None:
+            self._aiodns_resolver = aiodns.DNSResolver()
+        answers = await asyncio.gather(
+            self._aiodns_resolver.query(host, "A"),
+            self._aiodns_resolver.query(host, "AAAA"),
+            return_exceptions=True,
+        )
+        records = [
+            record
+            for answer in answers
+            if not isinstance(answer, Exception)
+            for record in answer
+        ]
+        if not records:
+            raise OSError(f"No addresses for {host}")
+        return [r.host for r in records], min(r.ttl for r in records)
+
+    async def prewarm(self, urls):
+        """ Look up the hosts of the URLs that are not cached yet. """
+        slots = asyncio.Semaphore(PREWARM_CONCURRENCY)
+
+        async def warm(host):
+            async with slots:
+                try:
+                    await self.resolve(host)
+                except OSError:
+                    pass  # The failure is cached, and reported by the checks
+
+        start = time.perf_counter()
+        hosts = {urllib.parse.urlsplit(url).hostname for url in urls}
+        hosts = [
+            host
+            for host in hosts
+            if host and host not in self._cache and not is_ip_address(host)
+        ]
+        await asyncio.gather(*(warm(host) for host in hosts))
+        logger.info(
+            "Resolved %d hosts in %.2fs", len(hosts), time.perf_counter() - start
+        )
+
+
+async def query_system(host, port):
+    loop = asyncio.get_event_loop()
+    infos = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    return [sockaddr[0] for family, type_, proto, canonname, sockaddr in infos]
+
+
+def is_ip_address(host):
+    try:
+        ipaddress.ip_address(host.strip("[]"))
+    except ValueError:
+        return False
+    return True
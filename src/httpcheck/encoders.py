@@ -0,0 +1,64 @@
+"""
+Encode check results as JSON, directly to bytes.
+
+The output has the same keys, key order and values as
+json.dumps(dataclasses.asdict(results)). The stdlib encoder, the default,
+reproduces it byte for byte. orjson and msgspec (when installed) are much
+faster, but leave out the optional whitespace and write non-ASCII characters
+unescaped, so they are only used when asked for ("auto" picks the fastest).
+"""
+import dataclasses
+import json
+
+from .common import WebsiteCheckResults
+
+try:
+    import orjson
+except ImportError:  # orjson is an optional dependency
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # msgspec is an optional dependency
+    msgspec = None
+
+FIELD_NAMES = tuple(f.name for f in dataclasses.fields(WebsiteCheckResults))
+_json_encoder = json.JSONEncoder()
+
+
+def _as_dict(results):
+    # Unlike dataclasses.asdict(), this does not recursively copy every value
+    return {name: getattr(results, name) for name in FIELD_NAMES}
+
+
+def encode_json(results):
+    return _json_encoder.encode(_as_dict(results)).encode("utf8")
+
+
+def encode_orjson(results):
+    return orjson.dumps(_as_dict(results))
+
+
+def encode_msgspec(results):
+    return _msgspec_encoder.encode(_as_dict(results))
+
+
+if msgspec is not None:
+    _msgspec_encoder = msgspec.json.Encoder()
+
+ENCODERS = {"json": encode_json, "orjson": encode_orjson, "msgspec": encode_msgspec}
+ENCODER_NAMES = ("auto", *ENCODERS)
+
+
+def get_encoder(name="json"):
+    if name == "auto":
+        if orjson is not None:
+            return encode_orjson
+        if msgspec is not None:
+            return encode_msgspec
+        return encode_json
+    if name == "orjson" and orjson is None:
+        raise RuntimeError("orjson is not installed")
+    if name == "msgspec" and msgspec is None:
+        raise RuntimeError("msgspec is not installed")
+    return ENCODERS[name]
@@ -0,0 +1,109 @@
+import asyncio
+import contextlib
+import dataclasses
+import logging
+import timeit
+import typing
+import urllib.parse
+
+from . import common
+
+logger = logging.getLogger(__name__)
+
+
+class ConcurrencyLimiter:
+    """ Admission control for checks, capping how many run at the same time.
+
+    There is a global cap on checks in flight and a separate cap per origin
+    (scheme, host and port), so that a large inventory neither exhausts file
+    descriptors nor floods a single target. Checks wait for a slot before they
+    start, so the wait is never counted as part of the response time.
+    """
+
+    @dataclasses.dataclass(frozen=True)
+    class Config:
+        max_in_flight: typing.Optional[int] = 500
+        max_per_host: typing.Optional[int] = 10
+
+    def __init__(self, config=None):
+        self.config = common.build_config(self.Config, config or {})
+        self.waiting = 0
+        self.in_flight = 0
+        self._global_slots = None
+        self._host_slots = {}
+
+    @property
+    def queue_depth(self):
+        """ The number of checks currently waiting for a slot. """
+        return self.waiting
+
+    def _get_global_slots(self):
+        # Created lazily so that the semaphore belongs to the running loop
+        if self._global_slots is None:
+            self._global_slots = _make_slots(self.config.max_in_flight)
+        return self._global_slots
+
+    @contextlib.asynccontextmanager
+    async def slot(self, monitor_config):
+        """ Wait until the check for this monitor is allowed to run. """
+        origin = get_origin(monitor_config.url)
+        host_slots = self._host_slots.get(origin)
+        if host_slots is None:
+            host_slots = _HostSlots(_make_slots(self.config.max_per_host))
+            self._host_slots[origin] = host_slots
+        host_slots.users += 1
+
+        admitted = False
+        self.waiting += 1
+        start_time = timeit.default_timer()
+        try:
+            async with host_slots.semaphore, self._get_global_slots():
+                admitted = True
+                self.waiting -= 1
+                self.in_flight += 1
+                _log_wait(monitor_config, timeit.default_timer() - start_time, self)
+                try:
+                    yield
+                finally:
+                    self.in_flight -= 1
+        finally:
+            if not admitted:
+                self.waiting -= 1
+            host_slots.users -= 1
+            if not host_slots.users:
+                del self._host_slots[origin]
+
+
+@dataclasses.dataclass
+class _HostSlots:
+    semaphore: typing.Any
+    users: int = 0
+
+
+class _Unlimited:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+def _make_slots(limit):
+    if not limit:
+        return _Unlimited()
+    return asyncio.Semaphore(limit)
+
+
+def _log_wait(monitor_config, waited, limiter):
+    if waited >= 0.001:
+        logger.debug(
+            "Waited %.3fs for a slot to check %s (queue depth %d)",
+            waited,
+            monitor_config.url,
+            limiter.queue_depth,
+        )
+
+
+def get_origin(url):
+    parts = urllib.parse.urlsplit(url)
+    return (parts.scheme, parts.netloc)
@@ -1,24 +1,97 @@
 import asyncio
 import dataclasses
+import datetime
 import functools
+import itertools
 import json
+import logging
+import os
 import signal
 import typing
 
+from . import adaptive
+from . import clients
+from . import coalescing
 from . import common
+from . import limits
 from . import publishers
 from . import scheduler
+from . import sharding
+from . import stats
+from . import transitions
 from . import websitecheck
 
+logger = logging.getLogger(__name__)
 
-def monitor_all(monitor_configs, publisher_config, websites_filename, once=False):
-    monitor_configs_from_file = dict(parse_websites_json(websites_filename))
-    all_monitor_configs = {**monitor_configs_from_file, **monitor_configs}
+# Changes to these fields move the job in the schedule, others only affect
+# what the next check does
+SCHEDULE_FIELDS = {"frequency"}
+# Monitors loaded between giving the event loop a chance to run checks
+LOAD_BATCH_SIZE = 1000
+# Files in a websites directory that are loaded
+WEBSITES_EXTENSIONS = (".json", ".jsonl", ".ndjson")
+
+
+def monitor_all(
+    monitor_configs,
+    publisher_config,
+    websites_filename,
+    once=False,
+    pool_config=None,
+    limiter_config=None,
+    scheduler_config=None,
+    hostname_refresh=0,
+    owns=None,
+    membership=None,
+    stats_interval=0,
+    lag_warning=1.0,
+    dns_prewarm=False,
+    coalesce=False,
+    transitions_config=None,
+):
+    # Look this up before any checks run, rather than during the first check
+    common.refresh_hostname()
+
+    scheduler_config = dict(scheduler_config or {})
+    backend = scheduler.make_backend(
+        scheduler_config.pop("backend", scheduler.DEFAULT_BACKEND)
+    )
+    adaptive_config = scheduler_config.pop("adaptive", None)
+    if adaptive_config is not None:
+        scheduler_config["adaptive"] = adaptive.AdaptivePolicy(adaptive_config)
 
     with publishers.get_publisher(publisher_config) as publisher:
-        job_fn = functools.partial(check_and_publish, publisher=publisher)
+        client_pool = clients.ClientPool(pool_config)
+        coalescer = coalescing.Coalescer() if coalesce else None
+        tracker = None
+        if transitions_config is not None:
+            tracker = transitions.TransitionTracker(transitions_config)
+        job_fn = functools.partial(
+            check_and_publish,
+            publisher=publisher,
+            client_pool=client_pool,
+            coalescer=coalescer,
+            tracker=tracker,
+        )
         monitor_manager = MonitorManager(
-            monitor_configs=all_monitor_configs, scheduler=scheduler.Scheduler(job_fn),
+            monitor_configs=dict(monitor_configs),
+            scheduler=scheduler.Scheduler(
+                job_fn,
+                backend=backend,
+                limiter=limits.ConcurrencyLimiter(limiter_config),
+                stats=stats.SchedulerStats(lag_warning),
+                **scheduler_config,
+            ),
+            client_pool=client_pool,
+            publisher=publisher,
+            hostname_refresh=hostname_refresh,
+            websites_filename=websites_filename,
+            owns=owns,
+            membership=membership,
+            stats_interval=stats_interval,
+            dns_prewarm=dns_prewarm,
+            coalescer=coalescer,
+            transition_tracker=tracker,
         )
         if once:
             monitor_manager.run_all_monitors_once()
@@ -26,90 +99,412 @@ def monitor_all(monitor_configs, publisher_config, websites_filename, once=False
             monitor_manager.schedule_all_monitors()
 
 
-async def check_and_publish(config, publisher):
-    check_results = await websitecheck.run(config)
-    data = json.dumps(dataclasses.asdict(check_results))
-    publisher.publish(data)
+async def check_and_publish(
+    config, publisher, client_pool=None, coalescer=None, tracker=None
+):
+    if coalescer is not None:
+        return await check_and_publish_coalesced(
+            config, publisher, client_pool, coalescer, tracker
+        )
+    check_results = await websitecheck.run(config, client_pool=client_pool)
+    await publish_results(publisher, config, check_results, tracker)
+    return check_results
+
+
+async def publish_results(publisher, config, results, tracker=None):
+    """ Publish the results, only if the monitor's state changed with a tracker.
+    """
+    if tracker is None or tracker.record(config, results):
+        await publisher.submit_results(results)
+
+
+async def check_and_publish_coalesced(
+    config, publisher, client_pool, coalescer, tracker=None
+):
+    """ Check a group of monitors with one request, publishing each one's results.
+    """
+    subscribers = coalescer.subscribers(config)
+    if not subscribers:
+        return None  # The group was removed while waiting to run
+    check_results, subscriber_results = await coalescing.run(
+        config, subscribers, client_pool
+    )
+    for subscriber, results in zip(subscribers, subscriber_results):
+        await publish_results(publisher, subscriber, results, tracker)
+    return check_results
 
 
 @dataclasses.dataclass(frozen=True)
 class MonitorManager:
     """ Manage the monitoring of many website, connect them to scheduler.
+
+    Monitors from the websites file are loaded while the first checks are
+    already running, so that large inventories start checking immediately.
     """
 
     monitor_configs: typing.Dict[str, common.WebsiteMonitorConfig]
     scheduler: typing.Optional[any] = None
+    client_pool: typing.Optional[clients.ClientPool] = None
+    publisher: typing.Optional[publishers.BasePublisher] = None
+    hostname_refresh: float = 0  # seconds
+    websites_filename: typing.Optional[str] = None
+    # Only monitors for which this returns True are checked (eg. by a worker)
+    owns: typing.Optional[typing.Callable] = None
+    # Cluster members, which also decide which monitors are checked
+    membership: typing.Optional[sharding.Membership] = None
+    # Seconds between publishing scheduler statistics (0 for never)
+    stats_interval: float = 0
+    # Look up the hosts of the monitors as they are loaded
+    dns_prewarm: bool = False
+    # Groups the monitors making the same request into one job, if set
+    coalescer: typing.Optional[coalescing.Coalescer] = None
+    # Only publishes the results that changed, and rollups of them, if set
+    transition_tracker: typing.Optional[transitions.TransitionTracker] = None
+    # Monitors configured explicitly (rather than in a file), owned or not
+    explicit_configs: typing.Dict[str, common.WebsiteMonitorConfig] = (
+        dataclasses.field(default_factory=dict, init=False)
+    )
+
+    def __post_init__(self):
+        self.explicit_configs.update(
+            (key, config)
+            for key, config in self.monitor_configs.items()
+            if config.source is None
+        )
 
     def run_all_monitors_once(self):
-        common.print_monitor_configs(*self.monitor_configs.values())
         asyncio.run(self.async_run_all_monitors_once())
 
     async def async_run_all_monitors_once(self):
-        coroutines = (
-            self.scheduler.run_once(config) for config in self.monitor_configs.values()
+        tasks = []
+
+        def start_monitor(config):
+            if self.coalescer is None:
+                tasks.append(asyncio.ensure_future(self.scheduler.run_once(config)))
+            else:
+                # Groups are checked once all of their monitors are loaded
+                self.coalescer.add(config)
+
+        try:
+            if self.publisher is not None:
+                await self.publisher.astart()
+            await self.load_monitors(start_monitor)
+            if self.coalescer is not None:
+                tasks.extend(
+                    asyncio.ensure_future(self.scheduler.run_once(group_config))
+                    for group_config in self.coalescer.group_configs()
+                )
+            await asyncio.gather(*tasks)
+        finally:
+            await self.aclose()
+
+    def _is_owned(self, config):
+        if self.membership is not None and not self.membership.owns(config):
+            return False
+        return self.owns is None or self.owns(config)
+
+    def _iter_monitor_configs(self):
+        explicit_configs = list(self.monitor_configs.items())
+        self.monitor_configs.clear()
+        explicit_keys = {key for key, config in explicit_configs}
+        configs = itertools.chain(
+            explicit_configs,
+            # Monitors configured explicitly take precedence
+            (
+                (key, config)
+                for key, config in parse_websites(self.websites_filename)
+                if key not in explicit_keys
+            ),
         )
-        await asyncio.gather(*coroutines)
+        for key, config in configs:
+            if self._is_owned(config):
+                yield key, config
 
-    def schedule_all_monitors(self):
-        common.print_monitor_configs(*self.monitor_configs.values())
+    async def load_monitors(self, start_monitor):
+        """ Load all monitors, calling start_monitor() as each one is parsed. """
+        summary = common.MonitorSummary()
+        for index, (key, config) in enumerate(self._iter_monitor_configs(), 1):
+            self.monitor_configs[key] = config
+            common.get_timezone(config.timezone)
+            summary.add(config)
+            start_monitor(config)
+            if not index % LOAD_BATCH_SIZE:
+                # Let the checks that were already started make progress
+                await asyncio.sleep(0)
+        summary.log()
+        self.prewarm_dns(self.monitor_configs.values())
 
-        # XXX Where to put results?
-        for monitor_config in self.monitor_configs.values():
-            self.scheduler.schedule(monitor_config)
+    def prewarm_dns(self, configs):
+        """ Start looking up the hosts of the monitors, if asked to. """
+        if self.dns_prewarm and self.client_pool is not None:
+            urls = [config.url for config in configs]
+            asyncio.ensure_future(self.client_pool.resolver.prewarm(urls))
 
-        self.scheduler.start()
+    async def aclose(self):
+        """ Publish any queued results and release connections held open. """
+        if self.publisher is not None:
+            await self.publisher.aclose()
+        if self.client_pool is not None:
+            await self.client_pool.aclose()
 
-        signal.signal(signal.SIGHUP, self.reload_config)
+    def schedule_all_monitors(self):
+        self.scheduler.start()
 
+        loop = asyncio.get_event_loop()
         try:
-            asyncio.get_event_loop().run_forever()
+            if self.publisher is not None:
+                loop.run_until_complete(self.publisher.astart())
+            # Checks start while the monitors are loading, but a broken
+            # configuration stops here (reloads keep the old monitors instead)
+            loop.run_until_complete(self.load_monitors(self.schedule))
+            loop.add_signal_handler(signal.SIGHUP, self.reload_config)
+            if self.hostname_refresh:
+                loop.create_task(self.refresh_hostname_periodically())
+            if self.membership is not None and self.membership.refresh_interval:
+                loop.create_task(self.refresh_membership_periodically())
+            if self.scheduler.stats is not None:
+                loop.create_task(self.scheduler.stats.probe_loop_lag())
+                if self.stats_interval:
+                    loop.create_task(self.publish_stats_periodically())
+            tracker = self.transition_tracker
+            if tracker is not None and tracker.config.heartbeat_interval:
+                loop.create_task(self.publish_rollups_periodically())
+            loop.run_forever()
         except (KeyboardInterrupt, SystemExit):
             pass
+        finally:
+            self.scheduler.stop()
+            loop.run_until_complete(self.aclose())
+
+    async def refresh_hostname_periodically(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(self.hostname_refresh)
+            await loop.run_in_executor(None, common.refresh_hostname)
+
+    def reload_config(self):
+        """ Handle SIGHUP, by reloading the configuration on the event loop. """
+        asyncio.ensure_future(self.async_reload_config())
+
+    async def publish_stats_periodically(self):
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            await self.publish_stats()
+
+    async def publish_stats(self):
+        record = {
+            "record": "stats",
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "hostname": common.get_hostname(),
+            **self.scheduler.stats.snapshot(),
+        }
+        if self.scheduler.limiter is not None:
+            record["checks_waiting"] = self.scheduler.limiter.queue_depth
+        await self.publisher.submit_record(record)
+
+    async def publish_rollups_periodically(self):
+        while True:
+            await asyncio.sleep(self.transition_tracker.config.heartbeat_interval)
+            await self.publish_rollups()
+
+    async def publish_rollups(self):
+        for record in self.transition_tracker.rollup():
+            await self.publisher.submit_record(record)
+
+    async def refresh_membership_periodically(self):
+        while True:
+            await asyncio.sleep(self.membership.refresh_interval)
+            if await self.async_reload_membership():
+                await self.async_reload_monitors()
 
-    def reload_config(self, signum, frame):
-        """ Reload any changes to the configuration file.
+    async def async_reload_config(self):
+        """ Reload any changes to the configuration file and cluster members.
 
         This provides the ability to reload a changed config file while still
         running, avoiding any extra attempts that might happen on a restart.
+        Only monitors that were added, removed or changed are touched, and
+        changed monitors keep their place in the schedule.
         """
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, common.refresh_hostname)
+        if self.membership is not None:
+            await self.async_reload_membership()
+        await self.async_reload_monitors()
+
+    async def async_reload_membership(self):
+        """ Reload the cluster members, returning whether they changed. """
+        loop = asyncio.get_event_loop()
+        try:
+            changed = await loop.run_in_executor(None, self.membership.reload)
+        except OSError as exc:
+            logger.error("Not reloading cluster members: %s", exc)
+            return False
+        if changed:
+            logger.info("Cluster members: %s", ", ".join(self.membership.members))
+        return changed
+
+    async def async_reload_monitors(self):
+        """ Start and stop checking monitors, to match the configuration. """
+        if not self.websites_filename and self.membership is None:
+            return
+
+        loop = asyncio.get_event_loop()
         monitor_updates = {}
+        if self.websites_filename:
+            try:
+                monitor_updates = await loop.run_in_executor(
+                    None, load_websites, self.websites_filename
+                )
+            except (OSError, ValueError, TypeError) as exc:
+                logger.error("Not reloading %s: %s", self.websites_filename, exc)
+                return
 
-        filenames = (c.source for c in self.monitor_configs.values() if c.source)
-        for filename in filenames:
-            monitor_updates.update(parse_websites_json(filename))
+        # Monitors configured explicitly take precedence
+        monitor_updates.update(self.explicit_configs)
+        monitor_updates = {
+            key: config
+            for key, config in monitor_updates.items()
+            if self._is_owned(config)
+        }
+        diff = diff_monitor_configs(self.monitor_configs, monitor_updates)
+        unchanged = len(self.monitor_configs) - len(diff.removed) - len(diff.changed)
+        self.apply_config_diff(diff)
+        self.prewarm_dns(
+            [*diff.added.values(), *(config for config, _ in diff.changed.values())]
+        )
+        logger.info(
+            "Reloaded monitors: %d added, %d removed, %d changed, %d unchanged",
+            len(diff.added),
+            len(diff.removed),
+            len(diff.changed),
+            unchanged,
+        )
 
-        if not monitor_updates:
+    def schedule(self, config):
+        """ Schedule the monitor, or add it to the group making its request. """
+        if self.coalescer is None:
+            self.scheduler.schedule(config)
             return
+        group_config, is_new = self.coalescer.add(config)
+        if is_new:
+            self.scheduler.schedule(group_config)
 
-        for key, monitor_config in self.monitor_configs.items():
-            # Leave explicitly configured monitors alone
-            if monitor_config.source is None:
-                continue
+    def unschedule(self, config):
+        if self.coalescer is None:
+            self.scheduler.unschedule(config)
+            self.forget_checks(config)
+            return
+        group_config, is_empty = self.coalescer.remove(config)
+        if is_empty:
+            self.scheduler.unschedule(group_config)
+            self.forget_checks(config)
+
+    def forget_checks(self, config):
+        """ Drop what was kept from the checks of a job no longer scheduled. """
+        if self.client_pool is not None:
+            self.client_pool.forget(config)
+
+    def update_coalesced(self, old_config, config):
+        """ Update a monitor, moving it to another group if its request changed. """
+        if coalescing.get_group_key(old_config) != coalescing.get_group_key(config):
+            self.unschedule(old_config)
+        self.schedule(config)
+
+    def apply_config_diff(self, diff):
+        for key, config in diff.removed.items():
+            self.unschedule(config)
+            del self.monitor_configs[key]
+            if self.transition_tracker is not None:
+                self.transition_tracker.forget(config)
 
-            if key in monitor_updates:
-                self.scheduler.reschedule(monitor_config)
+        for key, (config, changed_fields) in diff.changed.items():
+            old_config = self.monitor_configs[key]
+            self.monitor_configs[key] = config
+            if self.coalescer is not None:
+                self.update_coalesced(old_config, config)
+            elif changed_fields & SCHEDULE_FIELDS:
+                self.scheduler.reschedule(config)
             else:
-                self.scheduler.unschedule(monitor_config)
-                del self.monitor_configs[key]
+                self.scheduler.update(config)
+            if self.coalescer is None:
+                # Its request may have changed, eg. to another URL
+                self.forget_checks(old_config)
 
-        new_keys = set(monitor_updates) - set(self.monitor_configs)
-        for new_key in new_keys:
-            new_config = monitor_updates[new_key]
-            self.scheduler.schedule(new_config)
-            self.monitor_configs[new_key] = new_config
+        for key, config in diff.added.items():
+            self.schedule(config)
+            self.monitor_configs[key] = config
 
-        common.print_monitor_configs(*self.monitor_configs.values())
 
+@dataclasses.dataclass(frozen=True)
+class ConfigDiff:
+    added: typing.Dict[str, common.WebsiteMonitorConfig]
+    removed: typing.Dict[str, common.WebsiteMonitorConfig]
+    # The new config and the names of the fields that changed
+    changed: typing.Dict[str, typing.Tuple[common.WebsiteMonitorConfig, set]]
 
-def parse_websites_json(filename):
-    if not filename:
+
+def diff_monitor_configs(old_configs, new_configs):
+    added = {k: c for k, c in new_configs.items() if k not in old_configs}
+    removed = {k: c for k, c in old_configs.items() if k not in new_configs}
+    changed = {}
+    for key in old_configs.keys() & new_configs.keys():
+        old_config, new_config = old_configs[key], new_configs[key]
+        if old_config == new_config:
+            continue
+        old_values, new_values = old_config.as_dict(), new_config.as_dict()
+        changed_fields = {f for f in old_values if old_values[f] != new_values[f]}
+        changed[key] = (new_config, changed_fields)
+    return ConfigDiff(added=added, removed=removed, changed=changed)
+
+
+def load_websites(path):
+    return dict(parse_websites(path))
+
+
+def parse_websites(path):
+    """ Parse monitor configs from a file or a directory of files.
+
+    The files can be a JSON object keyed by monitor, or JSON Lines (.jsonl or
+    .ndjson) with one monitor per line, which is parsed incrementally.
+    """
+    if not path:
         return
 
+    if os.path.isdir(path):
+        for filename in sorted(os.listdir(path)):
+            if filename.endswith(WEBSITES_EXTENSIONS):
+                yield from parse_websites(os.path.join(path, filename))
+    elif path.endswith((".jsonl", ".ndjson")):
+        yield from parse_websites_jsonl(path)
+    else:
+        yield from parse_websites_json(path)
+
+
+def _make_monitor_config(key, config, source):
+    if "url" not in config:
+        config["url"] = key
+    # The job keeps its identity if the URL changes
+    config.setdefault("key", key)
+    config["source"] = source
+    return common.WebsiteMonitorConfig(**config)
+
+
+def parse_websites_json(filename):
     with open(filename) as f:
         websites_data = json.load(f)
 
     for key, config in websites_data.items():
-        if "url" not in config:
-            config["url"] = key
-        config["source"] = filename
-        yield key, common.WebsiteMonitorConfig(**config)
+        yield key, _make_monitor_config(key, config, filename)
+
+
+def parse_websites_jsonl(filename):
+    with open(filename) as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                config = json.loads(line)
+                key = config.get("key") or config["url"]
+                yield key, _make_monitor_config(key, config, filename)
+            except (ValueError, KeyError, TypeError) as exc:
+                raise ValueError(f"{filename}:{line_number}: {exc!r}") from exc
@@ -0,0 +1,190 @@
+"""
+Aggregate check results in memory, and serve them to Prometheus.
+
+Each result updates its monitor's counters and latency histogram in constant
+time, so serving /metrics costs the same however many checks have run. The
+histogram buckets are fixed, and only made cumulative when scraped.
+"""
+import asyncio
+import bisect
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the response time buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class MonitorMetrics:
+    __slots__ = (
+        "labels",
+        "online",
+        "offline",
+        "up",
+        "status_code",
+        "last_check",
+        "bucket_counts",
+        "latency_sum",
+        "latency_count",
+    )
+
+    def __init__(self, labels, bucket_count):
+        self.labels = labels
+        self.online = self.offline = 0
+        self.up = self.status_code = self.last_check = None
+        # One more than the buckets, for the +Inf bucket
+        self.bucket_counts = [0] * (bucket_count + 1)
+        self.latency_sum = 0.0
+        self.latency_count = 0
+
+
+class MetricsRegistry:
+    """ Counters and response time histograms, per URL and identifier. """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._monitors = {}
+
+    def record(self, url, identifier, is_online, response_time, status_code):
+        key = (url, identifier or "")
+        monitor = self._monitors.get(key)
+        if monitor is None:
+            labels = f'url="{escape(url)}",identifier="{escape(identifier or "")}"'
+            monitor = MonitorMetrics(labels, len(self.buckets))
+            self._monitors[key] = monitor
+
+        if is_online:
+            monitor.online += 1
+        else:
+            monitor.offline += 1
+        monitor.up = 1 if is_online else 0
+        monitor.status_code = status_code
+        monitor.last_check = time.time()
+        if response_time is not None:
+            monitor.bucket_counts[bisect.bisect_left(self.buckets, response_time)] += 1
+            monitor.latency_sum += response_time
+            monitor.latency_count += 1
+
+    def record_results(self, results):
+        self.record(
+            results.url,
+            results.identifier,
+            results.is_online,
+            results.response_time,
+            results.status_code,
+        )
+
+    def record_dict(self, results):
+        self.record(
+            results["url"],
+            results.get("identifier"),
+            results.get("is_online"),
+            results.get("response_time"),
+            results.get("status_code"),
+        )
+
+    def render(self):
+        """ The metrics in the Prometheus text exposition format. """
+        lines = [
+            "# HELP httpcheck_checks_total Checks made, by outcome",
+            "# TYPE httpcheck_checks_total counter",
+        ]
+        for labels, monitor in self._iter_labels():
+            for outcome in ("online", "offline"):
+                count = getattr(monitor, outcome)
+                lines.append(
+                    f'httpcheck_checks_total{{{labels},outcome="{outcome}"}} {count}'
+                )
+
+        lines += [
+            "# HELP httpcheck_up Whether the last check found the website online",
+            "# TYPE httpcheck_up gauge",
+        ]
+        lines += [
+            f"httpcheck_up{{{labels}}} {m.up}" for labels, m in self._iter_labels()
+        ]
+
+        lines += [
+            "# HELP httpcheck_status_code Status code of the last response",
+            "# TYPE httpcheck_status_code gauge",
+        ]
+        lines += [
+            f"httpcheck_status_code{{{labels}}} {m.status_code}"
+            for labels, m in self._iter_labels()
+            if m.status_code is not None
+        ]
+
+        lines += [
+            "# HELP httpcheck_last_check_timestamp_seconds Time of the last check",
+            "# TYPE httpcheck_last_check_timestamp_seconds gauge",
+        ]
+        lines += [
+            f"httpcheck_last_check_timestamp_seconds{{{labels}}} {m.last_check:.3f}"
+            for labels, m in self._iter_labels()
+        ]
+
+        lines += [
+            "# HELP httpcheck_response_time_seconds Time taken to get the response",
+            "# TYPE httpcheck_response_time_seconds histogram",
+        ]
+        bounds = [format_float(bound) for bound in self.buckets] + ["+Inf"]
+        for labels, monitor in self._iter_labels():
+            cumulative = 0
+            for bound, count in zip(bounds, monitor.bucket_counts):
+                cumulative += count
+                lines.append(
+                    f'httpcheck_response_time_seconds_bucket{{{labels},le="{bound}"}}'
+                    f" {cumulative}"
+                )
+            lines.append(
+                f"httpcheck_response_time_seconds_sum{{{labels}}} {monitor.latency_sum}"
+            )
+            lines.append(
+                f"httpcheck_response_time_seconds_count{{{labels}}}"
+                f" {monitor.latency_count}"
+            )
+        lines.append("")
+        return "\n".join(lines).encode("utf8")
+
+    def _iter_labels(self):
+        for monitor in self._monitors.values():
+            yield monitor.labels, monitor
+
+
+def escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_float(value):
+    return repr(float(value))
+
+
+async def serve_metrics(registry, host, port):
+    """ Serve the registry's metrics on http://host:port/metrics. """
+
+    async def respond(reader, writer):
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+            method, path = request.split(b" ", 2)[:2]
+            if method == b"GET" and path.split(b"?")[0] == b"/metrics":
+                status, content_type, body = "200 OK", CONTENT_TYPE, registry.render()
+            else:
+                status, content_type, body = "404 Not Found", "text/plain", b""
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+            )
+            writer.write(body)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass  # Not an HTTP request
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(respond, host, port)
+    logger.info("Serving metrics on http://%s:%d/metrics", host, port)
+    return server
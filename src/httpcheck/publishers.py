@@ -1,9 +1,22 @@
+import asyncio
+import collections
+import concurrent.futures
 import dataclasses
+import json
 import logging
+import os
+import sys
+import typing
+
+from . import common
+from . import encoders
+from . import metrics
+from . import store
 
 
 logger = logging.getLogger(__name__)
 REGISTERED_PUBLISHERS = {}
+OVERFLOW_POLICIES = ("block", "drop-oldest", "spill")
 
 
 def get_publisher(config):
@@ -11,24 +24,159 @@ def get_publisher(config):
     return REGISTERED_PUBLISHERS[backend](config)
 
 
+@dataclasses.dataclass
+class PublisherCounters:
+    queued: int = 0
+    dropped: int = 0
+    spilled: int = 0
+    flushed: int = 0
+
+
 class BasePublisher:
     """ Class that provides a .publish() method that will publish the results.
+
+    Checks hand their results to .submit_results(), which encodes them as JSON
+    (bytes) and passes them on to .submit(). By default these are published
+    immediately, but with a `queue_size` they are put on a bounded queue and a
+    background task writes them out in batches with .write_batch(), so a slow
+    sink never holds up the checks. A batch is written once it has
+    `batch_size` results or its first result has waited `flush_interval`
+    seconds. When the queue is full, the `overflow` policy decides whether to
+    wait for space, drop the oldest result or append it to `spill_filename`.
+    Spilled results are written by a thread of their own, with the file kept
+    open, so an overloaded publisher does not also block the event loop.
     """
 
     key = None
 
     @dataclasses.dataclass(frozen=True)
     class Config:
-        pass
+        queue_size: int = 0
+        batch_size: int = 100
+        flush_interval: float = 0.5
+        overflow: str = "block"
+        spill_filename: typing.Optional[str] = None
+        encoder: str = "json"
 
     def __init__(self, config):
-        relevant_config_keys = {f.name for f in dataclasses.fields(self.Config)}
-        relevant_config = {k: v for k, v in config.items() if k in relevant_config_keys}
-        self.config = self.Config(**relevant_config)
+        self.config = common.build_config(self.Config, config)
+        if self.config.overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {self.config.overflow}")
+        if self.config.overflow == "spill" and not self.config.spill_filename:
+            raise ValueError("The spill overflow policy needs a spill_filename")
+        self.encode = encoders.get_encoder(self.config.encoder)
+        self.counters = PublisherCounters()
+        self._queue = None
+        self._drain_task = None
+        self._spill_executor = None
+        self._spill_file = None
 
     def publish(self, msg):
         pass
 
+    async def astart(self):
+        """ Start anything that must be ready before the first results. """
+
+    def write_batch(self, msgs):
+        for msg in msgs:
+            self.publish(msg)
+
+    async def submit_results(self, results):
+        await self.submit(self.encode(results))
+
+    async def submit_encoded(self, msg):
+        """ Publish results that were already encoded, eg. by a worker. """
+        await self.submit(msg)
+
+    async def submit_record(self, record):
+        """ Publish a record other than check results, eg. statistics. """
+        await self.submit(json.dumps(record).encode("utf8"))
+
+    async def submit(self, msg):
+        if not self.config.queue_size:
+            self.publish(msg)
+            return
+
+        if self._drain_task is None:
+            self._queue = asyncio.Queue(self.config.queue_size)
+            self._drain_task = asyncio.ensure_future(self._drain())
+
+        if self._queue.full():
+            if self.config.overflow == "drop-oldest":
+                self._queue.get_nowait()
+                self._queue.task_done()
+                self.counters.dropped += 1
+            elif self.config.overflow == "spill":
+                await self._spill(msg)
+                return
+
+        await self._queue.put(msg)
+        self.counters.queued += 1
+
+    async def _spill(self, msg):
+        if self._spill_executor is None:
+            # A single thread, so spilled results are written in order
+            self._spill_executor = concurrent.futures.ThreadPoolExecutor(
+                1, thread_name_prefix="httpcheck-spill"
+            )
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(self._spill_executor, self._write_spill, msg)
+        self.counters.spilled += 1
+
+    def _write_spill(self, msg):
+        if self._spill_file is None:
+            self._spill_file = open(self.config.spill_filename, "ab")
+        self._spill_file.write(msg + b"\n")
+        self._spill_file.flush()
+
+    def _close_spill(self):
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+
+    async def _drain(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.config.flush_interval
+            while len(batch) < self.config.batch_size:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    msg = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(msg)
+
+            try:
+                await loop.run_in_executor(None, self.write_batch, batch)
+            except Exception:
+                logger.exception("Failed to publish %d results", len(batch))
+            else:
+                self.counters.flushed += len(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def aclose(self):
+        """ Wait for queued results to be published and stop the background task.
+        """
+        if self._spill_executor is not None:
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(self._spill_executor, self._close_spill)
+            self._spill_executor.shutdown()
+            self._spill_executor = None
+        if self._drain_task is None:
+            return
+        await self._queue.join()
+        self._drain_task.cancel()
+        self._drain_task = None
+        logger.info("Publisher finished: %s", self.counters)
+
     def close(self):
         pass
 
@@ -47,4 +195,147 @@ class ConsolePublisher(BasePublisher):
     key = "console"
 
     def publish(self, data):
-        print(data, flush=True)
+        self.write_batch([data])
+
+    def write_batch(self, msgs):
+        # A single write for the whole batch
+        data = b"".join(msg + b"\n" for msg in msgs)
+        sys.stdout.flush()
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
+
+
+class PipePublisher(BasePublisher):
+    """ Write results to a file descriptor, eg. a worker's pipe to its supervisor.
+    """
+
+    key = "pipe"
+
+    @dataclasses.dataclass(frozen=True)
+    class Config(BasePublisher.Config):
+        fd: int = 1
+
+    def publish(self, data):
+        self.write_batch([data])
+
+    def write_batch(self, msgs):
+        data = memoryview(b"".join(msg + b"\n" for msg in msgs))
+        while data:
+            written = os.write(self.config.fd, data)
+            data = data[written:]
+
+
+class PrometheusPublisher(ConsolePublisher):
+    """ Print the results, and also serve metrics aggregated from them.
+
+    Prometheus can scrape the counters and response time histograms of every
+    monitor from http://metrics_host:metrics_port/metrics.
+    """
+
+    key = "prometheus"
+
+    @dataclasses.dataclass(frozen=True)
+    class Config(BasePublisher.Config):
+        metrics_host: str = "127.0.0.1"
+        metrics_port: int = 9179
+        latency_buckets: typing.Tuple[float, ...] = metrics.DEFAULT_BUCKETS
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.registry = metrics.MetricsRegistry(self.config.latency_buckets)
+        self._server = None
+
+    async def astart(self):
+        """ Serve metrics from startup, before the first check has finished. """
+        if self._server is not None:
+            return
+        try:
+            self._server = await metrics.serve_metrics(
+                self.registry, self.config.metrics_host, self.config.metrics_port
+            )
+        except OSError as exc:
+            logger.error("Not serving metrics: %s", exc)
+
+    async def submit_results(self, results):
+        self.registry.record_results(results)
+        await super().submit_results(results)
+
+    async def submit_encoded(self, msg):
+        results = json.loads(msg)
+        if "record" not in results:  # Only check results are aggregated
+            self.registry.record_dict(results)
+        await super().submit_encoded(msg)
+
+    async def aclose(self):
+        await super().aclose()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+
+class StorePublisher(ConsolePublisher):
+    """ Print the results, and also append them to a local result store.
+
+    The store keeps the results when nothing is reading stdout, and answers
+    queries about them with `httpcheck-query`. Check results are stored from
+    the results themselves (only results encoded by a worker are decoded), and
+    appended to the store with the next batch that is written.
+    """
+
+    key = "store"
+
+    @dataclasses.dataclass(frozen=True)
+    class Config(BasePublisher.Config):
+        store_directory: typing.Optional[str] = None
+        segment_duration: int = 3600
+        retention: float = 7 * store.DAY
+
+    def __init__(self, config):
+        super().__init__(config)
+        if not self.config.store_directory:
+            raise ValueError("The store publisher needs a store_directory")
+        self.store = store.ResultStore(
+            self.config.store_directory,
+            segment_duration=self.config.segment_duration,
+            retention=self.config.retention,
+        )
+        # Check results waiting for the next batch (appended to from the event
+        # loop, and taken from by the thread writing the batch)
+        self._unstored = collections.deque()
+
+    async def submit_results(self, results):
+        self._unstored.append(results.as_dict())
+        await super().submit_results(results)
+
+    async def submit_encoded(self, msg):
+        results = json.loads(msg)
+        if "record" not in results:  # Only check results are stored
+            self._unstored.append(results)
+        await super().submit_encoded(msg)
+
+    def write_batch(self, msgs):
+        super().write_batch(msgs)
+        self._store_results()
+
+    def _store_results(self):
+        results = []
+        while self._unstored:
+            results.append(self._unstored.popleft())
+        if results:
+            self.store.append(results)
+
+    def close(self):
+        # Eg. results whose messages were dropped or spilled
+        self._store_results()
+        self.store.close()
+
+
+class PrometheusStorePublisher(PrometheusPublisher, StorePublisher):
+    """ Serve metrics aggregated from the results, and also store them. """
+
+    key = "prometheus-store"
+
+    @dataclasses.dataclass(frozen=True)
+    class Config(PrometheusPublisher.Config, StorePublisher.Config):
+        pass
@@ -0,0 +1,75 @@
+"""
+Decide when and whether a failed request is tried again.
+
+Retries wait an exponentially growing, randomly jittered delay, so that
+retries of many monitors do not all hit a struggling website at once. Each
+monitor configures which errors and status codes are retried, an overall
+deadline for all of its attempts, and optionally hedging: when a request is
+slower than most of the monitor's recent requests, a second one is started
+and whichever answers first is used. The recent response times are kept by
+the client pool, and forgotten when the monitor is no longer scheduled.
+"""
+import collections
+import random
+
+from .stats import percentile
+
+# Recent response times kept per hedged monitor
+HISTORY_SIZE = 100
+# Response times needed before a monitor's requests are hedged
+MIN_HISTORY = 10
+
+
+def is_retryable_error(config, exc):
+    """ Whether the config retries this exception, or the one it wraps. """
+    exc = exc.__cause__ or exc
+    return any(cls.__name__ in config.retry_errors for cls in type(exc).__mro__)
+
+
+def is_retryable(config, results, exc=None):
+    """ Whether an attempt that raised exc, or gave results, should be retried. """
+    if exc is not None:
+        return is_retryable_error(config, exc)
+    return results.status_code in config.retry_statuses
+
+
+def backoff_delay(config, retry_idx, retry_after=None, rand=random):
+    """ Seconds to wait before the given retry (counting from 0).
+
+    The delay is drawn uniformly up to an exponentially growing cap ("full
+    jitter"), and is at least the Retry-After the website asked for, within
+    retry_max_delay.
+    """
+    cap = min(config.retry_backoff * 2 ** retry_idx, config.retry_max_delay)
+    delay = rand.uniform(0, cap)
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, config.retry_max_delay))
+    return delay
+
+
+class LatencyHistory:
+    """ Recent response times of each hedged monitor, to decide when to hedge. """
+
+    def __init__(self, size=HISTORY_SIZE, min_size=MIN_HISTORY):
+        self.size = size
+        self.min_size = min_size
+        self._times = {}
+
+    def __len__(self):
+        return len(self._times)
+
+    def add(self, key, response_time):
+        times = self._times.get(key)
+        if times is None:
+            times = self._times[key] = collections.deque(maxlen=self.size)
+        times.append(response_time)
+
+    def hedge_delay(self, key, fraction):
+        """ Seconds after which to hedge, or None until enough are recorded. """
+        times = self._times.get(key)
+        if times is None or len(times) < self.min_size:
+            return None
+        return percentile(times, fraction)
+
+    def forget(self, key):
+        self._times.pop(key, None)
@@ -1,57 +1,489 @@
+import asyncio
 import dataclasses
+import datetime
+import hashlib
+import heapq
+import itertools
+import logging
+import random
+import time
 import typing
 
-from apscheduler.jobstores.base import JobLookupError
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.schedulers.base import BaseScheduler
+import pytz
+
+from . import adaptive as adaptive_module
+from . import common
+from . import limits
+from . import stats as stats_module
+
+try:
+    from apscheduler.events import EVENT_JOB_MAX_INSTANCES
+    from apscheduler.events import EVENT_JOB_MISSED
+    from apscheduler.events import EVENT_JOB_SUBMITTED
+    from apscheduler.jobstores.base import JobLookupError
+    from apscheduler.schedulers.asyncio import AsyncIOScheduler
+    from apscheduler.triggers.interval import IntervalTrigger
+except ImportError:  # APScheduler is an optional dependency
+    AsyncIOScheduler = None
+
+logger = logging.getLogger(__name__)
+
+STAGGER_MODES = ("none", "even", "hash")
+
+
+class APSchedulerBackend:
+    """ Run jobs using APScheduler's AsyncIOScheduler.
+
+    APScheduler's events report when each run was intended to start, and the
+    runs that it missed (later than the misfire grace time) or skipped (the
+    previous run was still going). Coalesced runs are the gaps between the
+    intended starts of consecutive runs.
+    """
+
+    def __init__(self, scheduler=None):
+        if AsyncIOScheduler is None:
+            raise RuntimeError(
+                "APScheduler is not installed, use the native scheduler backend"
+            )
+        self.scheduler = scheduler or AsyncIOScheduler()
+        self.stats = None
+        self._intervals = {}
+        self._last_run_times = {}
+
+    def start(self):
+        if self.stats is not None:
+            self.scheduler.add_listener(
+                self._on_event,
+                EVENT_JOB_SUBMITTED | EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES,
+            )
+        self.scheduler.start()
+
+    def _on_event(self, event):
+        interval = self._intervals.get(event.job_id)
+        if interval is None:
+            return  # Not a repeating job
+        if event.code == EVENT_JOB_MISSED:
+            self.stats.missed += 1
+        elif event.code == EVENT_JOB_MAX_INSTANCES:
+            self.stats.skipped += 1
+        else:
+            run_time = event.scheduled_run_times[-1].timestamp()
+            last_run_time = self._last_run_times.get(event.job_id)
+            self._last_run_times[event.job_id] = run_time
+            if last_run_time is not None:
+                missed_runs = round((run_time - last_run_time) / interval) - 1
+                self.stats.coalesced += max(0, missed_runs)
+            intended = time.monotonic() - (time.time() - run_time)
+            self.stats.job_launched(event.job_id, intended)
+
+    def stop(self):
+        self.scheduler.shutdown(wait=False)
+
+    def _get_trigger(self, interval, start_delay, jitter):
+        start_date = datetime.datetime.now(pytz.utc)
+        start_date += datetime.timedelta(seconds=start_delay)
+        return IntervalTrigger(
+            seconds=interval,
+            start_date=start_date,
+            timezone=pytz.utc,
+            jitter=jitter or None,
+        )
+
+    def run_soon(self, fn, args):
+        self.scheduler.add_job(fn, args=args)
+
+    def add_job(self, job_id, fn, args, interval, start_delay, jitter=0):
+        self._intervals[job_id] = interval
+        self._last_run_times.pop(job_id, None)
+        self.scheduler.add_job(
+            fn,
+            trigger=self._get_trigger(interval, start_delay, jitter),
+            args=args,
+            id=job_id,
+            replace_existing=True,
+        )
+
+    def reschedule_job(self, job_id, interval, start_delay=None, jitter=0):
+        job = self.scheduler.get_job(job_id)
+        if job is None:
+            return False
+        if start_delay is None:
+            next_run_time = getattr(job, "next_run_time", None)
+            if next_run_time is None:
+                start_delay = interval
+            else:
+                now = datetime.datetime.now(pytz.utc)
+                remaining = (next_run_time - now).total_seconds()
+                old_interval = job.trigger.interval.total_seconds()
+                start_delay = keep_phase(remaining, old_interval, interval)
+        trigger = self._get_trigger(interval, start_delay, jitter)
+        self.scheduler.reschedule_job(job_id, trigger=trigger)
+        self._intervals[job_id] = interval
+        self._last_run_times.pop(job_id, None)
+        return True
+
+    def update_job(self, job_id, args):
+        try:
+            self.scheduler.modify_job(job_id, args=args)
+        except JobLookupError:
+            return False
+        return True
+
+    def remove_job(self, job_id):
+        self._intervals.pop(job_id, None)
+        self._last_run_times.pop(job_id, None)
+        try:
+            self.scheduler.remove_job(job_id)
+        except JobLookupError:
+            pass
+
+
+@dataclasses.dataclass(eq=False)
+class _Job:
+    fn: typing.Callable
+    args: typing.List
+    job_id: typing.Optional[str] = None
+    interval: typing.Optional[float] = None
+    jitter: float = 0
+    base_time: float = 0
+    seq: int = 0
+    cancelled: bool = False
+    task: typing.Optional[asyncio.Task] = None
+
+
+class NativeBackend:
+    """ Run jobs using a heap of jobs keyed by their next fire time.
+
+    This runs directly on the asyncio loop with a single timer armed for the
+    earliest job. Adding or rescheduling a job is O(log n) and removing one is
+    O(1): outdated heap entries are skipped when they reach the top.
+
+    Like APScheduler, a job is skipped while its previous run is still going
+    and missed runs are coalesced into one.
+    """
+
+    def __init__(self):
+        self.stats = None
+        self._jobs = {}
+        self._heap = []
+        self._counter = itertools.count()
+        self._loop = None
+        self._timer = None
+        self._timer_deadline = None
+        self._tasks = set()
+
+    def start(self):
+        self._loop = asyncio.get_event_loop()
+        self._arm()
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = self._timer_deadline = None
+        self._loop = None
+        for task in self._tasks:
+            task.cancel()
+
+    def run_soon(self, fn, args):
+        self._push(_Job(fn, args), time.monotonic())
+
+    def add_job(self, job_id, fn, args, interval, start_delay, jitter=0):
+        self.remove_job(job_id)
+        job = _Job(fn, args, job_id=job_id, interval=interval, jitter=jitter)
+        self._jobs[job_id] = job
+        self._push(job, time.monotonic() + start_delay)
+
+    def reschedule_job(self, job_id, interval, start_delay=None, jitter=0):
+        job = self._jobs.get(job_id)
+        if job is None:
+            return False
+        now = time.monotonic()
+        if start_delay is None:
+            start_delay = keep_phase(job.base_time - now, job.interval, interval)
+        job.interval = interval
+        job.jitter = jitter
+        self._push(job, now + start_delay)
+        return True
+
+    def update_job(self, job_id, args):
+        job = self._jobs.get(job_id)
+        if job is None:
+            return False
+        job.args = args
+        return True
+
+    def remove_job(self, job_id):
+        job = self._jobs.pop(job_id, None)
+        if job is not None:
+            job.cancelled = True
+
+    def _push(self, job, base_time):
+        job.base_time = base_time
+        job.seq = next(self._counter)
+        deadline = base_time
+        if job.jitter:
+            deadline += random.uniform(-job.jitter, job.jitter)
+        heapq.heappush(self._heap, (deadline, job.seq, job))
+
+        if self._loop is None:
+            return
+        if self._timer_deadline is None or deadline < self._timer_deadline:
+            self._arm()
+
+    def _is_stale(self, entry):
+        deadline, seq, job = entry
+        return job.cancelled or seq != job.seq
+
+    def _arm(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = self._timer_deadline = None
+
+        while self._heap and self._is_stale(self._heap[0]):
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return
+
+        deadline = self._heap[0][0]
+        delay = max(0, deadline - time.monotonic())
+        self._timer_deadline = deadline
+        self._timer = self._loop.call_later(delay, self._fire)
+
+    def _fire(self):
+        self._timer = self._timer_deadline = None
+        now = time.monotonic()
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            if self._is_stale(entry):
+                continue
+            deadline, seq, job = entry
+            self._launch(job, deadline)
+            if job.interval:
+                next_time = job.base_time + job.interval
+                if next_time <= now:
+                    missed = (now - next_time) // job.interval + 1
+                    next_time += missed * job.interval
+                    if self.stats is not None:
+                        self.stats.coalesced += int(missed)
+                self._push(job, next_time)
+        self._arm()
+
+    def _launch(self, job, deadline):
+        if job.task is not None and not job.task.done():
+            logger.warning("Skipping run of %s: previous run still going", job.job_id)
+            if self.stats is not None:
+                self.stats.skipped += 1
+            return
+        if self.stats is not None and job.job_id is not None:
+            self.stats.job_launched(job.job_id, deadline)
+        job.task = self._loop.create_task(job.fn(*job.args))
+        self._tasks.add(job.task)
+        job.task.add_done_callback(self._job_done)
+
+    def _job_done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Job raised an exception", exc_info=task.exception())
+
+
+BACKENDS = {"native": NativeBackend, "apscheduler": APSchedulerBackend}
+DEFAULT_BACKEND = "native" if AsyncIOScheduler is None else "apscheduler"
+
+
+def make_backend(name=DEFAULT_BACKEND):
+    return BACKENDS[name]()
 
 
 @dataclasses.dataclass(frozen=True)
 class Scheduler:
-    """A Facade providing simplified access to the implementation (apscheduler)
+    """A Facade providing simplified access to the implementation (a backend)
+
+    The first run of each monitor can be staggered across its period, so that
+    monitors sharing a frequency do not all fire at the same moment:
+
+     * "none" runs every monitor immediately
+     * "even" spreads monitors evenly across the period, in the order they are
+       scheduled
+     * "hash" derives the offset from the monitor key and anchors it to the
+       wall clock, so the spread is the same across restarts and replicas
+
+    Every run can also be moved by up to `jitter` seconds (bounded by half of
+    the monitor's frequency).
+
+    With `stats`, the backend reports the intended start of each run, so the
+    scheduler can record how late it actually started.
+
+    With an `adaptive` policy, the results returned by job_fn can move the next
+    run of the monitor earlier or later than its regular schedule.
     """
 
     job_fn: typing.Callable
-    scheduler: BaseScheduler = dataclasses.field(default_factory=AsyncIOScheduler)
+    backend: typing.Any = dataclasses.field(default_factory=make_backend)
+    limiter: typing.Optional[limits.ConcurrencyLimiter] = None
+    stagger: str = "none"
+    jitter: float = 0
+    stats: typing.Optional[stats_module.SchedulerStats] = None
+    adaptive: typing.Optional[adaptive_module.AdaptivePolicy] = None
+    _stagger_counts: typing.Dict[int, int] = dataclasses.field(
+        default_factory=dict, repr=False
+    )
+    # Jobs whose next run was moved by the adaptive policy
+    _adapted: typing.Set[str] = dataclasses.field(default_factory=set, repr=False)
+
+    def __post_init__(self):
+        if self.stagger not in STAGGER_MODES:
+            raise ValueError(f"Unknown stagger mode: {self.stagger}")
+        self.backend.stats = self.stats
 
     def start(self):
-        self.scheduler.start()
+        self.backend.start()
+
+    def stop(self):
+        self.backend.stop()
 
     def _get_job_id(self, monitor_config):
-        key = monitor_config.key or monitor_config.url
-        return f"httpcheck:{key}"
+        return get_job_id(monitor_config)
+
+    async def _run_job(self, monitor_config):
+        if self.stats is None:
+            return await self._run_job_in_slot(monitor_config)
+        self.stats.job_started(self._get_job_id(monitor_config))
+        self.stats.in_flight += 1
+        try:
+            return await self._run_job_in_slot(monitor_config)
+        finally:
+            self.stats.in_flight -= 1
+            self.stats.job_finished()
+
+    async def _run_job_in_slot(self, monitor_config):
+        if self.limiter is None:
+            results = await self.job_fn(monitor_config)
+        else:
+            async with self.limiter.slot(monitor_config):
+                results = await self.job_fn(monitor_config)
+        if self.adaptive is not None and results is not None:
+            self._adapt(monitor_config, results)
+        return results
+
+    def _adapt(self, monitor_config, results):
+        job_id = self._get_job_id(monitor_config)
+        delay = self.adaptive.next_delay(job_id, monitor_config, results)
+        if delay is not None:
+            self._adapted.add(job_id)
+        elif job_id in self._adapted:
+            # Return to the regular schedule
+            self._adapted.discard(job_id)
+            delay = monitor_config.frequency
+            if self.stagger == "hash":
+                delay = self.get_first_run_delay(monitor_config)
+        else:
+            return
+        self.backend.reschedule_job(
+            job_id,
+            interval=monitor_config.frequency,
+            start_delay=delay,
+            jitter=self._get_jitter(monitor_config),
+        )
+
+    async def run_once(self, monitor_config):
+        await self._run_job(monitor_config)
+
+    def get_first_run_delay(self, monitor_config, now=None):
+        """ Seconds to wait before the first run of this monitor. """
+        frequency = monitor_config.frequency
+        if self.stagger == "even":
+            index = self._stagger_counts.get(frequency, 0)
+            self._stagger_counts[frequency] = index + 1
+            return van_der_corput(index) * frequency
+        if self.stagger == "hash":
+            now = time.time() if now is None else now
+            phase = hash_fraction(self._get_job_id(monitor_config)) * frequency
+            return (phase - now) % frequency
+        return 0
 
-    def run_once(self, monitor_config):
-        self.scheduler.add_job(self.job_fn, args=[monitor_config])
+    def _get_jitter(self, monitor_config):
+        return min(self.jitter, monitor_config.frequency / 2)
 
     def schedule(self, monitor_config):
         job_id = self._get_job_id(monitor_config)
 
-        # Run immediately, AsyncScheduler does not start with an immediate job
-        self.run_once(monitor_config)
+        if self.stagger == "none":
+            # Run immediately, the repeating job only starts after one interval
+            self.backend.run_soon(self._run_job, [monitor_config])
+            start_delay = monitor_config.frequency
+        else:
+            start_delay = self.get_first_run_delay(monitor_config)
 
         # Schedule repeats
-        self.scheduler.add_job(
-            self.job_fn,
-            trigger="interval",
-            seconds=monitor_config.frequency,
-            args=[monitor_config],
-            id=job_id,
-            replace_existing=True,
+        self.backend.add_job(
+            job_id,
+            self._run_job,
+            [monitor_config],
+            interval=monitor_config.frequency,
+            start_delay=start_delay,
+            jitter=self._get_jitter(monitor_config),
         )
 
     def reschedule(self, monitor_config):
+        """ Apply a new frequency, keeping the time since the last run. """
         job_id = self._get_job_id(monitor_config)
-        try:
-            self.scheduler.reschedule_job(
-                job_id, trigger="interval", seconds=monitor_config.frequency
-            )
-        except JobLookupError:
+        start_delay = None
+        if self.stagger == "hash":
+            start_delay = self.get_first_run_delay(monitor_config)
+        rescheduled = self.backend.reschedule_job(
+            job_id,
+            interval=monitor_config.frequency,
+            start_delay=start_delay,
+            jitter=self._get_jitter(monitor_config),
+        )
+        if rescheduled:
+            self.backend.update_job(job_id, [monitor_config])
+        else:
+            self.schedule(monitor_config)
+
+    def update(self, monitor_config):
+        """ Use a changed config for future runs, without moving the schedule. """
+        job_id = self._get_job_id(monitor_config)
+        if not self.backend.update_job(job_id, [monitor_config]):
             self.schedule(monitor_config)
 
     def unschedule(self, monitor_config):
         job_id = self._get_job_id(monitor_config)
-        try:
-            self.scheduler.remove_job(job_id)
-        except JobLookupError:
-            pass
+        self.backend.remove_job(job_id)
+        self._adapted.discard(job_id)
+        if self.adaptive is not None:
+            self.adaptive.forget(job_id)
+
+
+def get_job_id(monitor_config):
+    return f"httpcheck:{common.get_monitor_key(monitor_config)}"
+
+
+def keep_phase(remaining, old_interval, new_interval):
+    """ Delay before the next run after an interval change.
+
+    The time since the previous run (old_interval - remaining) is kept, so a
+    reloaded monitor neither runs early nor loses its place in the spread.
+    """
+    elapsed = old_interval - remaining
+    return max(0, new_interval - elapsed)
+
+
+def hash_fraction(key):
+    """ A stable number in [0, 1) derived from the key. """
+    digest = hashlib.sha1(key.encode("utf8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2 ** 64
+
+
+def van_der_corput(index):
+    """ The index-th number in the base 2 van der Corput sequence.
+
+    Each new value falls into the largest gap left by the previous ones, so
+    any number of monitors are spread evenly without knowing the total count.
+    """
+    fraction, denominator = 0.0, 1
+    while index:
+        denominator *= 2
+        index, remainder = divmod(index, 2)
+        fraction += remainder / denominator
+    return fraction
@@ -0,0 +1,109 @@
+"""
+Decide which monitors are checked by this process.
+
+Monitors are identified by their scheduler job id, so ownership follows the
+same identity as the schedule: a monitor keeps its owner when its URL changes.
+
+A `Shard` is a fixed partition (of worker processes, or of nodes started with
+--shard-index/--shard-count). A `Membership` assigns monitors to the nodes
+listed in a shared file by rendezvous hashing, so when a node is removed from
+the file only its monitors move, to the remaining nodes.
+"""
+import dataclasses
+import hashlib
+import heapq
+import logging
+
+from . import scheduler
+
+logger = logging.getLogger(__name__)
+
+
+def key_hash(key):
+    digest = hashlib.sha1(key.encode("utf8")).digest()
+    return int.from_bytes(digest[:8], "big")
+
+
+def jump_hash(key, bucket_count):
+    """ Jump consistent hash (Lamping & Veach), mapping a key to a bucket.
+
+    When the number of buckets changes from n to n+1, only 1/(n+1) of the keys
+    move to a different bucket.
+    """
+    key = key_hash(key)
+    bucket, candidate = -1, 0
+    while candidate < bucket_count:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) % 2 ** 64
+        candidate = int((bucket + 1) * (2 ** 31 / ((key >> 33) + 1)))
+    return bucket
+
+
+def rendezvous_owners(key, members, replicas=1):
+    """ The `replicas` members with the highest score for this key. """
+    return heapq.nlargest(
+        replicas, members, key=lambda member: key_hash(f"{member}\0{key}")
+    )
+
+
+def read_members(filename):
+    """ Read node names from a file, one per line, ignoring # comments. """
+    with open(filename) as f:
+        lines = (line.split("#", 1)[0].strip() for line in f)
+        return tuple(sorted({line for line in lines if line}))
+
+
+@dataclasses.dataclass(frozen=True)
+class Shard:
+    """ One of `count` partitions of the monitors, by consistent hash.
+
+    With replicas, each monitor is also owned by the shards that follow its
+    primary shard.
+    """
+
+    index: int
+    count: int
+    replicas: int = 1
+    # Partitions with different salts are independent of each other
+    salt: str = ""
+
+    def __post_init__(self):
+        if not 0 <= self.index < self.count:
+            raise ValueError(f"Shard index {self.index} is not in 0..{self.count - 1}")
+        if not 1 <= self.replicas <= self.count:
+            raise ValueError(f"Replicas {self.replicas} is not in 1..{self.count}")
+
+    def owns(self, monitor_config):
+        job_id = scheduler.get_job_id(monitor_config)
+        primary = jump_hash(self.salt + job_id, self.count)
+        return (self.index - primary) % self.count < self.replicas
+
+
+@dataclasses.dataclass
+class Membership:
+    """ Own monitors by rendezvous hash, among the nodes listed in a file.
+
+    The file is shared by the nodes, and is reloaded periodically: removing a
+    node that is down moves its monitors to the other nodes.
+    """
+
+    filename: str
+    node: str
+    replicas: int = 1
+    # Seconds between reloading the members file (0 for never)
+    refresh_interval: float = 10
+    members: tuple = ()
+
+    def reload(self):
+        """ Read the members file again, returning whether the members changed. """
+        members = read_members(self.filename)
+        if members == self.members:
+            return False
+        self.members = members
+        if self.node not in members:
+            logger.warning("Node %r is not a cluster member", self.node)
+        return True
+
+    def owns(self, monitor_config):
+        job_id = scheduler.get_job_id(monitor_config)
+        return self.node in rendezvous_owners(job_id, self.members, self.replicas)
@@ -0,0 +1,115 @@
+"""
+Measure how well httpcheck itself keeps up with its schedule.
+
+A late check is either the target's fault or httpcheck's: this records, for
+every scheduled run, how late it started compared to its intended time, as
+well as runs the scheduler backend missed, coalesced or skipped, the number
+of checks in flight and how late the event loop wakes up from a short sleep.
+"""
+import asyncio
+import collections
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Seconds between event loop lag probes
+LOOP_PROBE_INTERVAL = 0.5
+# Minimum seconds between two warnings about lag
+WARNING_INTERVAL = 60
+# Most recent schedule lags kept for the percentiles of each period, so memory
+# stays bounded when no snapshots are taken
+MAX_LAG_SAMPLES = 10000
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+class SchedulerStats:
+    """ Collect scheduling statistics, summarised by snapshot() each period.
+
+    Schedule lag percentiles are taken over the last MAX_LAG_SAMPLES runs of
+    the period, and its maximum over all of them. Event loop lag is summarised
+    by its mean and maximum over every probe of the period.
+
+    Backends call job_launched() with the intended start of each run (on the
+    time.monotonic() clock), and the scheduler calls job_started() when the
+    run actually starts.
+    """
+
+    def __init__(self, lag_warning=1.0):
+        self.lag_warning = lag_warning
+        self.in_flight = 0
+        self._intended = {}
+        self._last_warning = None
+        self.reset()
+
+    def reset(self):
+        self.period_start = time.monotonic()
+        self.started = 0
+        self.finished = 0
+        self.missed = 0
+        self.coalesced = 0
+        self.skipped = 0
+        self.lags = collections.deque(maxlen=MAX_LAG_SAMPLES)
+        self.lag_max = 0
+        self.loop_lag_count = 0
+        self.loop_lag_total = 0
+        self.loop_lag_max = 0
+
+    def job_launched(self, job_id, intended):
+        self._intended[job_id] = intended
+
+    def job_started(self, job_id):
+        self.started += 1
+        intended = self._intended.pop(job_id, None)
+        if intended is not None:
+            lag = time.monotonic() - intended
+            self.lags.append(lag)
+            self.lag_max = max(self.lag_max, lag)
+            self._check_lag(lag, "Check of %s started %.2fs late", job_id, lag)
+
+    def job_finished(self):
+        self.finished += 1
+
+    def _check_lag(self, lag, message, *args):
+        if not self.lag_warning or lag <= self.lag_warning:
+            return
+        now = time.monotonic()
+        if self._last_warning is None or now - self._last_warning > WARNING_INTERVAL:
+            self._last_warning = now
+            logger.warning(message, *args)
+
+    async def probe_loop_lag(self, interval=LOOP_PROBE_INTERVAL):
+        """ Measure how late the event loop wakes up, forever. """
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(interval)
+            lag = time.monotonic() - start - interval
+            self.loop_lag_count += 1
+            self.loop_lag_total += lag
+            self.loop_lag_max = max(self.loop_lag_max, lag)
+            self._check_lag(lag, "Event loop is %.2fs behind", lag)
+
+    def snapshot(self):
+        """ Summarise the period since the last snapshot, and start a new one. """
+        lags = self.lags or [0]
+        loop_lag_mean = self.loop_lag_total / max(self.loop_lag_count, 1)
+        summary = {
+            "period": round(time.monotonic() - self.period_start, 3),
+            "checks_started": self.started,
+            "checks_finished": self.finished,
+            "checks_in_flight": self.in_flight,
+            "schedule_lag_p50": round(percentile(lags, 0.5), 6),
+            "schedule_lag_p99": round(percentile(lags, 0.99), 6),
+            "schedule_lag_max": round(self.lag_max, 6),
+            "missed": self.missed,
+            "coalesced": self.coalesced,
+            "skipped": self.skipped,
+            "loop_lag_mean": round(loop_lag_mean, 6),
+            "loop_lag_max": round(self.loop_lag_max, 6),
+        }
+        self.reset()
+        return summary
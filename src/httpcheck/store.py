@@ -0,0 +1,424 @@
+"""
+Keep check results in a local, compact append log, and query them.
+
+The store is a directory of segment files, each holding the results of one
+time window as fixed size binary records:
+
+    timestamp     uint32, seconds since the epoch
+    monitor       uint32, the line of the monitor in monitors.jsonl
+    is_online     uint8, 0 or 1 (2 when unknown)
+    status_code   uint16, 0 when there was no response
+    response_time float32, in seconds (NaN when there was no response)
+
+URLs and identifiers are stored once, in monitors.jsonl, so each result takes
+15 bytes. Results are appended to the segment of the current window. Once the
+window has passed, the segment is sealed: its records are sorted by monitor
+and an index of each monitor's records is written next to it, so queries only
+read the records of the monitors and times they ask for. Sealed segments of
+earlier days are compacted into one segment per day, and segments older than
+the retention period are deleted. This maintenance runs in a thread of its
+own, so appending results never waits for it, and compaction merges the
+sorted segments a block at a time rather than reading a whole day at once.
+"""
+import concurrent.futures
+import dataclasses
+import datetime
+import heapq
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+import time
+from typing import Optional
+
+from .stats import percentile
+
+logger = logging.getLogger(__name__)
+
+RECORD = struct.Struct("<IIBHf")
+# The monitor, position and number of its records, and their first and last time
+INDEX_ENTRY = struct.Struct("<IIIII")
+MONITORS_FILENAME = "monitors.jsonl"
+SEGMENT_SUFFIX = ".seg"
+INDEX_SUFFIX = ".idx"
+DAY = 86400
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": DAY, "w": 7 * DAY}
+# Records read at a time when merging segments
+BLOCK_RECORDS = 4096
+
+
+@dataclasses.dataclass(frozen=True)
+class Segment:
+    """ A segment file, named after the window of time it covers. """
+
+    directory: str
+    start: int
+    end: int
+
+    @classmethod
+    def from_filename(cls, directory, filename):
+        start, end = filename[: -len(SEGMENT_SUFFIX)].split("-")
+        return cls(directory, int(start), int(end))
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, f"{self.start:010d}-{self.end:010d}")
+
+    @property
+    def segment_path(self):
+        return self.path + SEGMENT_SUFFIX
+
+    @property
+    def index_path(self):
+        return self.path + INDEX_SUFFIX
+
+    @property
+    def is_sealed(self):
+        return os.path.exists(self.index_path)
+
+    def read_index(self):
+        with open(self.index_path, "rb") as f:
+            data = f.read()
+        return list(INDEX_ENTRY.iter_unpack(data))
+
+    def read_records(self):
+        with open(self.segment_path, "rb") as f:
+            data = f.read()
+        # A crash may have left part of a record at the end
+        data = data[: len(data) - len(data) % RECORD.size]
+        return list(RECORD.iter_unpack(data))
+
+    def iter_records(self):
+        """ The records of the segment, read a block at a time. """
+        block_size = BLOCK_RECORDS * RECORD.size
+        with open(self.segment_path, "rb") as f:
+            while True:
+                data = f.read(block_size)
+                # A crash may have left part of a record at the end
+                data = data[: len(data) - len(data) % RECORD.size]
+                yield from RECORD.iter_unpack(data)
+                if len(data) < block_size:
+                    return
+
+    def write(self, records):
+        """ Write the records sorted by monitor, with their index. """
+        self.write_sorted(sorted(records, key=sort_key))
+
+    def write_sorted(self, records):
+        """ Write records that are already sorted by monitor, with their index. """
+        index = []
+        # Written under temporary names, so a crash leaves no half-sealed segment
+        with open(self.segment_path + ".tmp", "wb") as f:
+            for position, record in enumerate(records):
+                timestamp, monitor = record[:2]
+                if index and index[-1][0] == monitor:
+                    entry = index[-1]
+                    entry[2] += 1
+                    entry[4] = timestamp
+                else:
+                    index.append([monitor, position, 1, timestamp, timestamp])
+                f.write(RECORD.pack(*record))
+        with open(self.index_path + ".tmp", "wb") as f:
+            f.write(b"".join(INDEX_ENTRY.pack(*entry) for entry in index))
+        os.replace(self.segment_path + ".tmp", self.segment_path)
+        os.replace(self.index_path + ".tmp", self.index_path)
+
+    def seal(self):
+        self.write(self.read_records())
+
+    def delete(self):
+        for path in (self.index_path, self.segment_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def sort_key(record):
+    """ Records are sorted by monitor, then by time. """
+    return record[1], record[0]
+
+
+def list_segments(directory):
+    return sorted(
+        (
+            Segment.from_filename(directory, filename)
+            for filename in os.listdir(directory)
+            if filename.endswith(SEGMENT_SUFFIX)
+        ),
+        key=lambda segment: (segment.start, segment.end),
+    )
+
+
+def read_monitors(directory):
+    """ The (url, identifier) of each monitor, by its number. """
+    monitors = []
+    try:
+        with open(os.path.join(directory, MONITORS_FILENAME)) as f:
+            for line in f:
+                try:
+                    url, identifier = json.loads(line)
+                except ValueError:
+                    break  # A line still being written
+                monitors.append((url, identifier))
+    except FileNotFoundError:
+        pass
+    return monitors
+
+
+def to_epoch(timestamp):
+    """ Seconds since the epoch, from an ISO 8601 timestamp. """
+    moment = datetime.datetime.fromisoformat(timestamp)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=datetime.timezone.utc)
+    return int(moment.timestamp())
+
+
+def parse_duration(value):
+    """ Seconds in a duration such as "90", "30m", "12h" or "7d". """
+    value = str(value).strip()
+    unit = DURATION_UNITS.get(value[-1:], None)
+    if unit is None:
+        return float(value)
+    return float(value[:-1]) * unit
+
+
+def parse_time(value, now=None):
+    """ Seconds since the epoch, from a time, or a duration before now. """
+    now = time.time() if now is None else now
+    try:
+        return now - parse_duration(value)
+    except ValueError:
+        return to_epoch(value)
+
+
+class ResultStore:
+    """ Append results to the segments in a directory, and look after them. """
+
+    def __init__(self, directory, segment_duration=3600, retention=7 * DAY):
+        self.directory = directory
+        self.segment_duration = int(segment_duration)
+        self.retention = retention
+        os.makedirs(directory, exist_ok=True)
+        self._monitor_ids = {
+            monitor: i for i, monitor in enumerate(read_monitors(directory))
+        }
+        self._monitors_file = open(os.path.join(directory, MONITORS_FILENAME), "a")
+        self._active = None
+        self._active_file = None
+        # A single thread, so only one maintenance runs at a time
+        self._maintenance_executor = concurrent.futures.ThreadPoolExecutor(
+            1, thread_name_prefix="httpcheck-store"
+        )
+        self._maintenance = None
+
+    def _monitor_id(self, url, identifier):
+        key = (url, identifier or "")
+        monitor_id = self._monitor_ids.get(key)
+        if monitor_id is None:
+            monitor_id = self._monitor_ids[key] = len(self._monitor_ids)
+            self._monitors_file.write(json.dumps(key) + "\n")
+            self._monitors_file.flush()
+        return monitor_id
+
+    def append(self, results, now=None):
+        """ Append results (dicts of check results) to the current segment. """
+        now = int(time.time() if now is None else now)
+        if self._active is None or now >= self._active.end:
+            self._rotate(now)
+        records = []
+        for result in results:
+            is_online = result.get("is_online")
+            response_time = result.get("response_time")
+            records.append(
+                RECORD.pack(
+                    to_epoch(result["timestamp"]),
+                    self._monitor_id(result["url"], result.get("identifier")),
+                    2 if is_online is None else int(is_online),
+                    result.get("status_code") or 0,
+                    math.nan if response_time is None else response_time,
+                )
+            )
+        self._active_file.write(b"".join(records))
+        self._active_file.flush()
+
+    def _rotate(self, now):
+        self._close_active()
+        start = now - now % self.segment_duration
+        self._active = Segment(self.directory, start, start + self.segment_duration)
+        path = self._active.segment_path
+        if os.path.exists(path):
+            # Drop part of a record a crash may have left at the end
+            size = os.path.getsize(path)
+            os.truncate(path, size - size % RECORD.size)
+        self._active_file = open(path, "ab")
+        self._maintenance = self._maintenance_executor.submit(self._maintain, now)
+
+    def _maintain(self, now):
+        try:
+            self.maintain(now)
+        except Exception:
+            logger.exception("Failed to maintain the store in %s", self.directory)
+
+    def wait_for_maintenance(self):
+        """ Wait for the background maintenance started by the last rotation. """
+        if self._maintenance is not None:
+            self._maintenance.result()
+
+    def _close_active(self):
+        if self._active_file is not None:
+            self._active_file.close()
+            self._active_file = self._active = None
+
+    def maintain(self, now=None):
+        """ Seal past segments, compact them by day and apply the retention. """
+        now = time.time() if now is None else now
+        today = int(now) - int(now) % DAY
+        by_day = {}
+        for segment in list_segments(self.directory):
+            if segment.end <= now - self.retention:
+                segment.delete()
+                continue
+            if segment == self._active:
+                continue
+            if not segment.is_sealed and segment.end <= now:
+                segment.seal()
+            if segment.is_sealed and segment.end <= today:
+                by_day.setdefault(segment.start - segment.start % DAY, []).append(
+                    segment
+                )
+
+        for day, segments in by_day.items():
+            if len(segments) == 1 and segments[0].end - segments[0].start == DAY:
+                continue  # Already compacted
+            compact(Segment(self.directory, day, day + DAY), segments)
+
+    def close(self):
+        self._maintenance_executor.shutdown()
+        self._close_active()
+        self._monitors_file.close()
+
+
+def compact(target, segments):
+    """ Replace the sealed segments with one target segment holding their records.
+
+    The records of sealed segments are already sorted, so they are merged as
+    they are read.
+    """
+    records = heapq.merge(*(s.iter_records() for s in segments), key=sort_key)
+    target.write_sorted(records)
+    for segment in segments:
+        if segment != target:
+            segment.delete()
+
+
+def uncovered(segments):
+    """ The segments that are not within the window of another segment. """
+    return [
+        segment
+        for segment in segments
+        if not any(
+            other.start <= segment.start
+            and segment.end <= other.end
+            and other != segment
+            for other in segments
+        )
+    ]
+
+
+@dataclasses.dataclass
+class MonitorSummary:
+    url: str
+    identifier: str
+    checks: int = 0
+    online: int = 0
+    response_times: list = dataclasses.field(default_factory=list)
+
+    def add(self, records):
+        for timestamp, monitor, is_online, status_code, response_time in records:
+            self.checks += 1
+            self.online += is_online == 1
+            if not math.isnan(response_time):
+                self.response_times.append(response_time)
+
+    def as_dict(self):
+        times = self.response_times
+        summary = {
+            "url": self.url,
+            "identifier": self.identifier,
+            "checks": self.checks,
+            "uptime": round(self.online / self.checks, 6) if self.checks else None,
+        }
+        for name, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+            value = round(percentile(times, fraction), 6) if times else None
+            summary[f"response_time_{name}"] = value
+        return summary
+
+
+def query(
+    directory,
+    since,
+    until,
+    url: Optional[str] = None,
+    identifier: Optional[str] = None,
+):
+    """ Summarise the uptime and response times of the monitors in a time range.
+
+    Sealed segments are memory mapped, and only the records of the matching
+    monitors in the range are read. Segments covered by another one are skipped,
+    as they are being compacted into it.
+    """
+    monitors = read_monitors(directory)
+    wanted = {
+        monitor_id
+        for monitor_id, (monitor_url, monitor_identifier) in enumerate(monitors)
+        if (url is None or monitor_url == url)
+        and (identifier is None or monitor_identifier == identifier)
+    }
+    summaries = {}
+
+    def add(monitor_id, records):
+        records = [r for r in records if since <= r[0] < until]
+        if records:
+            if monitor_id not in summaries:
+                summaries[monitor_id] = MonitorSummary(*monitors[monitor_id])
+            summaries[monitor_id].add(records)
+
+    for segment in uncovered(list_segments(directory)):
+        try:
+            if not segment.is_sealed:
+                # Checks that were slow to finish may predate the window a little
+                if segment.start <= until:
+                    by_monitor = {}
+                    for record in segment.read_records():
+                        if record[1] in wanted:
+                            by_monitor.setdefault(record[1], []).append(record)
+                    for monitor_id, records in by_monitor.items():
+                        add(monitor_id, records)
+                continue
+
+            entries = [
+                entry
+                for entry in segment.read_index()
+                if entry[0] in wanted and entry[3] < until and entry[4] >= since
+            ]
+            if not entries:
+                continue
+            with open(segment.segment_path, "rb") as f, mmap.mmap(
+                f.fileno(), 0, access=mmap.ACCESS_READ
+            ) as data:
+                for monitor_id, position, count, first, last in entries:
+                    offset = position * RECORD.size
+                    records = RECORD.iter_unpack(
+                        data[offset : offset + count * RECORD.size]
+                    )
+                    add(monitor_id, records)
+        except FileNotFoundError:
+            continue  # Compacted or deleted while reading
+
+    return [
+        summaries[monitor_id].as_dict()
+        for monitor_id in sorted(summaries, key=lambda m: monitors[m])
+    ]
@@ -0,0 +1,208 @@
+"""
+Time each phase of a request: DNS, TCP connect, TLS, first byte and body.
+
+httpcore 0.13 has no trace hooks, so the clients use a transport whose network
+backend opens connections one phase at a time, recording the timings in the
+check that is running in the current task. All times come from a monotonic
+clock (time.perf_counter).
+
+The backend also looks host names up with the client pool's caching resolver.
+When httpcore does not provide the backend this builds on, clients use the
+default transport: only response_time is measured, and names are not cached
+(a warning is logged the first time this happens).
+"""
+import asyncio
+import contextlib
+import contextvars
+import dataclasses
+import logging
+import time
+from typing import Optional
+
+import httpcore
+import httpx
+
+from . import common
+from . import dns
+
+try:
+    from httpcore._backends.asyncio import AsyncioBackend, SocketStream
+except ImportError:  # Only the httpcore 0.13 internals are supported
+    AsyncioBackend = SocketStream = None
+
+logger = logging.getLogger(__name__)
+clock = time.perf_counter
+_warned_untraced = False
+_current_timings = contextvars.ContextVar("httpcheck_timings", default=None)
+
+
+@common.slotted
+@dataclasses.dataclass
+class RequestTimings:
+    """ Timestamps and durations of one request, in seconds. """
+
+    start: float
+    dns_time: Optional[float] = None
+    connect_time: Optional[float] = None
+    tls_time: Optional[float] = None
+    # Whether the host's addresses were cached, and how long the resolver took
+    dns_cache_hit: Optional[bool] = None
+    resolver_time: Optional[float] = None
+    # Whether the request opened a new connection, and when it was ready
+    new_connection: bool = False
+    connected_at: Optional[float] = None
+    # When the response headers were received
+    response_at: Optional[float] = None
+    # Whether the request went through a tracing transport at all (it does not
+    # when it is sent through a proxy, or mocked in tests)
+    traced: bool = False
+
+    def record(self, results, end):
+        results.dns_time = self.dns_time
+        results.connect_time = self.connect_time
+        results.tls_time = self.tls_time
+        results.dns_cache_hit = self.dns_cache_hit
+        results.resolver_time = self.resolver_time
+        results.connection_reused = None
+        if self.traced:
+            results.connection_reused = not self.new_connection
+        results.first_byte_time = results.body_time = None
+        if self.response_at is not None:
+            sent_at = self.connected_at or self.start
+            results.first_byte_time = self.response_at - sent_at
+            results.body_time = end - self.response_at
+
+
+@contextlib.contextmanager
+def trace_request():
+    """ Collect the timings of the request made in this context. """
+    timings = RequestTimings(start=clock())
+    token = _current_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _current_timings.reset(token)
+
+
+def mark_response():
+    """ Record that the response headers of the current request arrived. """
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.response_at = clock()
+
+
+async def connect(addresses, port, local_address=None):
+    """ Connect to each address in turn, until one accepts the connection. """
+    local_addr = None if local_address is None else (local_address, 0)
+    last_exc = OSError(f"No addresses to connect to on port {port}")
+    for address in addresses:
+        try:
+            return await asyncio.open_connection(address, port, local_addr=local_addr)
+        except OSError as exc:
+            last_exc = exc
+    raise last_exc
+
+
+@contextlib.contextmanager
+def _timed(timings, name):
+    """ Record how long a phase took, whether it succeeded or not. """
+    start = clock()
+    try:
+        yield
+    finally:
+        setattr(timings, name, clock() - start)
+
+
+def _remaining(deadline):
+    return None if deadline is None else max(deadline - clock(), 0)
+
+
+if AsyncioBackend is not None:
+
+    class TracingBackend(AsyncioBackend):
+        """ The asyncio backend, timing the phases of opening a connection.
+
+        Host names are looked up with the resolver when there is one.
+        """
+
+        def __init__(self, resolver=None):
+            super().__init__()
+            self.resolver = resolver
+
+        async def resolve(self, host, port, timings):
+            if self.resolver is None:
+                return await dns.query_system(host, port)
+            addresses, cache_hit, resolver_time = await self.resolver.resolve(
+                host, port
+            )
+            timings.dns_cache_hit = cache_hit
+            timings.resolver_time = resolver_time
+            return addresses
+
+        async def open_tcp_stream(
+            self, hostname, port, ssl_context, timeout, *, local_address
+        ):
+            timings = _current_timings.get()
+            if timings is None:
+                return await super().open_tcp_stream(
+                    hostname, port, ssl_context, timeout, local_address=local_address
+                )
+
+            timings.new_connection = True
+            host = hostname.decode("ascii")
+            connect_timeout = timeout.get("connect")
+            deadline = None if connect_timeout is None else clock() + connect_timeout
+            try:
+                with _timed(timings, "dns_time"):
+                    addresses = await asyncio.wait_for(
+                        self.resolve(host, port, timings), _remaining(deadline)
+                    )
+                with _timed(timings, "connect_time"):
+                    stream_reader, stream_writer = await asyncio.wait_for(
+                        connect(addresses, port, local_address), _remaining(deadline)
+                    )
+            except asyncio.TimeoutError as exc:
+                raise httpcore.ConnectTimeout(exc) from exc
+            except OSError as exc:
+                raise httpcore.ConnectError(exc) from exc
+
+            stream = SocketStream(
+                stream_reader=stream_reader, stream_writer=stream_writer
+            )
+            if ssl_context is not None:
+                with _timed(timings, "tls_time"):
+                    stream = await stream.start_tls(
+                        hostname, ssl_context, {"connect": _remaining(deadline)}
+                    )
+            timings.connected_at = clock()
+            return stream
+
+    class TracingTransport(httpx.AsyncHTTPTransport):
+        def __init__(self, resolver=None, **kwargs):
+            # httpcore accepts a backend instance as well as a backend name
+            super().__init__(backend=TracingBackend(resolver), **kwargs)
+
+        async def handle_async_request(self, *args, **kwargs):
+            timings = _current_timings.get()
+            if timings is not None:
+                timings.traced = True
+            return await super().handle_async_request(*args, **kwargs)
+
+
+else:
+    TracingTransport = None
+
+
+def make_transport(verify=True, limits=httpx.Limits(), resolver=None):
+    """ A transport that records request timings, or None if unsupported. """
+    global _warned_untraced
+    if TracingTransport is None:
+        if not _warned_untraced:
+            logger.warning(
+                "httpcore %s is not supported, so request timings are not "
+                "recorded and host names are not cached",
+                httpcore.__version__,
+            )
+            _warned_untraced = True
+        return None
+    return TracingTransport(resolver=resolver, verify=verify, limits=limits)
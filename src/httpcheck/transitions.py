@@ -0,0 +1,132 @@
+"""
+Only publish the results that differ from the monitor's previous results.
+
+Under steady state almost every result is the same as the one before it. In
+transitions-only mode the last state of each monitor is kept in a compact
+table, and results are only published when the state changes:
+
+ * the website goes down or comes back up
+ * the status code changes
+ * the regex is found or lost
+ * the response time moves into another band (split at `latency_bands`)
+
+The first result of each monitor is always published. Every
+`heartbeat_interval` seconds, a rollup record summarises each monitor's
+checks since the previous one: how many there were, how many were online,
+how many were published as transitions and the min/avg/max response time.
+"""
+import dataclasses
+import datetime
+import typing
+from bisect import bisect
+
+from . import common
+
+DEFAULT_LATENCY_BANDS = (1.0, 5.0)
+
+
+@common.slotted
+@dataclasses.dataclass
+class MonitorState(common.Record):
+    url: str
+    identifier: str
+    is_online: typing.Optional[bool] = None
+    status_code: typing.Optional[int] = None
+    regex_found: typing.Optional[bool] = None
+    latency_band: typing.Optional[int] = None
+    # Counted since the last rollup
+    checks: int = 0
+    online: int = 0
+    transitions: int = 0
+    timed: int = 0
+    time_min: typing.Optional[float] = None
+    time_max: typing.Optional[float] = None
+    time_total: float = 0.0
+
+    @property
+    def state(self):
+        return (self.is_online, self.status_code, self.regex_found, self.latency_band)
+
+    def reset_counts(self):
+        self.checks = self.online = self.transitions = self.timed = 0
+        self.time_min = self.time_max = None
+        self.time_total = 0.0
+
+
+class TransitionTracker:
+    @dataclasses.dataclass(frozen=True)
+    class Config:
+        latency_bands: typing.Tuple[float, ...] = DEFAULT_LATENCY_BANDS
+        heartbeat_interval: float = 300
+
+    def __init__(self, config=None):
+        self.config = common.build_config(self.Config, config or {})
+        self._bands = sorted(self.config.latency_bands)
+        self._states = {}
+
+    def forget(self, monitor_config):
+        self._states.pop(common.get_monitor_key(monitor_config), None)
+
+    def latency_band(self, response_time):
+        if response_time is None:
+            return None
+        return bisect(self._bands, response_time)
+
+    def record(self, monitor_config, results):
+        """ Add the results to the monitor's state, returning whether it changed.
+        """
+        key = common.get_monitor_key(monitor_config)
+        state = self._states.get(key)
+        is_new = state is None
+        if is_new:
+            state = self._states[key] = MonitorState(results.url, results.identifier)
+        previous = state.state
+        state.url = results.url
+        state.is_online = results.is_online
+        state.status_code = results.status_code
+        state.regex_found = results.regex_found
+        state.latency_band = self.latency_band(results.response_time)
+
+        state.checks += 1
+        state.online += bool(results.is_online)
+        response_time = results.response_time
+        if response_time is not None:
+            state.timed += 1
+            state.time_total += response_time
+            if state.time_min is None or response_time < state.time_min:
+                state.time_min = response_time
+            if state.time_max is None or response_time > state.time_max:
+                state.time_max = response_time
+
+        changed = is_new or state.state != previous
+        state.transitions += changed
+        return changed
+
+    def rollup(self):
+        """ A record summarising each monitor since the last rollup. """
+        timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        hostname = common.get_hostname()
+        records = []
+        for key, state in self._states.items():
+            records.append(
+                {
+                    "record": "rollup",
+                    "timestamp": timestamp,
+                    "hostname": hostname,
+                    "key": key,
+                    "url": state.url,
+                    "identifier": state.identifier,
+                    "is_online": state.is_online,
+                    "status_code": state.status_code,
+                    "checks": state.checks,
+                    "online": state.online,
+                    "transitions": state.transitions,
+                    "response_time_min": state.time_min,
+                    "response_time_avg": (
+                        state.time_total / state.timed if state.timed else None
+                    ),
+                    "response_time_max": state.time_max,
+                }
+            )
+            state.reset_counts()
+        return records
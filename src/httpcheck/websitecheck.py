@@ -1,47 +1,209 @@
+import asyncio
+import codecs
 import contextlib
+import copy
+import datetime
+import email.utils
 import re
-import timeit
 
 import httpcore
 import httpx
 
+from . import clients
+from . import common
+from . import conditional
+from . import retries
+from . import tracing
 from .common import WebsiteCheckResults
 from .common import WebsiteMonitorConfig
 
+# Characters kept from the end of each chunk, so a match spanning two chunks
+# is still found (unless the match itself is longer than this)
+REGEX_OVERLAP = 4096
+# Characters of the body kept before the text still to be searched, and read
+# after a match that looks ahead, so lookarounds and anchors see the real body
+REGEX_CONTEXT = 256
+# Bytes of the body read after the search has finished with it, so that the
+# connection can be reused (the connection of a larger body is closed instead)
+DRAIN_MAX_BYTES = 64 * 1024
+# Regex tokens that look at the text after them
+LOOKAHEAD_TOKENS = re.compile(r"\$|\\[bBZ]|\(\?[=!]")
+
+
+async def run(config: WebsiteMonitorConfig, client_pool=None, patterns=None):
+    """ Make the attempts and collate the results
+
+    With patterns, the body is searched for each of them instead of the
+    config's regex, and regex_found is a tuple of whether each was found.
+    """
+    if client_pool is None:
+        async with clients.ClientPool() as client_pool:
+            return await run(config, client_pool, patterns)
 
-async def run(config: WebsiteMonitorConfig):
-    """ Make the attempt and collate the results """
     results = WebsiteCheckResults.from_config(config)
+    attempts = Attempts(config, client_pool, patterns)
 
     total_attempts = 1 + config.retries
     for retry_idx in range(total_attempts):
         results.retries = retry_idx
+        if config.hedge_percentile is None:
+            exc = await attempts.make(results)
+        else:
+            exc = await attempts.make_hedged(results)
+        if retry_idx + 1 == total_attempts or not retries.is_retryable(
+            config, results, exc
+        ):
+            break
+        delay = retries.backoff_delay(config, retry_idx, results.retry_after)
+        if attempts.remaining() is not None and delay >= attempts.remaining():
+            break  # No time left for another attempt
+        await asyncio.sleep(delay)
+
+    if len(attempts.timeline) > 1:
+        results.attempts = attempts.timeline
+    return results
+
+
+class Attempts:
+    """ The requests made by one check, within its deadline. """
+
+    def __init__(self, config, client_pool, patterns=None):
+        self.config = config
+        self.client_pool = client_pool
+        self.patterns = patterns
+        self.start = tracing.clock()
+        self.deadline = None
+        if config.deadline is not None:
+            self.deadline = self.start + config.deadline
+        self.timeline = []
+
+    def remaining(self):
+        if self.deadline is None:
+            return None
+        return max(self.deadline - tracing.clock(), 0)
+
+    async def make(self, results, hedge=False):
+        """ Make one request, recording it in results. Returns its exception. """
+        started = tracing.clock()
+        attempt = {
+            "start": round(started - self.start, 6),
+            "duration": None,
+            "hedge": hedge,
+        }
+        self.timeline.append(attempt)
+        # Forget the outcome of any earlier attempt
+        results.status_code = results.exception = results.retry_after = None
+        results.regex_found = results.bytes_read = results.bytes_saved = None
         try:
-            with _measure_response_time(results):
-                response = await make_http_request(config)
+            async with self.client_pool.client(self.config) as client:
+                with _measure_response_time(results):
+                    response = await self._request(client, results)
         except ConnectionError as exc:
             _process_exception(exc, results)
-            continue  # Let's maybe retry!
-        else:
-            _process_response(response, results)
-            break  # No retry necessary, we're done
+            attempt["exception"] = results.exception
+            return exc
+        except asyncio.CancelledError:
+            attempt["exception"] = "Cancelled"
+            raise
+        finally:
+            attempt["duration"] = round(tracing.clock() - started, 6)
 
-    return results
+        _process_response(response, results)
+        attempt["status_code"] = results.status_code
+        if self.config.hedge_percentile is not None:
+            self.client_pool.latency_history.add(
+                self._history_key, results.response_time
+            )
+        return None
+
+    async def _request(self, client, results):
+        request = make_http_request(
+            client,
+            self.config,
+            results,
+            self.patterns,
+            self.client_pool.response_cache,
+        )
+        if self.deadline is None:
+            return await request
+        try:
+            return await asyncio.wait_for(request, self.remaining())
+        except asyncio.TimeoutError as exc:
+            raise ConnectionError("DeadlineExceeded") from exc
+
+    @property
+    def _history_key(self):
+        return common.get_monitor_key(self.config)
+
+    async def make_hedged(self, results):
+        """ Make a request, and a second one if the first is slow.
+
+        Whichever request gets a response first is recorded in results, and
+        the other one is cancelled.
+        """
+        delay = self.client_pool.latency_history.hedge_delay(
+            self._history_key, self.config.hedge_percentile
+        )
+        if delay is None:
+            return await self.make(results)
+
+        async def make_copy(hedge):
+            copy_results = copy.copy(results)
+            return copy_results, await self.make(copy_results, hedge=hedge)
+
+        tasks = [asyncio.ensure_future(make_copy(hedge=False))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                tasks.append(asyncio.ensure_future(make_copy(hedge=True)))
+            for next_done in asyncio.as_completed(tasks):
+                winner, exc = await next_done
+                if exc is None:
+                    break  # Got a response
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        results.__setstate__(winner.as_dict())
+        return exc
 
 
 @contextlib.contextmanager
 def _measure_response_time(results):
-    start_time = timeit.default_timer()
-    yield
-    results.response_time = timeit.default_timer() - start_time
+    """ Time the request, and each of its phases (even when it fails). """
+    with tracing.trace_request() as timings:
+        try:
+            yield
+        finally:
+            end_time = tracing.clock()
+            timings.record(results, end_time)
+    results.response_time = end_time - timings.start
 
 
 def _process_response(response, results):
     """ Given a completed response, extract the relevant data. """
     results.status_code = response.status_code
     results.is_online = not response.is_error
-    if results.regex:
-        results.regex_found = bool(re.search(results.regex, response.text))
+    results.retry_after = parse_retry_after(response.headers.get("retry-after"))
+
+
+def parse_retry_after(value):
+    """ Seconds to wait from a Retry-After header (seconds or an HTTP date). """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return max(0.0, (retry_at - now).total_seconds())
 
 
 def _process_exception(exception, results):
@@ -52,18 +214,147 @@ def _process_exception(exception, results):
     results.exception = " ".join(exception.args)
 
 
-async def make_http_request(config):
-    _timeout = httpx.Timeout(5, read=config.timeout)
-    headers = {"user-agent": f"httpcheck/{config.identifier}"}
-    async with httpx.AsyncClient(timeout=_timeout, headers=headers) as client:
-        try:
-            return await client.request(config.method, config.url)
-        except (
-            httpx.HTTPError,
-            httpcore.NetworkError,
-            httpcore.TimeoutException,
-            httpcore.ProtocolError,
-            httpcore.ProxyError,
-        ) as exc:
-            msg = type(exc).__name__
-            raise ConnectionError(msg) from exc
+async def scan_body(chunks, pattern, encoding=None, max_bytes=None):
+    """ Search the streamed body for the pattern, reading as little as possible.
+
+    Returns whether the pattern was found and the number of bytes read.
+    """
+    found, bytes_read = await scan_body_all(chunks, [pattern], encoding, max_bytes)
+    return found[0], bytes_read
+
+
+async def scan_body_all(chunks, patterns, encoding=None, max_bytes=None):
+    """ Search the streamed body for each pattern, until all of them are found.
+
+    Patterns are found as if the body was searched all at once, as long as a
+    match is no longer than REGEX_OVERLAP and its lookarounds look no further
+    than REGEX_CONTEXT. Returns a tuple of whether each pattern was found, and
+    the number of bytes read.
+    """
+    decoder = codecs.getincrementaldecoder(encoding or "utf-8")(errors="replace")
+    found = [False] * len(patterns)
+    margins = [
+        REGEX_CONTEXT if LOOKAHEAD_TOKENS.search(pattern.pattern) else 0
+        for pattern in patterns
+    ]
+    bytes_read = 0
+    # The text is searched from pos, with the text before it only there as
+    # context: "^", "\A" and lookbehinds never match at an artificial start
+    text, pos = "", 0
+    async for chunk in chunks:
+        if max_bytes is not None:
+            chunk = chunk[: max_bytes - bytes_read]
+        bytes_read += len(chunk)
+        text += decoder.decode(chunk)
+        # The body is only searched up to max_bytes, as if it ended there
+        final = max_bytes is not None and bytes_read >= max_bytes
+        if _search(patterns, found, text, pos, None if final else margins) or final:
+            return tuple(found), bytes_read
+        pos = max(pos, len(text) - REGEX_OVERLAP)
+        start = max(pos - REGEX_CONTEXT, 0)
+        text, pos = text[start:], pos - start
+
+    text += decoder.decode(b"", final=True)
+    _search(patterns, found, text, pos)
+    return tuple(found), bytes_read
+
+
+def _search(patterns, found, text, pos=0, margins=None):
+    """ Record the patterns found in the text, returning whether all were.
+
+    A match within its pattern's margin of the end of the text may depend on
+    the text after it (eg. "$" or a lookahead), so only counts once that is
+    read. Without margins, the text is the end of the body.
+    """
+    for index, pattern in enumerate(patterns):
+        if not found[index]:
+            match = pattern.search(text, pos)
+            limit = len(text) - (margins[index] if margins else 0)
+            found[index] = match is not None and match.end() <= limit
+    return all(found)
+
+
+async def _read_body(response, config, results, patterns=None):
+    """ Consume the body, searching it for the configured regex if any. """
+    chunks = response.aiter_bytes()
+    if patterns:
+        results.regex_found, results.bytes_read = await scan_body_all(
+            chunks,
+            patterns,
+            encoding=response.encoding,
+            max_bytes=config.regex_max_bytes,
+        )
+        await _drain(response, chunks)
+    elif config.pattern is not None:
+        results.regex_found, results.bytes_read = await scan_body(
+            chunks,
+            config.pattern,
+            encoding=response.encoding,
+            max_bytes=config.regex_max_bytes,
+        )
+        await _drain(response, chunks)
+    else:
+        results.bytes_read = 0
+        async for chunk in response.aiter_bytes():
+            results.bytes_read += len(chunk)
+
+
+async def _drain(response, chunks=None):
+    """ Read the rest of a small body, so its connection goes back to the pool.
+
+    The connection of a body larger than DRAIN_MAX_BYTES is closed instead.
+    """
+    try:
+        length = int(response.headers["content-length"])
+    except (KeyError, ValueError):
+        length = None
+    if length is not None and length > DRAIN_MAX_BYTES:
+        return
+    drained = 0
+    async for chunk in chunks or response.aiter_bytes():
+        drained += len(chunk)
+        if drained > DRAIN_MAX_BYTES:
+            return
+
+
+async def make_http_request(
+    client, config, results, patterns=None, response_cache=None
+):
+    cached = None if response_cache is None else response_cache.get(config)
+    headers = conditional.get_request_headers(config, cached)
+    try:
+        while True:
+            async with client.stream(
+                config.method, config.url, headers=headers or None
+            ) as response:
+                tracing.mark_response()
+                if response.status_code == 416 and "range" in headers:
+                    # The range cannot be satisfied (eg. the body is empty), so
+                    # ask for the whole body instead
+                    await _drain(response)
+                    del headers["range"]
+                    continue
+                if response.status_code == 304 and cached is not None:
+                    # Not modified, so the body is still what was searched last time
+                    await _drain(response)
+                    results.regex_found = cached.regex_found
+                    results.bytes_read = 0
+                    results.bytes_saved = cached.size
+                else:
+                    await _read_body(response, config, results, patterns)
+                    if response.status_code == 206:
+                        size = conditional.get_body_size(response)
+                        if size is not None:
+                            results.bytes_saved = max(size - results.bytes_read, 0)
+                    if response_cache is not None:
+                        response_cache.store(config, response, results)
+            return response
+    except (
+        httpx.HTTPError,
+        httpcore.NetworkError,
+        httpcore.TimeoutException,
+        httpcore.ProtocolError,
+        httpcore.ProxyError,
+    ) as exc:
+        msg = type(exc).__name__
+        raise ConnectionError(msg) from exc
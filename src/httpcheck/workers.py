@@ -0,0 +1,194 @@
+"""
+Run the checks in several worker processes, to make use of every core.
+
+A supervisor process starts the workers, each one checking its own shard of
+the monitors (see httpcheck.sharding) with its own scheduler. Workers publish
+their results to a pipe, and the supervisor publishes them all with a single
+publisher. SIGHUP is forwarded to the workers, and a worker that crashes is
+restarted.
+
+Workers stagger their checks by a hash of the monitor key anchored to the
+wall clock, so a restarted worker continues the schedule of the one it
+replaces rather than checking all of its monitors again immediately.
+"""
+import asyncio
+import logging
+import math
+import multiprocessing
+import os
+import signal
+
+from . import main
+from . import publishers
+from . import sharding
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait before restarting a crashed worker
+RESTART_DELAY = 1
+# Seconds to wait for the workers to stop before killing them
+STOP_TIMEOUT = 30
+
+
+def supervise(worker_count, publisher_config, once=False, **monitor_all_kwargs):
+    # Workers use the same settings (queueing, encoder) to publish to the pipe
+    worker_publisher_config = dict(publisher_config)
+    with publishers.get_publisher(publisher_config) as publisher:
+        supervisor = Supervisor(
+            worker_count=worker_count,
+            publisher=publisher,
+            once=once,
+            worker_kwargs=get_worker_kwargs(worker_count, monitor_all_kwargs),
+            worker_publisher_config=worker_publisher_config,
+        )
+        asyncio.run(supervisor.run())
+
+
+def get_worker_kwargs(worker_count, monitor_all_kwargs):
+    """ Share the concurrency limits between the workers. """
+    kwargs = dict(monitor_all_kwargs)
+    limiter_config = dict(kwargs.get("limiter_config") or {})
+    for name, limit in limiter_config.items():
+        if limit:
+            limiter_config[name] = math.ceil(limit / worker_count)
+    kwargs["limiter_config"] = limiter_config
+
+    scheduler_config = dict(kwargs.get("scheduler_config") or {})
+    if scheduler_config.get("stagger", "none") != "hash":
+        logger.info("Workers always stagger checks by hash")
+    scheduler_config["stagger"] = "hash"
+    kwargs["scheduler_config"] = scheduler_config
+    return kwargs
+
+
+def run_worker(shard_index, shard_count, conn, log_level, publisher_config, kwargs):
+    """ The entry point of each worker process. """
+    logging.basicConfig(level=log_level)
+    # Ctrl-C reaches the whole process group, the supervisor stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: _exit_worker())
+    # A forwarded SIGHUP would kill a worker that is still starting up, until
+    # the monitor manager handles it
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    publisher_config = {**publisher_config, "backend": "pipe", "fd": conn.fileno()}
+    shard = sharding.Shard(shard_index, shard_count, salt="worker:")
+    node_owns = kwargs.pop("owns", None)
+    if node_owns is None:
+        owns = shard.owns
+    else:
+        # Split this node's monitors between its workers
+        def owns(config):
+            return node_owns(config) and shard.owns(config)
+
+    main.monitor_all(publisher_config=publisher_config, owns=owns, **kwargs)
+
+
+def _exit_worker():
+    raise SystemExit(0)
+
+
+class Supervisor:
+    def __init__(
+        self, worker_count, publisher, worker_kwargs, worker_publisher_config, once
+    ):
+        self.worker_count = worker_count
+        self.publisher = publisher
+        self.worker_kwargs = worker_kwargs
+        self.worker_publisher_config = worker_publisher_config
+        self.once = once
+        self.processes = {}
+        self.stopping = False
+        self._context = multiprocessing.get_context("spawn")
+        self._stopped = None
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        self._stopped = asyncio.Event()
+        loop.add_signal_handler(signal.SIGHUP, self.forward_signal, signal.SIGHUP)
+        loop.add_signal_handler(signal.SIGINT, self.stop)
+        loop.add_signal_handler(signal.SIGTERM, self.stop)
+        await self.publisher.astart()
+
+        finished = asyncio.gather(
+            *(self.supervise_worker(i) for i in range(self.worker_count))
+        )
+        await asyncio.wait(
+            [finished, asyncio.ensure_future(self._stopped.wait())],
+            return_when=asyncio.FIRST_COMPLETED,
+        )
+        self.stopping = True
+        self.forward_signal(signal.SIGTERM)
+        done, _ = await asyncio.wait([finished], timeout=STOP_TIMEOUT)
+        if not done:
+            logger.error("Killing the workers that did not stop")
+            self.forward_signal(signal.SIGKILL)
+        await finished
+        await self.publisher.aclose()
+
+    def stop(self):
+        """ Stop the workers, once they have published their queued results. """
+        self._stopped.set()
+
+    def forward_signal(self, signum):
+        for process in self.processes.values():
+            if process.is_alive():
+                os.kill(process.pid, signum)
+
+    async def supervise_worker(self, shard_index):
+        """ Run a worker and publish its results, restarting it if it crashes. """
+        loop = asyncio.get_event_loop()
+        while True:
+            process, read_conn = self.start_worker(shard_index)
+            await self.relay(read_conn)
+            await loop.run_in_executor(None, process.join)
+            if self.stopping or process.exitcode == 0:
+                return
+
+            logger.error("Worker %d exited with %s", shard_index, process.exitcode)
+            if self.once:
+                # Restarting a --once worker would check its monitors again
+                return
+            await asyncio.sleep(RESTART_DELAY)
+            if self.stopping:
+                return
+
+    def start_worker(self, shard_index):
+        read_conn, write_conn = self._context.Pipe(duplex=False)
+        process = self._context.Process(
+            target=run_worker,
+            args=(
+                shard_index,
+                self.worker_count,
+                write_conn,
+                logging.getLogger().level,
+                self.get_worker_publisher_config(shard_index),
+                {**self.worker_kwargs, "once": self.once},
+            ),
+            name=f"httpcheck-worker-{shard_index}",
+        )
+        process.start()
+        write_conn.close()
+        self.processes[shard_index] = process
+        return process, read_conn
+
+    def get_worker_publisher_config(self, shard_index):
+        config = dict(self.worker_publisher_config)
+        if config.get("spill_filename"):
+            # Each process appends to a spill file of its own
+            config["spill_filename"] = f"{config['spill_filename']}.worker{shard_index}"
+        return config
+
+    async def relay(self, read_conn):
+        loop = asyncio.get_event_loop()
+        reader = asyncio.StreamReader(limit=2 ** 20)
+        transport, _ = await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), read_conn
+        )
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                await self.publisher.submit_encoded(line.rstrip(b"\n"))
+        finally:
+            transport.close()
@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+from httpcheck import adaptive
+from httpcheck import scheduler
+from httpcheck.common import WebsiteCheckResults
+from httpcheck.common import WebsiteMonitorConfig
+
+
+def make_results(is_online, status_code=None, retry_after=None):
+    return WebsiteCheckResults(
+        method="HEAD",
+        url="http://example.com",
+        timestamp="",
+        is_online=is_online,
+        status_code=status_code,
+        retry_after=retry_after,
+    )
+
+
+def get_delays(policy, outcomes, frequency=60):
+    config = WebsiteMonitorConfig("http://example.com", frequency=frequency)
+    return [policy.next_delay("job", config, make_results(o)) for o in outcomes]
+
+
+def test_confirm_changes():
+    policy = adaptive.AdaptivePolicy({"confirm_interval": 5})
+    delays = get_delays(policy, [True, True, False, True, True])
+    assert delays == [None, None, 5, 5, None]
+
+
+def test_back_off_while_down():
+    policy = adaptive.AdaptivePolicy({"confirm_interval": 5, "max_backoff": 300})
+    delays = get_delays(policy, [True, False, False, False, False, False, True])
+    assert delays == [None, 5, 120, 240, 300, 300, 5]
+
+
+def test_never_slower_than_frequency():
+    policy = adaptive.AdaptivePolicy({"confirm_interval": 5, "max_backoff": 300})
+    assert get_delays(policy, [True, False], frequency=1) == [None, 1]
+    policy = adaptive.AdaptivePolicy({"max_backoff": 30})
+    assert get_delays(policy, [False, False, False], frequency=60) == [None, 60, 60]
+
+
+def test_retry_after():
+    policy = adaptive.AdaptivePolicy({"max_backoff": 600})
+    config = WebsiteMonitorConfig("http://example.com", frequency=60)
+
+    def next_delay(status_code, retry_after):
+        results = make_results(False, status_code, retry_after)
+        return policy.next_delay("job", config, results)
+
+    assert next_delay(503, 30) is None
+    assert next_delay(429, 500) == 500
+    assert next_delay(503, 3600) == 600
+    policy.forget("job")
+    assert next_delay(500, 300) is None
+
+
+@pytest.mark.asyncio
+async def test_scheduler_backs_off():
+    runs = []
+
+    async def fail(monitor_config):
+        runs.append(asyncio.get_event_loop().time())
+        return make_results(False)
+
+    job_scheduler = scheduler.Scheduler(
+        fail,
+        backend=scheduler.NativeBackend(),
+        adaptive=adaptive.AdaptivePolicy({"max_backoff": 0.2}),
+    )
+    job_scheduler.schedule(WebsiteMonitorConfig("http://example.com", frequency=0.05))
+    job_scheduler.start()
+    await asyncio.sleep(0.6)
+    job_scheduler.stop()
+
+    gaps = [later - earlier for earlier, later in zip(runs, runs[1:])]
+    assert 4 <= len(runs) <= 6
+    assert gaps[0] < 0.08
+    assert all(0.15 < gap < 0.25 for gap in gaps[2:])
@@ -0,0 +1,37 @@
+import asyncio
+
+import pytest
+
+from httpcheck import bench
+
+
+@pytest.fixture
+async def target_port():
+    loop = asyncio.get_event_loop()
+    ready = loop.create_future()
+    config = bench.TargetConfig(latency=0, failure_rate=0.5, drop_rate=0.2)
+    server = asyncio.ensure_future(bench.serve_target(config, ready.set_result))
+    yield await ready
+    server.cancel()
+
+
+@pytest.mark.enable_socket
+@pytest.mark.asyncio
+async def test_benchmark(target_port):
+    monitor_configs = bench.make_monitor_configs(target_port, 20, 0.2, "GET")
+    results = await bench.run_benchmark(
+        monitor_configs, duration=1, warmup=0, scheduler_backend="native"
+    )
+
+    assert results["checks"] > 20
+    assert results["online"] and results["offline"]
+    assert results["checks_per_second"] > 0
+    assert results["lag_p50_ms"] <= results["lag_p99_ms"]
+    assert results["max_rss_mb"] >= results["rss_mb"] > 0
+
+
+def test_percentile():
+    values = list(range(100, 0, -1))
+    assert bench.percentile(values, 0.5) == 51
+    assert bench.percentile(values, 0.99) == 100
+    assert bench.percentile([3], 0.99) == 3
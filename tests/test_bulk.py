@@ -0,0 +1,95 @@
+import io
+import json
+
+import pytest
+
+from httpcheck import bulk
+from httpcheck import clients
+from httpcheck import publishers
+from httpcheck.common import WebsiteMonitorConfig
+
+
+class RecordingPublisher(publishers.BasePublisher):
+    key = "test-bulk"
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.urls = []
+
+    def publish(self, msg):
+        self.urls.append(json.loads(msg)["url"])
+
+
+def test_checkpoint(tmp_path):
+    filename = str(tmp_path / "checkpoint.json")
+    checkpoint = bulk.Checkpoint(filename, "urls.txt")
+    for line_number in (1, 2, 4, 5):
+        checkpoint.start(line_number)
+    checkpoint.finish(2)
+    assert checkpoint.line == 0
+    checkpoint.finish(1)
+    assert checkpoint.line == 2
+    checkpoint.finish(5)
+    assert checkpoint.line == 2
+    checkpoint.finish(4)
+    assert checkpoint.line == 5
+    checkpoint.save()
+
+    loaded = bulk.Checkpoint(filename, "urls.txt")
+    loaded.load()
+    assert loaded.line == 5
+    with pytest.raises(ValueError):
+        bulk.Checkpoint(filename, "other.txt").load()
+
+
+@pytest.mark.asyncio
+async def test_check_input(httpx_mock, tmp_path):
+    httpx_mock.add_response(headers={"ETag": '"v1"'})
+    lines = ["# Websites", "http://one.example.com", ""]
+    lines += [f"http://example.com/{i}" for i in range(10)]
+    f = io.StringIO("\n".join(lines))
+    checkpoint = bulk.Checkpoint(str(tmp_path / "checkpoint.json"), "urls.txt")
+    checkpoint.line = 5
+
+    publisher = RecordingPublisher({})
+    async with clients.ClientPool() as client_pool:
+        progress = await bulk.check_input(
+            f,
+            WebsiteMonitorConfig(url="", retries=0, method="GET", conditional=True),
+            publisher,
+            client_pool,
+            workers=3,
+            checkpoint=checkpoint,
+        )
+        # Each URL is checked once, so no responses are kept for later
+        assert len(client_pool.response_cache) == 0
+
+    # The URLs on lines 2, 4 and 5 were already checked
+    assert sorted(publisher.urls) == sorted(lines[5:])
+    assert progress.checked == progress.online == 8
+    assert progress.skipped == 3
+    assert checkpoint.line == len(lines)
+    assert "Checked 8 URLs" in progress.summary()
+
+
+@pytest.mark.asyncio
+async def test_check_input_malformed(httpx_mock, tmp_path):
+    httpx_mock.add_response(url="http://example.com")
+    lines = ["notaurl", "ftp://x", "http://[bad", "http://example.com"]
+    f = io.StringIO("\n".join(lines))
+    checkpoint = bulk.Checkpoint(str(tmp_path / "checkpoint.json"), "urls.txt")
+
+    publisher = RecordingPublisher({})
+    async with clients.ClientPool() as client_pool:
+        progress = await bulk.check_input(
+            f,
+            WebsiteMonitorConfig(url="", retries=0),
+            publisher,
+            client_pool,
+            workers=2,
+            checkpoint=checkpoint,
+        )
+
+    assert sorted(publisher.urls) == sorted(lines)
+    assert (progress.checked, progress.online) == (4, 1)
+    assert checkpoint.line == 4
@@ -1,9 +1,13 @@
+import datetime
+import json
 from unittest import mock
 
 from click.testing import CliRunner
 
 from httpcheck import main
+from httpcheck import store
 from httpcheck.cli import httpcheck_main as httpcheck_cli
+from httpcheck.cli import httpcheck_query
 from httpcheck.common import WebsiteMonitorConfig
 
 
@@ -22,3 +26,43 @@ def test_consistent_defaults(httpx_mock):
     cli_monitor_config = main.monitor_all.call_args.args[0]["http://example.com"]
 
     assert cli_monitor_config == direct_monitor_config
+
+
+def test_query(tmp_path):
+    result_store = store.ResultStore(str(tmp_path))
+    result = {"url": "http://example.com", "is_online": True, "response_time": 0.5}
+    result["timestamp"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    result_store.append([result])
+    result_store.close()
+
+    runner = CliRunner()
+    output = runner.invoke(httpcheck_query, ["--store", str(tmp_path)]).output
+    summary = json.loads(output)
+    assert summary["url"] == "http://example.com"
+    assert summary["uptime"] == 1
+    assert summary["response_time_p99"] == 0.5
+
+
+def test_input_needs_once(tmp_path):
+    runner = CliRunner()
+    result = runner.invoke(httpcheck_cli, ["--input", "-"])
+    assert result.exit_code == 2
+    assert "--input needs --once" in result.output
+
+
+def test_input_not_hedged():
+    runner = CliRunner()
+    result = runner.invoke(
+        httpcheck_cli, ["--input", "-", "--once", "--hedge-percentile", "0.9"]
+    )
+    assert result.exit_code == 2
+    assert "--input cannot be used with --hedge-percentile" in result.output
+
+
+def test_transitions_only_not_stored(tmp_path):
+    runner = CliRunner()
+    result = runner.invoke(
+        httpcheck_cli, ["--transitions-only", "--store", str(tmp_path), "--once"]
+    )
+    assert result.exit_code == 2
+    assert "--transitions-only cannot be used" in result.output
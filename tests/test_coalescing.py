@@ -0,0 +1,86 @@
+import httpx
+import pytest
+
+from httpcheck import coalescing
+from httpcheck.common import WebsiteMonitorConfig
+
+
+def make_config(key, **kwargs):
+    return WebsiteMonitorConfig(
+        url="http://example.com/health", key=key, method="GET", **kwargs
+    )
+
+
+def test_group_key():
+    group_key = coalescing.get_group_key(make_config("a"))
+    assert coalescing.get_group_key(make_config("b", regex="ok")) == group_key
+    assert coalescing.get_group_key(make_config("c", source="x.json")) == group_key
+    assert coalescing.get_group_key(make_config("d", identifier="team")) != group_key
+    assert coalescing.get_group_key(make_config("e", frequency=60)) != group_key
+
+    # The cached search result of a 304 response is shared by a group
+    conditional = make_config("f", conditional=True, regex="ok")
+    assert coalescing.get_group_key(conditional) != coalescing.get_group_key(
+        make_config("g", conditional=True, regex="up")
+    )
+
+
+def test_coalescer():
+    coalescer = coalescing.Coalescer()
+    group_config, is_new = coalescer.add(make_config("a", regex="ok"))
+    assert is_new
+    assert group_config.key.startswith("coalesced:")
+    assert group_config.regex is None
+    assert coalescer.add(make_config("b")) == (group_config, False)
+    assert coalescer.add(make_config("b", regex="up")) == (group_config, False)
+    assert [c.regex for c in coalescer.subscribers(group_config)] == ["ok", "up"]
+
+    assert coalescer.remove(make_config("a")) == (group_config, False)
+    assert coalescer.remove(make_config("b")) == (group_config, True)
+    assert coalescer.subscribers(group_config) == []
+    assert coalescer.group_configs() == []
+
+
+@pytest.mark.asyncio
+async def test_run(httpx_mock):
+    httpx_mock.add_response(data="status: ok")
+    subscribers = [
+        make_config("a", regex="ok"),
+        make_config("b", regex="down"),
+        make_config("c"),
+        make_config("d", regex="ok"),
+    ]
+    coalescer = coalescing.Coalescer()
+    for config in subscribers:
+        group_config, _ = coalescer.add(config)
+
+    results, subscriber_results = await coalescing.run(
+        group_config, coalescer.subscribers(group_config)
+    )
+
+    assert len(httpx_mock.get_requests()) == 1
+    assert results.is_online and results.regex_found is None
+    assert [(r.regex, r.regex_found) for r in subscriber_results] == [
+        ("ok", True),
+        ("down", False),
+        (None, None),
+        ("ok", True),
+    ]
+    assert all(r.bytes_read == 10 for r in subscriber_results)
+    assert len({id(r) for r in subscriber_results}) == 4
+
+
+@pytest.mark.asyncio
+async def test_run_failed(httpx_mock):
+    def fail(request, extensions):
+        raise httpx.ConnectError("refused", request=request)
+
+    httpx_mock.add_callback(fail)
+    config = make_config("a", regex="ok", retries=0)
+    results, (subscriber_results,) = await coalescing.run(
+        coalescing.Coalescer().add(config)[0], [config]
+    )
+    assert results.is_online is False
+    assert subscriber_results.exception == "ConnectError"
+    assert subscriber_results.regex == "ok"
+    assert subscriber_results.regex_found is None
@@ -0,0 +1,106 @@
+import asyncio
+
+import pytest
+
+from httpcheck import dns
+
+
+@pytest.fixture
+def lookups(monkeypatch):
+    """ The hosts looked up by the system resolver, which knows example.com. """
+    looked_up = []
+
+    async def query_system(host, port):
+        looked_up.append(host)
+        await asyncio.sleep(0.01)
+        if host != "example.com":
+            raise OSError(f"Unknown host {host}")
+        return ["93.184.216.34"]
+
+    monkeypatch.setattr(dns, "aiodns", None)
+    monkeypatch.setattr(dns, "query_system", query_system)
+    return looked_up
+
+
+@pytest.mark.asyncio
+async def test_resolve_cached(lookups):
+    resolver = dns.CachingResolver()
+    addresses, cache_hit, resolver_time = await resolver.resolve("example.com")
+    assert addresses == ["93.184.216.34"]
+    assert cache_hit is False and resolver_time > 0
+    assert await resolver.resolve("example.com") == (["93.184.216.34"], True, None)
+    assert await resolver.resolve("127.0.0.1") == (["127.0.0.1"], None, None)
+    assert lookups == ["example.com"]
+
+
+@pytest.mark.asyncio
+async def test_resolve_coalesced(lookups):
+    resolver = dns.CachingResolver()
+    answers = await asyncio.gather(*(resolver.resolve("example.com") for _ in "abc"))
+    assert [addresses for addresses, *_ in answers] == [["93.184.216.34"]] * 3
+    assert lookups == ["example.com"]
+
+
+@pytest.mark.asyncio
+async def test_resolve_negative_cached(lookups):
+    resolver = dns.CachingResolver({"dns_negative_ttl": 0.05})
+    for _ in "ab":
+        with pytest.raises(OSError, match="Unknown host"):
+            await resolver.resolve("missing.invalid")
+    assert lookups == ["missing.invalid"]
+
+    await asyncio.sleep(0.05)
+    with pytest.raises(OSError):
+        await resolver.resolve("missing.invalid")
+    assert lookups == ["missing.invalid"] * 2
+
+
+@pytest.mark.asyncio
+async def test_ttl_clamped(lookups, monkeypatch):
+    resolver = dns.CachingResolver({"dns_min_ttl": 30, "dns_max_ttl": 60})
+
+    async def query_aiodns(host):
+        return ["93.184.216.34"], {"short.example": 1, "long.example": 86400}[host]
+
+    monkeypatch.setattr(resolver, "_query_aiodns", query_aiodns)
+    monkeypatch.setattr(dns.time, "monotonic", lambda: 1000)
+    short = await resolver._query("short.example", 0)
+    long = await resolver._query("long.example", 0)
+    assert (short.expires, long.expires) == (1030, 1060)
+
+
+@pytest.mark.asyncio
+async def test_prewarm(lookups):
+    resolver = dns.CachingResolver()
+    await resolver.prewarm(
+        [
+            "https://example.com/",
+            "http://example.com:8080/status",
+            "http://missing.invalid/",
+            "http://127.0.0.1/",
+        ]
+    )
+    assert sorted(lookups) == ["example.com", "missing.invalid"]
+    await resolver.resolve("example.com")
+    assert len(lookups) == 2
+
+
+@pytest.mark.asyncio
+async def test_cache_evicted(lookups, monkeypatch):
+    async def query_system(host, port):
+        lookups.append(host)
+        return ["192.0.2.1"]
+
+    monkeypatch.setattr(dns, "query_system", query_system)
+    resolver = dns.CachingResolver(
+        {"dns_cache_size": 2, "dns_default_ttl": 0.05, "dns_min_ttl": 0}
+    )
+    for host in ("a.example", "b.example", "a.example", "c.example"):
+        await resolver.resolve(host)
+    assert list(resolver._cache) == ["a.example", "c.example"]
+
+    await asyncio.sleep(0.05)
+    lookups.clear()
+    await resolver.resolve("a.example")
+    assert lookups == ["a.example"]
+    assert list(resolver._cache) == ["c.example", "a.example"]
@@ -0,0 +1,45 @@
+import dataclasses
+import json
+
+import pytest
+
+from httpcheck import encoders
+from httpcheck import publishers
+from httpcheck.common import WebsiteCheckResults
+from httpcheck.common import WebsiteMonitorConfig
+
+
+@pytest.fixture
+def check_results():
+    config = WebsiteMonitorConfig("http://example.com/ü", regex="e.+e")
+    results = WebsiteCheckResults.from_config(config)
+    results.is_online = False
+    results.response_time = 0.1 + 0.2
+    results.exception = "ConnectError"
+    return results
+
+
+def test_json_encoder_is_identical(check_results):
+    expected = json.dumps(dataclasses.asdict(check_results)).encode("utf8")
+    assert encoders.encode_json(check_results) == expected
+
+
+def test_default_encoder_is_identical(check_results):
+    check_results.regex = "caf\u00e9 \u2603"
+    expected = json.dumps(dataclasses.asdict(check_results)).encode("utf8")
+    assert b"\\u00e9" in expected
+    assert encoders.get_encoder()(check_results) == expected
+    publisher = publishers.get_publisher({"backend": "console"})
+    assert publisher.encode(check_results) == expected
+
+
+@pytest.mark.parametrize("name", encoders.ENCODER_NAMES)
+def test_encoders_agree(check_results, name):
+    try:
+        encode = encoders.get_encoder(name)
+    except RuntimeError:
+        pytest.skip(f"{name} is not installed")
+    data = encode(check_results)
+    assert isinstance(data, bytes)
+    assert json.loads(data) == dataclasses.asdict(check_results)
+    assert list(json.loads(data)) == list(encoders.FIELD_NAMES)
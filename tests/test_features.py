@@ -1,12 +1,23 @@
+import asyncio
+import email.utils
+import pickle
+import re
+import time
+
 import httpcore
 import pytest
 import pytest_httpx
 
+from httpcheck import clients
+from httpcheck import common
+from httpcheck import conditional
+from httpcheck import retries
+from httpcheck import tracing
 from httpcheck import websitecheck
 
 
 def new_config(old_config, **updates):
-    kwargs = {**vars(old_config), **updates}
+    kwargs = {**old_config.as_dict(), **updates}
     Config = type(old_config)
     return Config(**kwargs)
 
@@ -57,3 +68,411 @@ async def test_identifier(monitor_config, httpx_mock):
     await websitecheck.run(monitor_config)
     (request1,) = httpx_mock.get_requests()
     assert request1.headers["user-agent"] == "httpcheck/hello"
+
+
+@pytest.mark.asyncio
+async def test_client_pool_reuse(monitor_config, httpx_mock):
+    httpx_mock.add_response()
+    async with clients.ClientPool() as client_pool:
+        await websitecheck.run(monitor_config, client_pool)
+        await websitecheck.run(monitor_config, client_pool)
+        assert len(client_pool._clients) == 1
+
+        other_config = new_config(monitor_config, identifier="other")
+        await websitecheck.run(other_config, client_pool)
+        assert len(client_pool._clients) == 2
+    assert len(httpx_mock.get_requests()) == 3
+
+
+@pytest.mark.asyncio
+async def test_fresh_connection(monitor_config, httpx_mock):
+    monitor_config = new_config(monitor_config, fresh_connection=True)
+    httpx_mock.add_response()
+    async with clients.ClientPool() as client_pool:
+        output = await websitecheck.run(monitor_config, client_pool)
+        assert not client_pool._clients
+    assert output.is_online is True
+
+
+@pytest.mark.asyncio
+async def test_hostname_is_cached(monitor_config, httpx_mock, monkeypatch):
+    lookups = []
+    monkeypatch.setattr("socket.getfqdn", lambda: lookups.append(1) or "checker")
+    monkeypatch.setattr(common, "_hostname", None)
+
+    httpx_mock.add_response()
+    output1 = await websitecheck.run(monitor_config)
+    output2 = await websitecheck.run(monitor_config)
+    assert output1.hostname == output2.hostname == "checker"
+    assert len(lookups) == 1
+
+
+async def iterate(chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+@pytest.mark.asyncio
+async def test_regex_across_chunks():
+    pattern = re.compile("testtest")
+    chunks = [b"aaaa test", b"test bbbb"]
+    assert await websitecheck.scan_body(iterate(chunks), pattern) == (True, 18)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "regex, chunks, expected",
+    [
+        # Chunk boundaries are not the start or the end of the body
+        (r"^b", [b"a" + b"bx" * 3000, b"!"], False),
+        (r"\Ab", [b"a" + b"bx" * 3000, b"!"], False),
+        (r"(?<!x)b", [b"a" + b"xb" * 3000, b"!"], False),
+        (r"(?m)^b", [b"a" + b"\nb" * 3000, b"!"], True),
+        (r"end$", [b"the end", b" is not here"], False),
+        (r"end$", [b"the", b" end"], True),
+        (r"\bword\b", [b"a word", b"y"], False),
+        (r"word(?!y)", [b"a word", b"y, a word"], True),
+    ],
+)
+async def test_regex_anchors_across_chunks(regex, chunks, expected):
+    pattern = re.compile(regex)
+    # The same as searching the whole body at once
+    assert bool(pattern.search(b"".join(chunks).decode())) is expected
+    found, _ = await websitecheck.scan_body(iterate(chunks), pattern)
+    assert found is expected
+
+
+def test_regex_compiled_per_config(monitor_config):
+    monitor_config = new_config(monitor_config, regex=r"test+")
+    assert monitor_config.pattern is monitor_config.pattern
+    # The compiled regex is not pickled (eg. for worker processes)
+    copied = pickle.loads(pickle.dumps(monitor_config))
+    assert copied == monitor_config
+    assert copied.pattern.search("a testtt")
+    assert new_config(monitor_config, regex=None).pattern is None
+
+
+@pytest.mark.asyncio
+async def test_regex_all_patterns():
+    patterns = [re.compile("first"), re.compile("second"), re.compile("third")]
+    chunks = [b"first a", b"second b", b"the end"]
+    found, bytes_read = await websitecheck.scan_body_all(iterate(chunks), patterns)
+    assert (found, bytes_read) == ((True, True, False), 22)
+
+    found, bytes_read = await websitecheck.scan_body_all(iterate(chunks), patterns[:2])
+    assert (found, bytes_read) == ((True, True), 15)
+
+
+@pytest.mark.asyncio
+async def test_regex_max_bytes():
+    pattern = re.compile("needle")
+    chunks = [b"a" * 100, b"needle"]
+    found, bytes_read = await websitecheck.scan_body(
+        iterate(chunks), pattern, max_bytes=50
+    )
+    assert (found, bytes_read) == (False, 50)
+
+
+@pytest.mark.asyncio
+async def test_regex_bytes_read(monitor_config, httpx_mock):
+    monitor_config = new_config(monitor_config, regex=r"test", regex_max_bytes=6)
+    httpx_mock.add_response(url=monitor_config.url, data="no match, test")
+    output = await websitecheck.run(monitor_config)
+    assert output.regex_found is False
+    assert output.bytes_read == 6
+
+
+@pytest.fixture
+async def local_url():
+    """ A keep-alive HTTP server on localhost, supporting conditional requests. """
+
+    async def respond(reader, writer):
+        while True:
+            request = await reader.readuntil(b"\r\n\r\n")
+            if b"if-none-match" in request.lower():
+                writer.write(b"HTTP/1.1 304 Not Modified\r\nETag: \"v1\"\r\n\r\n")
+            else:
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nETag: \"v1\"\r\n"
+                    b"Content-Length: 4\r\n\r\ntest"
+                )
+            await writer.drain()
+
+    server = await asyncio.start_server(respond, "localhost", 0)
+    port = server.sockets[0].getsockname()[1]
+    yield f"http://localhost:{port}/"
+    server.close()
+    await server.wait_closed()
+
+
+def test_tracing_supported():
+    # Without it, checks silently lose their timings and the DNS cache
+    assert tracing.TracingTransport is not None, (
+        "The installed httpcore does not provide the backend the request "
+        "timings build on"
+    )
+
+
+def test_untraced_fallback_warns(monkeypatch, caplog):
+    monkeypatch.setattr(tracing, "TracingTransport", None)
+    monkeypatch.setattr(tracing, "_warned_untraced", False)
+    assert tracing.make_transport() is None
+    assert tracing.make_transport() is None
+    warnings = [r for r in caplog.records if r.levelname == "WARNING"]
+    assert len(warnings) == 1
+    assert "request timings are not recorded" in warnings[0].getMessage()
+
+
+@pytest.mark.enable_socket
+@pytest.mark.asyncio
+async def test_request_timings(monitor_config, local_url):
+    monitor_config = new_config(monitor_config, url=local_url, method="GET", timeout=5)
+    async with clients.ClientPool() as client_pool:
+        first = await websitecheck.run(monitor_config, client_pool)
+        second = await websitecheck.run(monitor_config, client_pool)
+
+    assert first.is_online and second.is_online
+    assert first.connection_reused is False
+    assert first.dns_time >= 0 and first.connect_time >= 0
+    assert first.tls_time is None
+    assert first.dns_cache_hit is False and first.resolver_time >= 0
+    assert second.connection_reused is True
+    assert second.dns_time is second.connect_time is None
+    for results in (first, second):
+        assert 0 <= results.first_byte_time <= results.response_time
+        assert 0 <= results.body_time <= results.response_time
+
+
+@pytest.mark.asyncio
+async def test_request_timings_not_traced(monitor_config, httpx_mock):
+    httpx_mock.add_response()
+    output = await websitecheck.run(monitor_config)
+    assert output.response_time is not None
+    assert output.first_byte_time is not None
+    assert output.connection_reused is None
+    assert output.dns_time is None
+
+
+@pytest.mark.asyncio
+async def test_retry_after(monitor_config, httpx_mock):
+    headers = {"Retry-After": "120"}
+    httpx_mock.add_response(url=monitor_config.url, status_code=503, headers=headers)
+    output = await websitecheck.run(monitor_config)
+    assert output.status_code == 503
+    assert output.retry_after == 120
+
+
+def test_parse_retry_after():
+    assert websitecheck.parse_retry_after("30") == 30
+    assert websitecheck.parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+    assert 3500 < websitecheck.parse_retry_after(
+        email.utils.formatdate(time.time() + 3600, usegmt=True)
+    ) <= 3600
+    assert websitecheck.parse_retry_after("soon") is None
+    assert websitecheck.parse_retry_after(None) is None
+
+
+@pytest.mark.asyncio
+async def test_retry_statuses(monitor_config, httpx_mock):
+    monitor_config = new_config(
+        monitor_config, retries=2, retry_statuses=[503], retry_backoff=0
+    )
+    httpx_mock.add_response(status_code=503, headers={"Retry-After": "0"})
+    httpx_mock.add_response(status_code=200)
+    output = await websitecheck.run(monitor_config)
+    assert output.is_online is True
+    assert output.retries == 1
+    assert output.retry_after is None
+    assert [a["status_code"] for a in output.attempts] == [503, 200]
+    assert output.attempts[1]["start"] >= output.attempts[0]["duration"]
+
+
+@pytest.mark.asyncio
+async def test_retry_errors(monitor_config, httpx_mock):
+    monitor_config = new_config(
+        monitor_config, retries=2, retry_errors=["ConnectTimeout"], retry_backoff=0
+    )
+
+    def raise_exception(*args, **kwargs):
+        raise httpcore.ConnectError()
+
+    httpx_mock.add_callback(raise_exception)
+    output = await websitecheck.run(monitor_config)
+    assert output.exception == "ConnectError"
+    assert output.retries == 0
+    assert output.attempts is None
+    assert len(httpx_mock.get_requests()) == 1
+
+
+@pytest.fixture
+async def slow_first_url():
+    """ An HTTP server on localhost, that answers its first request after 1s. """
+    requests = 0
+    handlers = []
+
+    async def respond(reader, writer):
+        nonlocal requests
+        handlers.append(asyncio.current_task())
+        try:
+            while await reader.readuntil(b"\r\n\r\n"):
+                requests += 1
+                if requests == 1:
+                    await asyncio.sleep(1)
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 4\r\n\r\ntest")
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+
+    server = await asyncio.start_server(respond, "localhost", 0)
+    port = server.sockets[0].getsockname()[1]
+    yield f"http://localhost:{port}/"
+    for handler in handlers:
+        handler.cancel()
+    server.close()
+    await server.wait_closed()
+
+
+@pytest.mark.enable_socket
+@pytest.mark.asyncio
+async def test_deadline(monitor_config, slow_first_url):
+    monitor_config = new_config(
+        monitor_config, url=slow_first_url, timeout=5, retries=3, deadline=0.2
+    )
+    start = time.perf_counter()
+    output = await websitecheck.run(monitor_config)
+    assert time.perf_counter() - start < 0.5
+    assert output.is_online is False
+    assert output.exception == "DeadlineExceeded"
+    assert output.retries == 0
+
+
+@pytest.mark.enable_socket
+@pytest.mark.asyncio
+async def test_hedged_request(monitor_config, slow_first_url):
+    monitor_config = new_config(
+        monitor_config, url=slow_first_url, timeout=5, hedge_percentile=0.95
+    )
+    client_pool = clients.ClientPool()
+    for _ in range(retries.MIN_HISTORY):
+        client_pool.latency_history.add(monitor_config.url, 0.05)
+
+    async with client_pool:
+        output = await websitecheck.run(monitor_config, client_pool)
+    assert output.is_online is True
+    assert output.response_time < 0.5
+    first, hedge = output.attempts
+    assert first["hedge"] is False and first["exception"] == "Cancelled"
+    assert hedge["hedge"] is True and hedge["status_code"] == 200
+    assert hedge["start"] >= 0.05
+
+
+@pytest.mark.asyncio
+async def test_conditional_request(monitor_config, httpx_mock):
+    monitor_config = new_config(
+        monitor_config,
+        url="http://example.com/conditional",
+        method="GET",
+        regex="test",
+        conditional=True,
+    )
+    headers = {"ETag": '"v1"', "Last-Modified": "Wed, 21 Oct 2015 07:28:00 GMT"}
+
+    def respond(request, *args, **kwargs):
+        if request.headers.get("if-none-match") == '"v1"':
+            assert request.headers["if-modified-since"] == headers["Last-Modified"]
+            return pytest_httpx.to_response(status_code=304)
+        return pytest_httpx.to_response(data="a test", headers=headers)
+
+    httpx_mock.add_callback(respond)
+    async with clients.ClientPool() as client_pool:
+        first = await websitecheck.run(monitor_config, client_pool)
+        assert first.regex_found is True
+        assert first.bytes_saved is None
+
+        second = await websitecheck.run(monitor_config, client_pool)
+        assert second.is_online is True
+        assert second.status_code == 304
+        assert second.regex_found is True
+        assert second.bytes_read == 0
+        assert second.bytes_saved == 6
+
+        # A different regex cannot reuse the result
+        await websitecheck.run(new_config(monitor_config, regex="other"), client_pool)
+        assert "if-none-match" not in httpx_mock.get_requests()[-1].headers
+
+        client_pool.response_cache.forget(monitor_config)
+        await websitecheck.run(monitor_config, client_pool)
+        assert "if-none-match" not in httpx_mock.get_requests()[-1].headers
+
+
+@pytest.mark.asyncio
+async def test_range_request(monitor_config, httpx_mock):
+    monitor_config = new_config(
+        monitor_config, method="GET", regex="test", range_bytes=10
+    )
+
+    def partial_content(request, *args, **kwargs):
+        assert request.headers["range"] == "bytes=0-9"
+        headers = {"Content-Range": "bytes 0-9/100"}
+        return pytest_httpx.to_response(
+            status_code=206, data="a test ...", headers=headers
+        )
+
+    httpx_mock.add_callback(partial_content)
+    output = await websitecheck.run(monitor_config)
+    assert output.is_online is True
+    assert output.regex_found is True
+    assert output.bytes_saved == 90
+
+
+@pytest.mark.asyncio
+async def test_range_not_satisfiable(monitor_config, httpx_mock):
+    monitor_config = new_config(
+        monitor_config, method="GET", regex="test", range_bytes=10
+    )
+
+    def respond(request, *args, **kwargs):
+        if "range" in request.headers:
+            return pytest_httpx.to_response(status_code=416)
+        return pytest_httpx.to_response(data="")
+
+    httpx_mock.add_callback(respond)
+    output = await websitecheck.run(monitor_config)
+    assert output.is_online is True
+    assert output.status_code == 200
+    assert output.regex_found is False
+    assert len(httpx_mock.get_requests()) == 2
+
+
+def test_parse_content_range_size():
+    assert conditional.parse_content_range_size("bytes 0-9/100") == 100
+    assert conditional.parse_content_range_size("bytes 0-9/*") is None
+    assert conditional.parse_content_range_size(None) is None
+
+
+@pytest.mark.enable_socket
+@pytest.mark.asyncio
+async def test_regex_found_reuses_connection(monitor_config, local_url):
+    monitor_config = new_config(
+        monitor_config, url=local_url, method="GET", regex="te", timeout=5
+    )
+    async with clients.ClientPool() as client_pool:
+        first = await websitecheck.run(monitor_config, client_pool)
+        second = await websitecheck.run(monitor_config, client_pool)
+
+    assert first.regex_found is second.regex_found is True
+    # The rest of the body is read, so the connection goes back to the pool
+    assert second.connection_reused is True
+
+
+@pytest.mark.enable_socket
+@pytest.mark.asyncio
+async def test_not_modified_reuses_connection(monitor_config, local_url):
+    monitor_config = new_config(
+        monitor_config, url=local_url, method="GET", conditional=True, timeout=5
+    )
+    async with clients.ClientPool() as client_pool:
+        checks = [await websitecheck.run(monitor_config, client_pool) for _ in range(4)]
+
+    assert [c.status_code for c in checks] == [200, 304, 304, 304]
+    assert [c.connection_reused for c in checks] == [False, True, True, True]
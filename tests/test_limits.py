@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+from httpcheck import limits
+from httpcheck import scheduler
+from httpcheck.common import WebsiteMonitorConfig
+
+
+def make_counting_job():
+    in_flight = 0
+    peaks = []
+
+    async def job_fn(monitor_config):
+        nonlocal in_flight
+        in_flight += 1
+        peaks.append(in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+
+    return job_fn, peaks
+
+
+@pytest.mark.asyncio
+async def test_max_per_host():
+    job_fn, peaks = make_counting_job()
+    limiter = limits.ConcurrencyLimiter({"max_per_host": 2})
+    job_scheduler = scheduler.Scheduler(job_fn, limiter=limiter)
+    configs = [WebsiteMonitorConfig(f"http://example.com/{i}") for i in range(5)]
+
+    await asyncio.gather(*(job_scheduler.run_once(c) for c in configs))
+
+    assert max(peaks) == 2
+    assert limiter.queue_depth == 0
+    assert limiter.in_flight == 0
+    assert not limiter._host_slots
+
+
+@pytest.mark.asyncio
+async def test_max_in_flight():
+    job_fn, peaks = make_counting_job()
+    limiter = limits.ConcurrencyLimiter({"max_in_flight": 3, "max_per_host": None})
+    job_scheduler = scheduler.Scheduler(job_fn, limiter=limiter)
+    configs = [WebsiteMonitorConfig(f"http://{i}.example.com/") for i in range(10)]
+
+    await asyncio.gather(*(job_scheduler.run_once(c) for c in configs))
+
+    assert max(peaks) == 3
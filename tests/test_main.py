@@ -0,0 +1,271 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from httpcheck import clients
+from httpcheck import common
+from httpcheck import main
+from httpcheck import scheduler
+from httpcheck import sharding
+
+
+class RecordingScheduler:
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        def record(monitor_config):
+            self.calls.append((name, monitor_config.key))
+
+        return record
+
+
+@pytest.fixture(autouse=True)
+def hostname(monkeypatch):
+    monkeypatch.setattr("socket.getfqdn", lambda: "checker")
+    monkeypatch.setattr("httpcheck.common._hostname", None)
+
+
+def write_websites(path, websites):
+    path.write_text(json.dumps(websites))
+    return str(path)
+
+
+@pytest.mark.asyncio
+async def test_reload_config(tmp_path):
+    websites = {
+        "unchanged": {"url": "http://example.com/1"},
+        "new-url": {"url": "http://example.com/2"},
+        "new-frequency": {"url": "http://example.com/3", "frequency": 60},
+        "removed": {"url": "http://example.com/4"},
+    }
+    filename = write_websites(tmp_path / "websites.json", websites)
+    job_scheduler = RecordingScheduler()
+    manager = main.MonitorManager(
+        monitor_configs=main.load_websites(filename),
+        scheduler=job_scheduler,
+        websites_filename=filename,
+    )
+
+    websites["new-url"]["url"] = "http://example.com/two"
+    websites["new-frequency"]["frequency"] = 30
+    del websites["removed"]
+    websites["added"] = {"url": "http://example.com/5"}
+    write_websites(tmp_path / "websites.json", websites)
+    await manager.async_reload_config()
+
+    assert sorted(job_scheduler.calls) == [
+        ("reschedule", "new-frequency"),
+        ("schedule", "added"),
+        ("unschedule", "removed"),
+        ("update", "new-url"),
+    ]
+    assert manager.monitor_configs["new-url"].url == "http://example.com/two"
+    assert manager.monitor_configs["new-frequency"].frequency == 30
+    assert set(manager.monitor_configs) == set(websites)
+
+
+@pytest.mark.asyncio
+async def test_reload_forgets_responses(tmp_path):
+    websites = {
+        key: {"url": f"http://example.com/{key}", "method": "GET", "conditional": True}
+        for key in ("kept", "moved", "removed")
+    }
+    filename = write_websites(tmp_path / "websites.json", websites)
+    client_pool = clients.ClientPool()
+    manager = main.MonitorManager(
+        monitor_configs=main.load_websites(filename),
+        scheduler=RecordingScheduler(),
+        client_pool=client_pool,
+        websites_filename=filename,
+    )
+    response = httpx.Response(200, headers={"ETag": '"v1"'})
+    for config in manager.monitor_configs.values():
+        results = common.WebsiteCheckResults.from_config(config)
+        client_pool.response_cache.store(config, response, results)
+        client_pool.latency_history.add(config.key, 0.1)
+
+    websites["moved"]["url"] = "http://example.com/elsewhere"
+    del websites["removed"]
+    write_websites(tmp_path / "websites.json", websites)
+    await manager.async_reload_config()
+
+    configs = manager.monitor_configs
+    assert client_pool.response_cache.get(configs["kept"]) is not None
+    assert client_pool.response_cache.get(configs["moved"]) is None
+    assert len(client_pool.response_cache) == 1
+    assert len(client_pool.latency_history) == 1
+
+
+@pytest.mark.asyncio
+async def test_reload_coalesced(tmp_path):
+    health = {"url": "http://example.com/health", "method": "GET"}
+    websites = {
+        "a": {**health, "regex": "ok"},
+        "b": {**health, "regex": "up"},
+        "c": {**health, "frequency": 60},
+    }
+    filename = write_websites(tmp_path / "websites.json", websites)
+    job_scheduler = RecordingScheduler()
+    manager = main.MonitorManager(
+        monitor_configs={},
+        scheduler=job_scheduler,
+        websites_filename=filename,
+        coalescer=main.coalescing.Coalescer(),
+    )
+    await manager.load_monitors(manager.schedule)
+    shared, every_minute = (key for name, key in job_scheduler.calls)
+    assert job_scheduler.calls == [("schedule", shared), ("schedule", every_minute)]
+
+    job_scheduler.calls.clear()
+    websites["a"]["regex"] = "healthy"
+    websites["c"]["frequency"] = 300
+    websites["d"] = {**health, "method": "HEAD"}
+    write_websites(tmp_path / "websites.json", websites)
+    await manager.async_reload_config()
+
+    assert sorted(job_scheduler.calls) == [
+        ("schedule", main.coalescing.get_group_key(manager.monitor_configs["d"])),
+        ("unschedule", every_minute),
+    ]
+    group_config = main.coalescing.Coalescer().add(manager.monitor_configs["a"])[0]
+    subscribers = manager.coalescer.subscribers(group_config)
+    assert [c.key for c in subscribers] == ["a", "b", "c"]
+    assert subscribers[0].regex == "healthy"
+
+
+@pytest.mark.enable_socket
+def test_schedule_invalid_config(tmp_path, event_loop):
+    filename = tmp_path / "websites.json"
+    filename.write_text("{")
+
+    async def job_fn(config):
+        pass
+
+    manager = main.MonitorManager(
+        monitor_configs={},
+        scheduler=scheduler.Scheduler(job_fn, backend=scheduler.NativeBackend()),
+        websites_filename=str(filename),
+    )
+    asyncio.set_event_loop(event_loop)
+    with pytest.raises(ValueError):
+        manager.schedule_all_monitors()
+    assert manager.monitor_configs == {}
+
+
+@pytest.mark.asyncio
+async def test_reload_invalid_config(tmp_path):
+    filename = write_websites(tmp_path / "websites.json", {"one": {}})
+    job_scheduler = RecordingScheduler()
+    manager = main.MonitorManager(
+        monitor_configs=main.load_websites(filename),
+        scheduler=job_scheduler,
+        websites_filename=filename,
+    )
+
+    (tmp_path / "websites.json").write_text("{")
+    await manager.async_reload_config()
+
+    assert not job_scheduler.calls
+    assert set(manager.monitor_configs) == {"one"}
+
+
+def test_parse_websites_directory(tmp_path):
+    write_websites(tmp_path / "a.json", {"one": {"url": "http://example.com/1"}})
+    (tmp_path / "b.jsonl").write_text(
+        '{"url": "http://example.com/2"}\n'
+        "\n"
+        '{"key": "three", "url": "http://example.com/3", "frequency": 60}\n'
+    )
+    (tmp_path / "ignored.txt").write_text("not a websites file")
+
+    configs = main.load_websites(str(tmp_path))
+
+    assert list(configs) == ["one", "http://example.com/2", "three"]
+    assert configs["three"].frequency == 60
+    assert configs["three"].source == str(tmp_path / "b.jsonl")
+
+
+def test_parse_websites_jsonl_error(tmp_path):
+    (tmp_path / "websites.jsonl").write_text('{"url": "http://example.com"}\n{}\n')
+    with pytest.raises(ValueError, match="websites.jsonl:2"):
+        main.load_websites(str(tmp_path / "websites.jsonl"))
+
+
+@pytest.mark.asyncio
+async def test_load_monitors(tmp_path):
+    filename = write_websites(
+        tmp_path / "websites.json",
+        {"one": {"frequency": 60}, "http://example.com": {"frequency": 60}},
+    )
+    cli_config = main.common.WebsiteMonitorConfig("http://example.com")
+    manager = main.MonitorManager(
+        monitor_configs={"http://example.com": cli_config}, websites_filename=filename,
+    )
+    started = []
+    await manager.load_monitors(started.append)
+
+    assert [c.url for c in started] == ["http://example.com", "one"]
+    assert manager.monitor_configs["http://example.com"] is cli_config
+
+
+@pytest.mark.asyncio
+async def test_reload_cluster_members(tmp_path):
+    members_file = tmp_path / "members"
+    members_file.write_text("a\nb\n")
+    membership = sharding.Membership(str(members_file), "a")
+    membership.reload()
+    configs = {
+        f"monitor-{i}": common.WebsiteMonitorConfig(
+            url=f"http://example.com/{i}", key=f"monitor-{i}"
+        )
+        for i in range(20)
+    }
+    job_scheduler = RecordingScheduler()
+    manager = main.MonitorManager(
+        monitor_configs=configs, scheduler=job_scheduler, membership=membership
+    )
+    await manager.load_monitors(job_scheduler.schedule)
+    owned = set(manager.monitor_configs)
+    assert 0 < len(owned) < 20
+
+    members_file.write_text("a\n")
+    job_scheduler.calls.clear()
+    await manager.async_reload_config()
+
+    assert sorted(job_scheduler.calls) == sorted(
+        ("schedule", key) for key in configs if key not in owned
+    )
+    assert set(manager.monitor_configs) == set(configs)
+
+
+@pytest.mark.asyncio
+async def test_nodes_check_each_monitor_once(tmp_path):
+    members_file = tmp_path / "members"
+    members_file.write_text("a\nb\n")
+    filename = write_websites(
+        tmp_path / "websites.json",
+        {f"monitor-{i}": {"url": f"http://example.com/{i}"} for i in range(50)},
+    )
+    checked = {"a": [], "b": []}
+
+    def make_manager(node):
+        async def job_fn(config):
+            checked[node].append(config.key)
+
+        membership = sharding.Membership(str(members_file), node)
+        membership.reload()
+        return main.MonitorManager(
+            monitor_configs={},
+            scheduler=scheduler.Scheduler(job_fn, backend=scheduler.NativeBackend()),
+            websites_filename=filename,
+            membership=membership,
+        )
+
+    for node in checked:
+        await make_manager(node).async_run_all_monitors_once()
+
+    assert checked["a"] and checked["b"]
+    assert sorted(checked["a"] + checked["b"]) == sorted(main.load_websites(filename))
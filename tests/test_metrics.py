@@ -0,0 +1,53 @@
+import asyncio
+
+import pytest
+
+from httpcheck import metrics
+
+
+def test_histogram_buckets():
+    registry = metrics.MetricsRegistry(buckets=(0.1, 1))
+    for response_time in (0.05, 0.1, 0.5, 2):
+        registry.record("http://example.com", "", True, response_time, 200)
+    registry.record("http://example.com", "", False, None, None)
+
+    lines = registry.render().decode().splitlines()
+    labels = 'url="http://example.com",identifier=""'
+    assert f'httpcheck_checks_total{{{labels},outcome="online"}} 4' in lines
+    assert f'httpcheck_checks_total{{{labels},outcome="offline"}} 1' in lines
+    assert f"httpcheck_up{{{labels}}} 0" in lines
+    assert f'httpcheck_response_time_seconds_bucket{{{labels},le="0.1"}} 2' in lines
+    assert f'httpcheck_response_time_seconds_bucket{{{labels},le="1.0"}} 3' in lines
+    assert f'httpcheck_response_time_seconds_bucket{{{labels},le="+Inf"}} 4' in lines
+    assert f"httpcheck_response_time_seconds_sum{{{labels}}} 2.65" in lines
+    assert f"httpcheck_response_time_seconds_count{{{labels}}} 4" in lines
+
+
+def test_labels_are_escaped():
+    registry = metrics.MetricsRegistry()
+    registry.record('http://example.com/"\\', "eu\nwest", True, 0.1, 200)
+    labels = 'url="http://example.com/\\"\\\\",identifier="eu\\nwest"'
+    assert f"httpcheck_up{{{labels}}} 1" in registry.render().decode()
+
+
+@pytest.mark.enable_socket
+@pytest.mark.asyncio
+async def test_serve_metrics():
+    registry = metrics.MetricsRegistry()
+    registry.record("http://example.com", "", True, 0.1, 200)
+    server = await metrics.serve_metrics(registry, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+
+    async def get(path):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+        response = await reader.read()
+        writer.close()
+        return response
+
+    response = await get("/metrics")
+    assert response.startswith(b"HTTP/1.1 200 OK")
+    assert response.endswith(registry.render())
+    assert (await get("/")).startswith(b"HTTP/1.1 404 Not Found")
+    server.close()
+    await server.wait_closed()
@@ -0,0 +1,171 @@
+import asyncio
+import os
+import threading
+from unittest import mock
+
+import pytest
+
+from httpcheck import publishers
+from httpcheck import store
+from httpcheck.common import WebsiteCheckResults
+from httpcheck.common import WebsiteMonitorConfig
+
+
+class RecordingPublisher(publishers.BasePublisher):
+    key = "test-recording"
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.batches = []
+
+    def write_batch(self, msgs):
+        self.batches.append(list(msgs))
+
+
+@pytest.mark.asyncio
+async def test_immediate_publishing(capsys):
+    publisher = publishers.get_publisher({"backend": "console"})
+    await publisher.submit(b"one")
+    assert capsys.readouterr().out == "one\n"
+
+
+@pytest.mark.asyncio
+async def test_queued_publishing_batches():
+    config = {"queue_size": 10, "batch_size": 3, "flush_interval": 0.01}
+    publisher = RecordingPublisher(config)
+    for i in range(7):
+        await publisher.submit(str(i).encode())
+    await publisher.aclose()
+
+    published = [m for batch in publisher.batches for m in batch]
+    assert published == [str(i).encode() for i in range(7)]
+    assert max(len(batch) for batch in publisher.batches) == 3
+    assert publisher.counters.queued == publisher.counters.flushed == 7
+
+
+@pytest.mark.asyncio
+async def test_queued_console_publishing(capsys):
+    config = {"backend": "console", "queue_size": 10}
+    publisher = publishers.get_publisher(config)
+    await publisher.submit(b"one")
+    await publisher.submit(b"two")
+    await publisher.aclose()
+    assert capsys.readouterr().out == "one\ntwo\n"
+
+
+@pytest.mark.asyncio
+async def test_overflow_drop_oldest():
+    config = {"queue_size": 2, "overflow": "drop-oldest"}
+    publisher = RecordingPublisher(config)
+    # Nothing is drained until the test waits for the publisher to finish
+    for i in range(4):
+        await publisher.submit(str(i).encode())
+    await publisher.aclose()
+    assert publisher.batches == [[b"2", b"3"]]
+    assert publisher.counters.dropped == 2
+
+
+@pytest.mark.asyncio
+async def test_overflow_spill(tmp_path):
+    spill_filename = tmp_path / "spill.jsonl"
+    config = {"queue_size": 1, "overflow": "spill", "spill_filename": spill_filename}
+    publisher = RecordingPublisher(config)
+    write_spill = publisher._write_spill
+    threads = set()
+
+    def record_thread(msg):
+        threads.add(threading.current_thread())
+        write_spill(msg)
+
+    publisher._write_spill = record_thread
+    for i in range(3):
+        await publisher.submit(str(i).encode())
+    await publisher.aclose()
+
+    # Written off the event loop, to a file kept open until the end
+    assert threading.main_thread() not in threads
+    assert publisher._spill_file is None
+    spilled = spill_filename.read_bytes().splitlines()
+    published = [m for batch in publisher.batches for m in batch]
+    assert publisher.counters.spilled == len(spilled) > 0
+    assert sorted(published + spilled) == [b"0", b"1", b"2"]
+
+
+@pytest.mark.asyncio
+async def test_pipe_publishing():
+    read_fd, write_fd = os.pipe()
+    publisher = publishers.get_publisher({"backend": "pipe", "fd": write_fd})
+    await publisher.submit(b"one")
+    await publisher.submit(b"two")
+    with os.fdopen(read_fd, "rb") as reader:
+        os.close(write_fd)
+        assert reader.read() == b"one\ntwo\n"
+
+
+@pytest.mark.enable_socket
+@pytest.mark.asyncio
+async def test_prometheus_publishing(capsys):
+    config = {"backend": "prometheus", "metrics_port": 0}
+    publisher = publishers.get_publisher(config)
+    await publisher.astart()
+    # Metrics are served before any results are published
+    port = publisher._server.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+    assert (await reader.read()).startswith(b"HTTP/1.1 200 OK")
+    writer.close()
+
+    results = WebsiteCheckResults(
+        method="HEAD", url="http://example.com", timestamp="", is_online=True
+    )
+    await publisher.submit_results(results)
+    await publisher.submit_encoded(publisher.encode(results))
+    await publisher.aclose()
+
+    assert len(capsys.readouterr().out.splitlines()) == 2
+    assert b'outcome="online"} 2' in publisher.registry.render()
+
+
+@pytest.mark.asyncio
+async def test_store_publishing(tmp_path, capsys):
+    config = {"backend": "store", "store_directory": str(tmp_path)}
+    results = WebsiteCheckResults.from_config(
+        WebsiteMonitorConfig(url="http://example.com")
+    )
+    results.is_online = True
+    with publishers.get_publisher(config) as publisher:
+        with mock.patch("json.loads", side_effect=AssertionError("Decoded")):
+            await publisher.submit_results(results)
+        # Eg. from a worker
+        await publisher.submit_encoded(publisher.encode(results))
+        await publisher.submit_record({"record": "stats"})
+    assert len(capsys.readouterr().out.splitlines()) == 3
+
+    start = store.to_epoch(results.timestamp)
+    (summary,) = store.query(str(tmp_path), start, start + 1)
+    assert summary["url"] == "http://example.com"
+    assert summary["checks"] == 2
+
+
+@pytest.mark.enable_socket
+@pytest.mark.asyncio
+async def test_prometheus_store_publishing(tmp_path, capsys):
+    config = {
+        "backend": "prometheus-store",
+        "metrics_port": 0,
+        "store_directory": str(tmp_path),
+    }
+    results = WebsiteCheckResults.from_config(
+        WebsiteMonitorConfig(url="http://example.com")
+    )
+    results.is_online = True
+    with publishers.get_publisher(config) as publisher:
+        await publisher.astart()
+        await publisher.submit_results(results)
+        await publisher.aclose()
+    assert len(capsys.readouterr().out.splitlines()) == 1
+    assert b'outcome="online"} 1' in publisher.registry.render()
+
+    start = store.to_epoch(results.timestamp)
+    (summary,) = store.query(str(tmp_path), start, start + 1)
+    assert summary["checks"] == 1
@@ -0,0 +1,50 @@
+import random
+
+import httpcore
+import httpx
+
+from httpcheck import retries
+from httpcheck.common import WebsiteMonitorConfig
+
+
+def test_backoff_delay():
+    config = WebsiteMonitorConfig(url="http://example.com", retry_max_delay=3)
+    rand = random.Random(0)
+    for retry_idx, cap in enumerate([0.5, 1, 2, 3, 3]):
+        delays = [retries.backoff_delay(config, retry_idx, rand=rand) for _ in "ab"]
+        assert all(0 <= delay <= cap for delay in delays)
+    assert retries.backoff_delay(config, 0, retry_after=2) == 2
+    assert retries.backoff_delay(config, 0, retry_after=60) == 3
+
+
+def test_is_retryable():
+    config = WebsiteMonitorConfig(url="http://example.com", retry_statuses=[503])
+    assert config.retry_statuses == (503,)
+
+    def wrapped(exc):
+        try:
+            raise ConnectionError(type(exc).__name__) from exc
+        except ConnectionError as wrapper:
+            return wrapper
+
+    assert retries.is_retryable_error(config, wrapped(httpcore.ReadTimeout()))
+    assert retries.is_retryable_error(config, wrapped(httpx.ConnectError("")))
+    assert not retries.is_retryable_error(config, wrapped(httpx.TooManyRedirects("")))
+
+    config = WebsiteMonitorConfig(url="http://example.com", retry_errors=["ReadError"])
+    assert not retries.is_retryable_error(config, wrapped(httpcore.ReadTimeout()))
+    assert retries.is_retryable_error(config, wrapped(httpcore.ReadError()))
+
+
+def test_latency_history():
+    history = retries.LatencyHistory(size=20, min_size=10)
+    for i in range(9):
+        history.add("a", i)
+    assert history.hedge_delay("a", 0.95) is None
+    for i in range(100):
+        history.add("a", i)
+    assert history.hedge_delay("a", 0.5) == 90
+    assert history.hedge_delay("b", 0.5) is None
+    history.forget("a")
+    assert history.hedge_delay("a", 0.5) is None
+    assert len(history) == 0
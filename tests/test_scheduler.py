@@ -0,0 +1,133 @@
+import asyncio
+import time
+
+import pytest
+
+from httpcheck import scheduler
+from httpcheck import stats
+from httpcheck.common import WebsiteMonitorConfig
+
+
+async def job_fn(monitor_config):
+    pass
+
+
+def test_van_der_corput():
+    values = [scheduler.van_der_corput(i) for i in range(4)]
+    assert values == [0, 0.5, 0.25, 0.75]
+
+
+def test_stagger_even():
+    job_scheduler = scheduler.Scheduler(job_fn, stagger="even")
+    configs = [
+        WebsiteMonitorConfig(f"http://{i}.example.com", frequency=60) for i in range(4)
+    ]
+    delays = [job_scheduler.get_first_run_delay(c) for c in configs]
+    assert delays == [0, 30, 15, 45]
+
+
+def test_stagger_hash_is_stable():
+    config = WebsiteMonitorConfig("http://example.com", frequency=60)
+    scheduler1 = scheduler.Scheduler(job_fn, stagger="hash")
+    scheduler2 = scheduler.Scheduler(job_fn, stagger="hash")
+
+    delay1 = scheduler1.get_first_run_delay(config, now=1000)
+    assert delay1 == scheduler2.get_first_run_delay(config, now=1000)
+    assert 0 <= delay1 < 60
+    # The phase is anchored to the clock, not to when the process started
+    assert scheduler1.get_first_run_delay(config, now=1010) == pytest.approx(
+        (delay1 - 10) % 60
+    )
+
+
+def test_unknown_stagger_mode():
+    with pytest.raises(ValueError):
+        scheduler.Scheduler(job_fn, stagger="random")
+
+
+@pytest.mark.asyncio
+async def test_native_backend():
+    runs = []
+
+    async def record_run(monitor_config):
+        runs.append(monitor_config.url)
+
+    backend = scheduler.NativeBackend()
+    job_scheduler = scheduler.Scheduler(record_run, backend=backend)
+    config1 = WebsiteMonitorConfig("http://one.example.com", frequency=0.02)
+    config2 = WebsiteMonitorConfig("http://two.example.com", frequency=0.02)
+    job_scheduler.schedule(config1)
+    job_scheduler.schedule(config2)
+    job_scheduler.start()
+
+    await asyncio.sleep(0.05)
+    job_scheduler.unschedule(config2)
+    runs_before = runs.count(config2.url)
+    await asyncio.sleep(0.05)
+
+    assert runs.count(config1.url) >= 4
+    assert runs_before >= 2
+    assert runs.count(config2.url) == runs_before
+
+
+@pytest.mark.asyncio
+async def test_native_backend_reschedule():
+    runs = []
+
+    async def record_run(monitor_config):
+        runs.append(monitor_config.url)
+
+    backend = scheduler.NativeBackend()
+    job_scheduler = scheduler.Scheduler(record_run, backend=backend, stagger="even")
+    config = WebsiteMonitorConfig("http://example.com", frequency=10)
+    job_scheduler.schedule(config)
+    job_scheduler.start()
+    await asyncio.sleep(0.01)
+    assert runs == [config.url]
+
+    job_scheduler.reschedule(WebsiteMonitorConfig("http://example.com", frequency=0.02))
+    await asyncio.sleep(0.05)
+    assert len(runs) >= 2
+    assert len(backend._jobs) == 1
+
+
+@pytest.mark.parametrize("backend_name", sorted(scheduler.BACKENDS))
+@pytest.mark.asyncio
+async def test_stats_of_blocked_loop(backend_name, caplog):
+    async def block_loop(monitor_config):
+        time.sleep(0.25)
+
+    job_stats = stats.SchedulerStats(lag_warning=0.1)
+    job_scheduler = scheduler.Scheduler(
+        block_loop,
+        backend=scheduler.make_backend(backend_name),
+        stagger="hash",
+        stats=job_stats,
+    )
+    job_scheduler.schedule(WebsiteMonitorConfig("http://example.com", frequency=0.1))
+    job_scheduler.start()
+    probe = asyncio.ensure_future(job_stats.probe_loop_lag(interval=0.05))
+    await asyncio.sleep(1)
+    probe.cancel()
+    job_scheduler.stop()
+
+    summary = job_stats.snapshot()
+    assert summary["checks_started"] >= 2
+    assert summary["schedule_lag_max"] > 0
+    assert summary["loop_lag_max"] > 0.1
+    assert summary["coalesced"] + summary["missed"] >= 1
+    assert "late" in caplog.text or "behind" in caplog.text
+    assert job_stats.snapshot()["checks_started"] == 0
+
+
+def test_stats_bounded(monkeypatch):
+    monkeypatch.setattr(stats, "MAX_LAG_SAMPLES", 100)
+    job_stats = stats.SchedulerStats(lag_warning=0)
+    for index in range(1000):
+        job_stats.job_launched("job", time.monotonic() - index / 1000)
+        job_stats.job_started("job")
+    assert len(job_stats.lags) == 100
+
+    summary = job_stats.snapshot()
+    assert summary["checks_started"] == 1000
+    assert summary["schedule_lag_max"] >= 0.999
@@ -0,0 +1,73 @@
+from httpcheck import common
+from httpcheck import sharding
+
+
+def make_config(key):
+    return common.WebsiteMonitorConfig(url=f"http://{key}.example.com", key=key)
+
+
+def test_shards_partition_monitors():
+    configs = [make_config(f"monitor-{i}") for i in range(1000)]
+    shards = [sharding.Shard(i, 4) for i in range(4)]
+
+    owners = [[s.index for s in shards if s.owns(config)] for config in configs]
+    assert all(len(owner) == 1 for owner in owners)
+    counts = [sum(owner == [s.index] for owner in owners) for s in shards]
+    assert min(counts) > 200
+
+
+def test_adding_a_shard_moves_few_monitors():
+    keys = [f"monitor-{i}" for i in range(1000)]
+    before = [sharding.jump_hash(key, 4) for key in keys]
+    after = [sharding.jump_hash(key, 5) for key in keys]
+    moved = [b for b, a in zip(before, after) if b != a]
+    assert len(moved) < 300
+    assert all(a == 4 for b, a in zip(before, after) if b != a)
+
+
+def test_ownership_follows_key():
+    shard = sharding.Shard(0, 3)
+    config = make_config("monitor")
+    moved = common.WebsiteMonitorConfig(url="http://moved.example.com", key="monitor")
+    assert shard.owns(config) == shard.owns(moved)
+
+
+def test_shard_replicas():
+    configs = [make_config(f"monitor-{i}") for i in range(100)]
+    shards = [sharding.Shard(i, 3, replicas=2) for i in range(3)]
+    for config in configs:
+        assert sum(s.owns(config) for s in shards) == 2
+
+
+def test_salted_shards_are_independent():
+    configs = [make_config(f"monitor-{i}") for i in range(1000)]
+    node, worker = sharding.Shard(0, 2), sharding.Shard(0, 2, salt="worker:")
+    both = [c for c in configs if node.owns(c) and worker.owns(c)]
+    assert 150 < len(both) < 350
+
+
+def test_membership_failover(tmp_path):
+    members_file = tmp_path / "members"
+    members_file.write_text("a\nb\n# down for maintenance\n\nc\n")
+    memberships = [sharding.Membership(str(members_file), node) for node in "abc"]
+    assert all(m.reload() for m in memberships)
+    assert memberships[0].members == ("a", "b", "c")
+
+    configs = [make_config(f"monitor-{i}") for i in range(300)]
+    before = {c.key: [m.node for m in memberships if m.owns(c)] for c in configs}
+    assert all(len(owners) == 1 for owners in before.values())
+
+    members_file.write_text("a\nb\n")
+    assert all(m.reload() for m in memberships)
+    assert not memberships[0].reload()
+    after = {c.key: [m.node for m in memberships if m.owns(c)] for c in configs}
+    # Only the monitors of the removed node move
+    assert all(after[k] == before[k] for k in before if before[k] != ["c"])
+    assert all(len(owners) == 1 for owners in after.values())
+    assert {tuple(owners) for owners in after.values()} == {("a",), ("b",)}
+
+
+def test_membership_replicas():
+    membership = sharding.Membership("", "a", replicas=2, members=("a", "b", "c"))
+    owned = [membership.owns(make_config(f"monitor-{i}")) for i in range(300)]
+    assert 150 < sum(owned) < 250
@@ -0,0 +1,154 @@
+import datetime
+import os
+
+import pytest
+
+from httpcheck import store
+
+DAY = store.DAY
+START = 1_700_000_000 - 1_700_000_000 % DAY
+
+
+def make_result(url, timestamp, is_online=True, response_time=0.1):
+    moment = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+    return {
+        "url": url,
+        "identifier": "eu",
+        "timestamp": moment.isoformat(),
+        "is_online": is_online,
+        "status_code": 200 if is_online else None,
+        "response_time": response_time if is_online else None,
+    }
+
+
+def test_append_and_query(tmp_path):
+    directory = str(tmp_path)
+    result_store = store.ResultStore(directory, retention=30 * DAY)
+    for minute in range(120):
+        now = START + 60 * minute
+        result_store.append(
+            [
+                make_result("http://one", now, response_time=minute / 100),
+                make_result("http://two", now, is_online=minute % 4 != 0),
+            ],
+            now=now,
+        )
+
+    # The first hour is sealed with an index, the second one is still active
+    result_store.wait_for_maintenance()
+    segments = store.list_segments(directory)
+    assert [s.is_sealed for s in segments] == [True, False]
+    assert os.path.getsize(segments[0].segment_path) == 60 * 2 * store.RECORD.size
+
+    one, two = store.query(directory, START, START + 2 * 3600)
+    assert one["url"] == "http://one" and one["identifier"] == "eu"
+    assert one["checks"] == 120 and one["uptime"] == 1
+    assert one["response_time_p50"] == pytest.approx(0.6)
+    assert two["checks"] == 120 and two["uptime"] == 0.75
+
+    # Half an hour from each segment
+    (one,) = store.query(directory, START + 1800, START + 5400, url="http://one")
+    assert one["checks"] == 60
+    assert store.query(directory, START, START + 3600, identifier="other") == []
+    result_store.close()
+
+    # Reopened, the store keeps numbering the same monitors
+    result_store = store.ResultStore(directory, retention=30 * DAY)
+    result_store.append([make_result("http://two", START + 7200)], now=START + 7200)
+    assert len(store.read_monitors(directory)) == 2
+    result_store.close()
+
+
+def test_compaction_and_retention(tmp_path):
+    directory = str(tmp_path)
+    result_store = store.ResultStore(directory, retention=3 * DAY)
+    for hour in range(3):
+        now = START + 3600 * hour
+        result_store.append([make_result("http://one", now)], now=now)
+
+    # The next day, the first day is compacted into one segment
+    now = START + DAY + 60
+    result_store.append([make_result("http://one", now)], now=now)
+    result_store.wait_for_maintenance()
+    segments = store.list_segments(directory)
+    assert [(s.start, s.end) for s in segments] == [
+        (START, START + DAY),
+        (START + DAY, START + DAY + 3600),
+    ]
+    (summary,) = store.query(directory, START, START + DAY)
+    assert summary["checks"] == 3
+
+    # Three days later, the first day is deleted
+    now = START + 4 * DAY
+    result_store.append([make_result("http://one", now)], now=now)
+    result_store.wait_for_maintenance()
+    segments = store.list_segments(directory)
+    assert segments[0].start == START + DAY
+    assert store.query(directory, START, START + DAY) == []
+    result_store.close()
+
+
+def test_compaction_merges_blocks(tmp_path, monkeypatch):
+    monkeypatch.setattr(store, "BLOCK_RECORDS", 2)
+    directory = str(tmp_path)
+    result_store = store.ResultStore(directory, retention=3 * DAY)
+    for minute in range(0, 180, 20):
+        now = START + 60 * minute
+        result_store.append(
+            [make_result(f"http://{name}", now) for name in ("one", "two", "three")],
+            now=now,
+        )
+    now = START + DAY
+    result_store.append([make_result("http://one", now)], now=now)
+    result_store.close()
+
+    day = store.list_segments(directory)[0]
+    assert (day.start, day.end) == (START, START + DAY)
+    records = day.read_records()
+    assert records == sorted(records, key=store.sort_key)
+    assert [(monitor, count) for monitor, _, count, *_ in day.read_index()] == [
+        (0, 9),
+        (1, 9),
+        (2, 9),
+    ]
+    summaries = store.query(directory, START, START + DAY)
+    assert [summary["checks"] for summary in summaries] == [9, 9, 9]
+
+
+def test_query_skips_covered_segments(tmp_path):
+    directory = str(tmp_path)
+    records = [(START + 60 * i, 0, 1, 200, 0.1) for i in range(3)]
+    with open(os.path.join(directory, store.MONITORS_FILENAME), "w") as f:
+        f.write('["http://one", "eu"]\n')
+    # Compacted, but the hourly segment is not deleted yet
+    store.Segment(directory, START, START + 3600).write(records)
+    store.Segment(directory, START, START + DAY).write(records)
+
+    (summary,) = store.query(directory, START, START + DAY)
+    assert summary["checks"] == 3
+
+
+def test_partial_record(tmp_path):
+    directory = str(tmp_path)
+    result_store = store.ResultStore(directory)
+    result_store.append([make_result("http://one", START)], now=START)
+    result_store.close()
+    (segment,) = store.list_segments(directory)
+    with open(segment.segment_path, "ab") as f:
+        f.write(b"\0\0\0")
+
+    result_store = store.ResultStore(directory, retention=30 * DAY)
+    result_store.append([make_result("http://one", START + 1)], now=START + 1)
+    result_store.close()
+    (summary,) = store.query(directory, START, START + 3600)
+    assert summary["checks"] == 2
+
+
+def test_parse_time():
+    assert store.parse_duration("90") == 90
+    assert store.parse_duration("30m") == 1800
+    assert store.parse_duration("7d") == 7 * DAY
+    assert store.parse_time("1h", now=START) == START - 3600
+    assert store.parse_time("2023-11-14T00:00:00+00:00") == 1_699_920_000
+    with pytest.raises(ValueError):
+        store.parse_time("yesterday")
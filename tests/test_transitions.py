@@ -0,0 +1,81 @@
+import pytest
+
+from httpcheck import main
+from httpcheck import transitions
+from httpcheck.common import WebsiteCheckResults
+from httpcheck.common import WebsiteMonitorConfig
+
+CONFIG = WebsiteMonitorConfig(url="http://example.com", key="example")
+
+
+def make_results(is_online=True, status_code=200, response_time=0.1, **kwargs):
+    results = WebsiteCheckResults.from_config(CONFIG)
+    results.is_online = is_online
+    results.status_code = status_code
+    results.response_time = response_time
+    for name, value in kwargs.items():
+        setattr(results, name, value)
+    return results
+
+
+def test_transitions():
+    tracker = transitions.TransitionTracker({"latency_bands": [1, 5]})
+    changes = [
+        tracker.record(CONFIG, results)
+        for results in [
+            make_results(),
+            make_results(response_time=0.2),
+            make_results(response_time=1.5),
+            make_results(response_time=1.2),
+            make_results(status_code=204, response_time=1.2),
+            make_results(status_code=204, response_time=1.3, regex_found=False),
+            make_results(False, None, None),
+            make_results(False, None, None),
+            make_results(),
+        ]
+    ]
+    assert changes == [True, False, True, False, True, True, True, False, True]
+
+
+def test_rollup(monkeypatch):
+    monkeypatch.setattr("httpcheck.common._hostname", "checker")
+    tracker = transitions.TransitionTracker()
+    for results in [make_results(), make_results(False, 503, 0.3), make_results()]:
+        tracker.record(CONFIG, results)
+    tracker.record(CONFIG, make_results(False, None, None))
+
+    (rollup,) = tracker.rollup()
+    assert rollup["record"] == "rollup"
+    assert rollup["hostname"] == "checker"
+    assert (rollup["key"], rollup["url"]) == ("example", "http://example.com")
+    assert (rollup["is_online"], rollup["status_code"]) == (False, None)
+    assert (rollup["checks"], rollup["online"], rollup["transitions"]) == (4, 2, 4)
+    assert rollup["response_time_min"] == 0.1
+    assert rollup["response_time_avg"] == pytest.approx(0.5 / 3)
+    assert rollup["response_time_max"] == 0.3
+
+    (rollup,) = tracker.rollup()
+    assert (rollup["checks"], rollup["transitions"]) == (0, 0)
+    assert rollup["response_time_avg"] is None
+
+    tracker.forget(CONFIG)
+    assert tracker.rollup() == []
+    assert tracker.record(CONFIG, make_results(False, None, None))
+
+
+class RecordingPublisher:
+    def __init__(self):
+        self.results = []
+
+    async def submit_results(self, results):
+        self.results.append(results)
+
+
+@pytest.mark.asyncio
+async def test_check_and_publish_transitions(httpx_mock):
+    httpx_mock.add_response(status_code=200)
+    publisher = RecordingPublisher()
+    tracker = transitions.TransitionTracker()
+    for _ in range(3):
+        await main.check_and_publish(CONFIG, publisher, tracker=tracker)
+    assert len(publisher.results) == 1
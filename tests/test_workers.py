@@ -0,0 +1,112 @@
+import asyncio
+import json
+import os
+import signal
+import time
+
+import pytest
+
+from httpcheck import sharding
+from httpcheck import workers
+from httpcheck.common import WebsiteMonitorConfig
+
+
+def test_worker_limits_are_shared():
+    kwargs = workers.get_worker_kwargs(
+        3,
+        {
+            "limiter_config": {"max_in_flight": 500, "max_per_host": 10},
+            "scheduler_config": {"stagger": "none"},
+        },
+    )
+    assert kwargs["limiter_config"] == {"max_in_flight": 167, "max_per_host": 4}
+    assert kwargs["scheduler_config"]["stagger"] == "hash"
+
+
+def test_worker_spill_files():
+    supervisor = workers.Supervisor(
+        worker_count=2,
+        publisher=None,
+        worker_kwargs={},
+        worker_publisher_config={"backend": "console", "spill_filename": "spill"},
+        once=False,
+    )
+    assert supervisor.get_worker_publisher_config(1)["spill_filename"] == (
+        "spill.worker1"
+    )
+    assert supervisor.worker_publisher_config["spill_filename"] == "spill"
+
+
+class RelayedResults:
+    """ Records the URLs of the results relayed by the supervisor. """
+
+    def __init__(self):
+        self.urls = []
+
+    async def astart(self):
+        pass
+
+    async def submit_encoded(self, msg):
+        self.urls.append(json.loads(msg)["url"])
+
+    async def aclose(self):
+        pass
+
+
+async def wait_until(condition, timeout=30):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Timed out"
+        await asyncio.sleep(0.1)
+
+
+@pytest.mark.enable_socket
+@pytest.mark.asyncio
+async def test_supervisor():
+    async def respond(reader, writer):
+        await reader.readuntil(b"\r\n\r\n")
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n")
+        await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(respond, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    configs = {
+        url: WebsiteMonitorConfig(url, frequency=0.5, retries=0)
+        for url in (f"http://127.0.0.1:{port}/{i}" for i in range(8))
+    }
+    first_shard = sharding.Shard(0, 2, salt="worker:")
+    first_urls = {url for url, config in configs.items() if first_shard.owns(config)}
+    assert 0 < len(first_urls) < len(configs)
+
+    publisher = RelayedResults()
+    supervisor = workers.Supervisor(
+        worker_count=2,
+        publisher=publisher,
+        worker_kwargs=workers.get_worker_kwargs(
+            2, {"monitor_configs": configs, "websites_filename": None}
+        ),
+        worker_publisher_config={"backend": "console"},
+        once=False,
+    )
+    running = asyncio.ensure_future(supervisor.run())
+    try:
+        # Both workers relay the results of their monitors
+        await wait_until(lambda: set(publisher.urls) == set(configs))
+        # Workers reload on SIGHUP rather than exit
+        supervisor.forward_signal(signal.SIGHUP)
+
+        crashed = supervisor.processes[0]
+        os.kill(crashed.pid, signal.SIGKILL)
+        await wait_until(lambda: supervisor.processes[0] is not crashed)
+        relayed = len(publisher.urls)
+        await wait_until(lambda: first_urls & set(publisher.urls[relayed:]))
+        assert supervisor.processes[0].is_alive()
+        assert supervisor.processes[1].is_alive()
+    finally:
+        supervisor.stop()
+        await running
+        server.close()
+        await server.wait_closed()
+
+    assert not any(process.is_alive() for process in supervisor.processes.values())